@@ -0,0 +1,113 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Clocks read once per tick of an event loop, real or virtual. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# A Clock is called for the current time like time.time, but gives the
+# time sampled at the start of the current tick of the event loop
+# driving it: every TTL, deadline and backoff worked out while handling
+# one event then agrees, and reading the time costs no system call.
+# The loop calls tick() once per iteration, and waits for events with
+# wait(), which ticks once the wait is over.
+#
+# A VirtualClock gives a time that only moves when it is advanced, or
+# when a wait() ends without an event, in which case the whole timeout
+# passes at once.  Replies are then instantaneous and timeouts free, so
+# that expiry, backoff and retries happen in the same order on every
+# run, and hours of them take seconds.
+
+import time
+
+# Most real seconds a VirtualClock waits for an event.
+VIRTUAL_POLL = 0.05
+
+class Clock:
+  """
+  The real time, sampled once per tick.
+
+  Member variables:
+
+  _source -- the function returning the current time in seconds.
+
+  _now -- the time sampled at the last tick.
+  """
+
+  def __init__(self, source = time.time):
+    self._source = source
+    self._now = source()
+
+  def __call__(self):
+    return self._now
+
+  def tick(self):
+    """ Samples the time anew, and returns it. """
+    self._now = self._source()
+    return self._now
+
+  def wait(self, poll, timeout):
+    """ Returns poll(timeout), which waits up to timeout seconds for an
+    event and returns None if none came, and ticks. """
+    try:
+      return poll(timeout)
+    finally:
+      self.tick()
+
+  def sleep(self, seconds):
+    time.sleep(seconds)
+    self.tick()
+
+class VirtualClock(Clock):
+  """
+  A time that moves only when advanced, or when a wait times out.
+
+  Member variables:
+
+  _poll -- the most real seconds wait() waits for an event; if none
+  comes by then, the time waited for passes at once.  Events that take
+  longer in real time look like timeouts.
+  """
+
+  def __init__(self, start = 0.0, poll = VIRTUAL_POLL):
+    self._now = float(start)
+    self._poll = poll
+
+  def tick(self):
+    return self._now
+
+  def advance(self, seconds):
+    """ Moves the time seconds ahead. """
+    self._now += max(seconds, 0)
+    return self._now
+
+  def advanceTo(self, when):
+    """ Moves the time to when, unless it is past that already. """
+    self._now = max(self._now, when)
+    return self._now
+
+  def wait(self, poll, timeout):
+    result = poll(min(timeout, self._poll))
+    if result is None:
+      self.advance(timeout)
+    return result
+
+  def sleep(self, seconds):
+    self.advance(seconds)
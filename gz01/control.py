@@ -0,0 +1,388 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Commands to look into and change a running server's cache. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# A server given a control path takes commands on it, as a Unix
+# socket, one per line, from any number of clients at once:
+#
+#   lookup NAME            the RRs cached of NAME, with the TTLs left
+#   flush NAME             forget everything cached of NAME
+#   flushzone NAME         forget everything cached of NAME and the
+#                          names below it
+#   preload NAME[/TYPE]... resolve the names in the background, so that
+#                          their answers are cached (type A by default)
+#   dump                   every RR cached, with the TTLs left, and
+#                          close the connection
+#   stats                  the number of entries and preloads
+#
+# RRs are written as in a master file; answers that a name or type
+# does not exist are written as comments.  Every reply ends with a line
+# "OK ..." or "ERROR ...".
+#
+# The server's loop calls step() between queries.  flushzone goes
+# through CHUNK cache entries per step, and stops while its client's
+# reply is not being read; only copying the keys of each cache first
+# holds up queries, for some 30ms per million entries.  dump is written
+# by a child process, from its copy of the cache as it was when the
+# command came, so that it holds up nothing however big the cache.
+
+import errno, logging, os, signal
+from collections import deque
+from select import select, error as select_error
+from socket import socket, inet_aton, error, AF_UNIX, SOCK_STREAM
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import RR, RR_A, RR_NS, RR_CNAME
+from gz01.inetlib.types import DomainName
+from gz01.resolver import isSubdomainKey, renamed
+
+_log = logging.getLogger(__name__)
+
+# Cache entries gone through per step by dump and flushzone.
+CHUNK = 500
+
+# Commands run per client per step.
+MAX_COMMANDS = 100
+
+# Bytes of reply kept for a client before its command is paused.
+MAX_OUTPUT = 1 << 16
+
+# Longest command line.
+MAX_LINE = 1 << 16
+
+# Seconds a dump waits for its client to read more.
+DUMP_TIMEOUT = 60.0
+
+# Names waiting to be preloaded at most, and resolved at once.
+MAX_PRELOADS = 100000
+PRELOAD_CONCURRENCY = 10
+
+TYPE_NAMES = dict([(getattr(RR, n), n[5:]) for n in dir(RR)
+                   if n.startswith("TYPE_") and getattr(RR, n) > 0])
+
+def type_name(qtype):
+  return TYPE_NAMES.get(qtype, "TYPE%d" % (qtype,))
+
+def parse_type(s):
+  """ Returns the type named s, e.g. "MX" or "TYPE99". """
+  s = s.upper()
+  for (qtype, name) in TYPE_NAMES.items():
+    if name == s:
+      return qtype
+  if s.startswith("TYPE") and s[4:].isdigit():
+    return int(s[4:])
+  raise ValueError("unknown type %s" % (s,))
+
+def parse_name(s):
+  return DomainName(s if s.endswith(".") else s + ".")
+
+def entry_lines(label, key, entry, now):
+  """ Returns lines describing the entry under key in the cache label,
+  with the TTLs left at time now; none if it has expired, or holds the
+  health of a server. """
+  if label == 'infra':
+    return []
+  dn = DomainName.fromKey(key[0] if isinstance(key, tuple) else key)
+  if label == 'a':
+    rrs = [RR_A(dn, e._expiration - now, inet_aton(ip))
+           for (ip, e) in entry._dict.items() if e._expiration >= now]
+  elif label == 'ns':
+    rrs = [RR_NS(dn, e._expiration - now, nsdn)
+           for (nsdn, e) in entry.items() if e._expiration >= now]
+  elif entry._expiration < now:
+    return []
+  elif label == 'cname':
+    rrs = [RR_CNAME(dn, entry._expiration - now, entry._cname)]
+  elif label == 'rrset':
+    rrs = renamed(entry._rrs, dn, entry._expiration - now)
+  else:
+    return ["; %-28s\t%d\t%s\t%s" % (str(dn), entry._expiration - now,
+            type_name(key[1]), Header.RCODE_NAMES.get(entry._rcode,
+                                                      entry._rcode))]
+  return [str(rr) for rr in rrs]
+
+class _Client:
+  """ A connection to the control socket, and the command it is
+  running, if any. """
+
+  def __init__(self, sock):
+    self.sock = sock
+    self.sock.setblocking(0)
+    self.input = ""
+    self.output = ""
+    self.job = None
+
+  def fileno(self):
+    return self.sock.fileno()
+
+  def line(self):
+    """ Returns the next command line received, or None. """
+    (line, sep, rest) = self.input.partition("\n")
+    if not sep:
+      return None
+    self.input = rest
+    return line.strip()
+
+class ControlServer:
+  """
+  Takes commands on a Unix socket.
+
+  Member variables:
+
+  _clients -- the _Clients connected.
+
+  _preloads -- the QEs waiting to be preloaded, oldest first.
+
+  _preloading -- the Resolutions of those being preloaded.
+
+  _dumps -- the process IDs of the children writing dumps.
+  """
+
+  def __init__(self, path, resolver, clock):
+    try:
+      os.unlink(path)
+    except OSError:
+      pass
+    self._sock = socket(AF_UNIX, SOCK_STREAM)
+    # Anyone who can connect can flush the cache, so the socket is
+    # created accessible to the server's user only.
+    umask = os.umask(0177)
+    try:
+      self._sock.bind(path)
+    finally:
+      os.umask(umask)
+    self._sock.listen(5)
+    self._sock.setblocking(0)
+    self._resolver = resolver
+    self._cache = resolver.cache
+    self._clock = clock
+    self._clients = []
+    self._preloads = deque()
+    self._preloading = []
+    self._dumps = []
+
+  def fileno(self):
+    return self._sock.fileno()
+
+  def readers(self):
+    """ The sockets to wait on to read from. """
+    return [self] + self._clients
+
+  def writers(self):
+    """ The sockets to wait on to write to. """
+    return [c for c in self._clients if c.output]
+
+  def busy(self):
+    """ Returns whether step() has work to do without waiting. """
+    for c in self._clients:
+      if len(c.output) < MAX_OUTPUT and \
+         (c.job is not None or "\n" in c.input):
+        return True
+    return bool(self._preloads) and \
+           len(self._preloading) < PRELOAD_CONCURRENCY
+
+  def step(self):
+    """ Takes in new clients and commands, and carries on with the
+    commands and preloads under way, without waiting. """
+    try:
+      (rds, wds, xds) = select(self.readers(), [], [], 0)
+    except select_error:
+      rds = []
+    if self in rds:
+      self._accept()
+    for c in rds:
+      if c is not self:
+        self._read(c)
+    for c in list(self._clients):
+      self._run(c)
+      if c in self._clients and c.output:
+        self._write(c)
+    self._preload()
+    for pid in list(self._dumps):
+      if os.waitpid(pid, os.WNOHANG)[0]:
+        self._dumps.remove(pid)
+
+  def _accept(self):
+    try:
+      (sock, address) = self._sock.accept()
+    except error:
+      return
+    self._clients.append(_Client(sock))
+
+  def _close(self, c):
+    c.sock.close()
+    self._clients.remove(c)
+
+  def _read(self, c):
+    try:
+      data = c.sock.recv(4096)
+    except error, e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      data = ""
+    if not data:
+      self._close(c)
+      return
+    c.input += data
+    if len(c.input) > MAX_LINE and "\n" not in c.input:
+      self._close(c)
+
+  def _write(self, c):
+    try:
+      sent = c.sock.send(c.output)
+    except error, e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+        return
+      self._close(c)
+      return
+    c.output = c.output[sent:]
+
+  def _run(self, c):
+    """ Runs c's commands until one has gone through a chunk of the
+    cache, MAX_COMMANDS have run or its reply is not being read. """
+    commands = 0
+    while len(c.output) < MAX_OUTPUT and commands < MAX_COMMANDS:
+      if c.job is not None:
+        try:
+          c.output += c.job.next()
+        except StopIteration:
+          c.job = None
+          continue
+        break
+      line = c.line()
+      if line is None:
+        break
+      commands += 1
+      try:
+        reply = self._command(c, line)
+      except ValueError, e:
+        reply = "ERROR %s\n" % (e,)
+      if reply is None:
+        return # handed to a child
+      if isinstance(reply, str):
+        c.output += reply
+      else:
+        c.job = reply
+
+  def _command(self, c, line):
+    """ Returns the reply to the command line from client c, a
+    generator of the parts of a long one, or None if a child process
+    has taken c over. """
+    args = line.split()
+    if not args:
+      raise ValueError("no command")
+    (command, args) = (args[0].lower(), args[1:])
+    if command in ('lookup', 'flush', 'flushzone') and len(args) != 1:
+      raise ValueError("usage: %s NAME" % (command,))
+    if command == 'lookup':
+      return self._lookup(parse_name(args[0]))
+    elif command == 'flush':
+      n = self._cache.remove(parse_name(args[0]), nameServers=True)
+      _log.info("control: flushed %d entries of %s", n, args[0])
+      return "OK %d removed\n" % (n,)
+    elif command == 'flushzone':
+      return self._flushZone(parse_name(args[0]))
+    elif command == 'preload':
+      return self._queuePreloads(args)
+    elif command == 'dump':
+      self._dump(c)
+      return None
+    elif command == 'stats':
+      return "entries %d\npreloads %d queued, %d resolving\nOK\n" % \
+             (len(self._cache), len(self._preloads), len(self._preloading))
+    raise ValueError("unknown command %s" % (command,))
+
+  def _lookup(self, dn):
+    now = int(self._clock())
+    lines = []
+    for (label, key, entry) in self._cache.cached(dn):
+      lines.extend(entry_lines(label, key, entry, now))
+    return "".join([l + "\n" for l in lines]) + "OK %d\n" % (len(lines),)
+
+  def _flushZone(self, zone):
+    n = 0
+    gone = 0
+    for (label, key, entry) in self._cache.entries():
+      k = key[0] if isinstance(key, tuple) else key
+      if label != 'infra' and (k == zone._key or isSubdomainKey(k, zone._key)):
+        if self._cache.removeKey(label, key):
+          n += 1
+      gone += 1
+      if gone % CHUNK == 0:
+        yield ""
+    _log.info("control: flushed %d entries at or below %s", n, zone)
+    yield "OK %d removed\n" % (n,)
+
+  def _dump(self, c):
+    """ Writes every RR cached to client c, after the replies it has
+    not read yet, and closes its connection, from a child process. """
+    try:
+      pid = os.fork()
+    except OSError, e:
+      c.output += "ERROR cannot dump: %s\n" % (e,)
+      return
+    if pid != 0:
+      self._dumps.append(pid)
+      self._close(c)
+      return
+    # The child must not run the server's handlers, which wait on
+    # threads it does not have.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+      c.sock.settimeout(DUMP_TIMEOUT)
+      now = int(self._clock())
+      lines = [c.output]
+      n = 0
+      for (label, key, entry) in self._cache.entries():
+        lines.extend([l + "\n" for l in entry_lines(label, key, entry, now)])
+        n += 1
+        if n % CHUNK == 0:
+          c.sock.sendall("".join(lines))
+          lines = []
+      lines.append("OK %d entries\n" % (n,))
+      c.sock.sendall("".join(lines))
+    finally:
+      os._exit(0)
+
+  def _queuePreloads(self, args):
+    questions = []
+    for arg in args:
+      (name, sep, qtype) = arg.partition("/")
+      question = QE(type=parse_type(qtype) if sep else RR.TYPE_A,
+                    dn=parse_name(name))
+      questions.append(question)
+    if len(self._preloads) + len(questions) > MAX_PRELOADS:
+      raise ValueError("too many names waiting to be preloaded")
+    self._preloads.extend(questions)
+    return "OK %d queued\n" % (len(questions),)
+
+  def _preload(self):
+    """ Starts resolving the next names to preload, if fewer than
+    PRELOAD_CONCURRENCY are being resolved. """
+    if self._preloading:
+      self._preloading = [r for r in self._preloading if r.result is None]
+    while self._preloads and len(self._preloading) < PRELOAD_CONCURRENCY:
+      r = self._resolver.prefetch(self._preloads.popleft())
+      if r is not None:
+        self._preloading.append(r)
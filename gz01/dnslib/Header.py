@@ -38,7 +38,7 @@ class Header:
 
   _rcode -- the 4-bit DNS response code, one of { Header.RCODE_NOERR,
     Header.RCODE_FORMATERR, Header.RCODE_SERVFAIL,
-    Header.RCODE_NAMEERR, Header.RCODE_NIMPL }.
+    Header.RCODE_NAMEERR, Header.RCODE_NIMPL, Header.RCODE_REFUSED }.
 
   _qdcount -- number of question entries indicated in the Header
 
@@ -73,6 +73,11 @@ class Header:
   RCODE_SRVFAIL = 2
   RCODE_NAMEERR = 3
   RCODE_NIMPL = 4
+  RCODE_REFUSED = 5
+
+  RCODE_NAMES = { RCODE_NOERR: "NOERROR", RCODE_FORMATERR: "FORMATERR",
+                  RCODE_SRVFAIL: "SRVFAIL", RCODE_NAMEERR: "NAMEERR",
+                  RCODE_NIMPL: "NIMPL", RCODE_REFUSED: "REFUSED" }
 
   OPCODE_QUERY = 0
   OPCODE_IQUERY = 1
@@ -102,7 +107,7 @@ class Header:
 
     rcode -- the 4-bit DNS response code, one of { Header.RCODE_NOERR,
       Header.RCODE_FORMATERR, Header.RCODE_SERVFAIL,
-      Header.RCODE_NAMEERR, Header.RCODE_NIMPL }.
+      Header.RCODE_NAMEERR, Header.RCODE_NIMPL, Header.RCODE_REFUSED }.
 
     Keyword arguments:
     qdcount -- number of question entries indicated in the Header
@@ -188,6 +193,8 @@ class Header:
       d['status'] = "NAMEERR"
     elif self._rcode == Header.RCODE_NIMPL:
       d['status'] = "NIMPL"
+    elif self._rcode == Header.RCODE_REFUSED:
+      d['status'] = "REFUSED"
 
     d['id'] = self._id
 
@@ -38,7 +38,11 @@ class QE:
   asking.  Possible values: { QE.TYPE_A (address query), QE.TYPE_NS
   (NS query), QE.TYPE_CNAME (CNAME query), QE.TYPE_SOA (start of
   authority query), QE.TYPE_PTR (DNS PTR query), QE.TYPE_MX (mail
-  exchange query) }.
+  exchange query), QE.TYPE_TXT (text query), QE.TYPE_AAAA (IPv6
+  address query) }, or the number of another type.
+
+  _class -- the class asked about, QE.CLASS_IN unless read from data
+  of another class.
   """
   
   # values of the _type field
@@ -48,6 +52,8 @@ class QE:
   TYPE_SOA = 6
   TYPE_PTR = 12
   TYPE_MX = 15
+  TYPE_TXT = 16
+  TYPE_AAAA = 28
 
   CLASS_IN = 1
 
@@ -56,15 +62,17 @@ class QE:
     gz01.inetlib.DomainName) """
     self._type = type
     self._dn = dn
+    self._class = QE.CLASS_IN
 
   def pack(self):
     """ Return a binary-packed string rep. """
-    l = [self._dn.pack(), struct.pack(">2H", self._type, QE.CLASS_IN)]
+    l = [self._dn.pack(), struct.pack(">2H", self._type, self._class)]
     return "".join(l)
 
   def __copy__(self):
     """ Return a copy of this QE, recursively copying its members. """
     res = QE(self._type, copy(self._dn))
+    res._class = self._class
     return res
 
   def __str__(self):
@@ -74,8 +82,18 @@ class QE:
       return "%-30s\tIN\tNS" % (str(self._dn),)
     elif self._type == QE.TYPE_CNAME:
       return "%-30s\tIN\tCNAME" % (str(self._dn),)
+    elif self._type == QE.TYPE_SOA:
+      return "%-30s\tIN\tSOA" % (str(self._dn),)
+    elif self._type == QE.TYPE_PTR:
+      return "%-30s\tIN\tPTR" % (str(self._dn),)
+    elif self._type == QE.TYPE_MX:
+      return "%-30s\tIN\tMX" % (str(self._dn),)
+    elif self._type == QE.TYPE_TXT:
+      return "%-30s\tIN\tTXT" % (str(self._dn),)
+    elif self._type == QE.TYPE_AAAA:
+      return "%-30s\tIN\tAAAA" % (str(self._dn),)
     else:
-      return "NIMPL"
+      return "%-30s\tIN\tTYPE%d" % (str(self._dn), self._type,)
 
   def __len__(self):
     # returns the length of the RFC 1035-compliant packed rep
@@ -26,8 +26,11 @@ from copy import copy
 from gz01.inetlib.types import DomainName
 from gz01.util import *
 from socket import inet_ntoa, inet_ntop, inet_aton, AF_INET6
+import logging
 import struct
 
+_log = logging.getLogger(__name__)
+
 class RR:
   """ 
   Representation common to all DNS resource records.
@@ -43,11 +46,11 @@ class RR:
   (DNS A record), RR.TYPE_NS (DNS NS record), RR.TYPE_CNAME (DNS CNAME
   record), RR.TYPE_SOA (DNS start-of-authority record), RR.TYPE_PTR
   (DNS PTR record), RR.TYPE_MX (DNS mail exchange record),
-  RR.TYPE_AAAA (DNS IPv6 address record).
+  RR.TYPE_TXT (DNS text record), RR.TYPE_AAAA (DNS IPv6 address
+  record), or the number of another type (see RR_UNKNOWN).
 
-  _class - the DNS class type of this resource record.  Always
-  RR.CLASS_IN for Internet in this implementation (other classes do
-  exist in general).
+  _class - the DNS class type of this resource record: RR.CLASS_IN
+  for Internet, unless read from data of another class.
 
   """
   TYPE_A = 1
@@ -56,6 +59,7 @@ class RR:
   TYPE_SOA = 6
   TYPE_PTR = 12
   TYPE_MX = 15
+  TYPE_TXT = 16
   TYPE_AAAA = 28 # RFC 3596 IPv6 address
 
   TYPE_UNKNOWN = -1
@@ -100,10 +104,18 @@ class RR:
       return "%-30s\t%d\tIN\tCNAME" % (str(self._dn), self._ttl,)
     elif self._type == RR.TYPE_SOA:
       return "%-30s\t%d\tIN\tSOA" % (str(self._dn), self._ttl,)
+    elif self._type == RR.TYPE_PTR:
+      return "%-30s\t%d\tIN\tPTR" % (str(self._dn), self._ttl,)
+    elif self._type == RR.TYPE_MX:
+      return "%-30s\t%d\tIN\tMX" % (str(self._dn), self._ttl,)
+    elif self._type == RR.TYPE_TXT:
+      return "%-30s\t%d\tIN\tTXT" % (str(self._dn), self._ttl,)
     elif self._type == RR.TYPE_AAAA:
       return "%-30s\t%d\tIN\tAAAA" % (str(self._dn), self._ttl,)
     elif self._type == RR.TYPE_UNKNOWN:
       return "%-30s\t%d\tIN\t???" % (str(self._dn), self._ttl,)
+    else:
+      return "%-30s\t%d\tIN\tTYPE%d" % (str(self._dn), self._ttl, self._type,)
 
   def __len__(self):
     """ Return the length of this RR. """
@@ -119,33 +131,50 @@ class RR:
     dn = DomainName.fromData(data, offset)
     (type, cls, ttl, rdlength) = struct.unpack_from(">2HlH", data, 
                                                     offset + len(dn))
-    logger.log(DEBUG2, "RR.fromData: offset=%s; dn=%s; len(dn)=%d,\
-               type=%d, cls=%d, ttl=%d, rdlength=%d" % \
-               (hex(offset), dn, len(dn), type, cls, ttl, rdlength,))
+    if _log.isEnabledFor(DEBUG2):
+      _log.log(DEBUG2, "RR.fromData: offset=%#x; dn=%s; len(dn)=%d, "
+               "type=%d, cls=%d, ttl=%d, rdlength=%d",
+               offset, dn, len(dn), type, cls, ttl, rdlength)
+    rdata = offset + len(dn) + 10
     if type == RR.TYPE_A:
-      (inaddr,) = struct.unpack_from(">4s", data, offset + len(dn) + 10)
-      return (RR_A(copy(dn), ttl, inaddr), len(dn) + 10 + rdlength)
+      (inaddr,) = struct.unpack_from(">4s", data, rdata)
+      rr = RR_A(copy(dn), ttl, inaddr)
     elif type == RR.TYPE_NS:
-      nsdn = DomainName.fromData(data, offset + len(dn) + 10)
-      return (RR_NS(copy(dn), ttl, copy(nsdn)), len(dn) + 10 + rdlength)
+      nsdn = DomainName.fromData(data, rdata)
+      rr = RR_NS(copy(dn), ttl, copy(nsdn))
     elif type == RR.TYPE_CNAME:
-      cname = DomainName.fromData(data, offset + len(dn) + 10)
-      return (RR_CNAME(copy(dn), ttl, copy(cname)), len(dn) + 10 + rdlength)
+      cname = DomainName.fromData(data, rdata)
+      rr = RR_CNAME(copy(dn), ttl, copy(cname))
     elif type == RR.TYPE_SOA:
-      mname = DomainName.fromData(data, offset + len(dn) + 10)
-      rname = DomainName.fromData(data, offset + len(dn) + 10 + len(mname))
+      mname = DomainName.fromData(data, rdata)
+      rname = DomainName.fromData(data, rdata + len(mname))
       (serial, refresh, retry, expire, minimum,) = \
-        struct.unpack_from(">5L", data, 
-                           offset + len(dn) + 10 + len(mname) + len(rname))
-      soa = RR_SOA(copy(dn), ttl, copy(mname), copy(rname), serial, refresh, retry,
-                   expire, minimum)
-      return (soa, len(RR_SOA(dn, ttl, mname, rname, serial, refresh,
-                              retry, expire, minimum)))
+        struct.unpack_from(">5L", data, rdata + len(mname) + len(rname))
+      rr = RR_SOA(copy(dn), ttl, copy(mname), copy(rname), serial, refresh,
+                  retry, expire, minimum)
     elif type == RR.TYPE_AAAA:
-      (inaddr,) = struct.unpack_from(">16s", data, offset + len(dn) + 10)
-      return (RR_AAAA(copy(dn), ttl, inaddr), len(dn) + 10 + rdlength)
+      (inaddr,) = struct.unpack_from(">16s", data, rdata)
+      rr = RR_AAAA(copy(dn), ttl, inaddr)
+    elif type == RR.TYPE_MX:
+      (preference,) = struct.unpack_from(">H", data, rdata)
+      exchange = DomainName.fromData(data, rdata + 2)
+      rr = RR_MX(copy(dn), ttl, preference, copy(exchange))
+    elif type == RR.TYPE_PTR:
+      ptrdn = DomainName.fromData(data, rdata)
+      rr = RR_PTR(copy(dn), ttl, copy(ptrdn))
+    elif type == RR.TYPE_TXT:
+      strings = []
+      i = rdata
+      while i < rdata + rdlength:
+        n = ord(data[i])
+        strings.append(data[i + 1:i + 1 + n])
+        i += 1 + n
+      rr = RR_TXT(copy(dn), ttl, strings)
     else:
-      return (RR(copy(dn), ttl, rdlength), len(dn) + 10 + rdlength)
+      rr = RR_UNKNOWN(copy(dn), ttl, type, data[rdata:rdata + rdlength])
+    if cls != RR.CLASS_IN:
+      rr._class = cls
+    return (rr, len(dn) + 10 + rdlength)
 
 class RR_A(RR):
   """ 
@@ -316,3 +345,117 @@ class RR_AAAA(RR):
     """ Reutrn a packed-binary rep. """
     s = "".join([RR.pack(self), self._inaddr])
     return s
+
+  def __repr__(self):
+    return "(%s, %d, IN, AAAA, %s)" % (str(self._dn), self._ttl,
+                                       inet_ntop(AF_INET6, self._inaddr),)
+
+class RR_PTR(RR):
+  """
+  Representation of a DNS RR of type PTR (domain name pointer).
+
+  Member variables:
+
+  _ptrdn -- the DomainName that this RR_PTR record points to.
+  """
+
+  def __init__(self, dn, ttl, ptrdn):
+    RR.__init__(self, dn, ttl, len(ptrdn.pack()))
+    self._type = RR.TYPE_PTR
+    self._ptrdn = ptrdn
+
+  def pack(self):
+    """ Return a packed-binary rep. """
+    return "".join([RR.pack(self), self._ptrdn.pack()])
+
+  def __str__(self):
+    return "%s\t%s" % (RR.__str__(self), str(self._ptrdn),)
+
+  def __repr__(self):
+    return "(%s, %d, IN, PTR, %s)" % (str(self._dn), self._ttl,
+                                      str(self._ptrdn),)
+
+class RR_MX(RR):
+  """
+  Representation of a DNS RR of type MX (mail exchange).
+
+  Member variables:
+
+  _preference -- a 16-bit integer; exchanges with lower values are
+  preferred.
+
+  _exchange -- the DomainName of the mail exchange.
+  """
+
+  def __init__(self, dn, ttl, preference, exchange):
+    RR.__init__(self, dn, ttl, 2 + len(exchange.pack()))
+    self._type = RR.TYPE_MX
+    self._preference = preference
+    self._exchange = exchange
+
+  def pack(self):
+    """ Return a packed-binary rep. """
+    return "".join([RR.pack(self), struct.pack(">H", self._preference),
+                    self._exchange.pack()])
+
+  def __str__(self):
+    return "%s\t%d\t%s" % (RR.__str__(self), self._preference,
+                            str(self._exchange),)
+
+  def __repr__(self):
+    return "(%s, %d, IN, MX, %d, %s)" % (str(self._dn), self._ttl,
+                                         self._preference, str(self._exchange),)
+
+class RR_TXT(RR):
+  """
+  Representation of a DNS RR of type TXT.
+
+  Member variables:
+
+  _strings -- the list of character strings (each at most 255 bytes)
+  of the record.
+  """
+
+  def __init__(self, dn, ttl, strings):
+    RR.__init__(self, dn, ttl, sum([1 + len(t) for t in strings]))
+    self._type = RR.TYPE_TXT
+    self._strings = strings
+
+  def pack(self):
+    """ Return a packed-binary rep. """
+    l = [RR.pack(self)]
+    for t in self._strings:
+      l.append(chr(len(t)))
+      l.append(t)
+    return "".join(l)
+
+  def __str__(self):
+    return "%s\t%s" % (RR.__str__(self),
+                       " ".join(['"%s"' % (t,) for t in self._strings]),)
+
+  def __repr__(self):
+    return "(%s, %d, IN, TXT, %r)" % (str(self._dn), self._ttl, self._strings,)
+
+class RR_UNKNOWN(RR):
+  """
+  A RR of a type not represented by a class of its own, with its
+  RDATA kept as it came (RFC 3597), so that it can be cached and sent
+  on.
+
+  Member variables:
+
+  _rdata -- the packed RDATA.
+  """
+
+  def __init__(self, dn, ttl, type, rdata):
+    RR.__init__(self, dn, ttl, len(rdata))
+    self._type = type
+    self._rdata = rdata
+
+  def pack(self):
+    """ Return a packed-binary rep. """
+    return "".join([RR.pack(self), self._rdata])
+
+  def __repr__(self):
+    return "(%s, %d, IN, TYPE%d, %d bytes)" % (str(self._dn), self._ttl,
+                                               self._type, len(self._rdata),)
@@ -0,0 +1,496 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" A pool of upstream recursive resolvers to forward queries to. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# A query is sent over UDP to an upstream picked at random with weight
+# inversely proportional to its smoothed RTT.  If no reply has come
+# after the hedge delay (a multiple of that RTT, unless fixed), the
+# query is also sent to another upstream, and so on; the first valid
+# reply wins.  A truncated reply is retried over a new TCP connection
+# to the same upstream, which is selected on like the UDP sockets, so
+# that nothing waits on it.  Queries under way at once share the pool's
+# UDP socket of each address family, and are told apart by their IDs.
+#
+# Upstreams that time out MAX_FAILURES times in a row are marked down
+# and skipped, and a background thread probes them until they answer
+# again.
+
+import errno, logging, os, random, struct, threading, time
+from select import select, error as select_error
+from socket import socket, inet_pton, inet_ntop, AF_INET, AF_INET6, \
+  SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, SO_ERROR, error
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import RR
+from gz01.inetlib.types import DomainName
+
+_log = logging.getLogger(__name__)
+
+MAX_FAILURES = 3
+
+# Bounds of the hedge delay, in seconds, and its multiple of the
+# smoothed RTT of the upstream first asked.
+HEDGE_MIN = 0.01
+HEDGE_MAX = 1.0
+HEDGE_RTT_FACTOR = 3.0
+HEDGE_INITIAL = 0.2 # before the upstream's RTT is known
+
+# Seconds between probes of an upstream that is down.
+PROBE_INTERVAL = 2.0
+
+def parse_upstream(spec, port = 53):
+  """ Returns (address, port) for the string "ADDR", "ADDR:PORT",
+  "[ADDR]" or "[ADDR]:PORT"; an IPv6 ADDR with a port must be in
+  brackets.  Raises ValueError if it is none of these. """
+  if spec.startswith("["):
+    (addr, sep, rest) = spec[1:].partition("]")
+    if not sep or (rest and not rest.startswith(":")):
+      raise ValueError("bad address %r" % (spec,))
+    p = rest[1:]
+    sep = rest[:1]
+  elif spec.count(":") > 1:
+    (addr, sep, p) = (spec, "", "")
+  else:
+    (addr, sep, p) = spec.partition(":")
+  family = AF_INET6 if ":" in addr else AF_INET
+  try:
+    addr = inet_ntop(family, inet_pton(family, addr))
+  except error:
+    raise ValueError("bad address %r" % (spec,))
+  return (addr, int(p) if sep else port)
+
+def address_family(address):
+  """ Returns the family of the (address, port) address. """
+  return AF_INET6 if ":" in address[0] else AF_INET
+
+def reply_matches(packet, data):
+  """ Returns whether data is the reply to the query packet: same ID
+  and question. """
+  return data[:2] == packet[:2] and \
+         data[12:len(packet)].lower() == packet[12:].lower()
+
+class Upstream:
+  """
+  One upstream resolver.
+
+  Member variables:
+
+  _srtt -- smoothed round-trip time in seconds, or None if unmeasured.
+
+  _failures -- timeouts since the last reply.
+
+  _down -- whether the upstream is skipped until a probe succeeds.
+
+  _queries, _timeouts -- counts of queries sent and unanswered.
+  """
+
+  ALPHA = 0.8
+
+  def __init__(self, address):
+    self._address = address
+    self._srtt = None
+    self._failures = 0
+    self._down = False
+    self._queries = 0
+    self._timeouts = 0
+
+  def __str__(self):
+    if address_family(self._address) == AF_INET6:
+      return "[%s]:%d" % self._address
+    return "%s:%d" % self._address
+
+  def update_rtt(self, rtt):
+    self._srtt = rtt if self._srtt is None else \
+      (rtt*(1.0 - self.ALPHA) + self._srtt*self.ALPHA)
+
+  def success(self, rtt):
+    self.update_rtt(rtt)
+    self._failures = 0
+    if self._down:
+      _log.info("upstream %s is up", self)
+      self._down = False
+
+  def failure(self):
+    self._timeouts += 1
+    self._failures += 1
+    if self._failures >= MAX_FAILURES and not self._down:
+      _log.warning("upstream %s is down after %d timeouts", self,
+                   self._failures)
+      self._down = True
+
+class TcpRetry:
+  """
+  A query sent again over TCP, after a truncated reply, that does not
+  block: the connection is opened without waiting, and step() sends
+  and receives what it can whenever the socket is ready.
+
+  Member variables:
+
+  upstream -- the Upstream asked.
+
+  _out -- what is left to send of the length-prefixed query.
+
+  _in -- what has been received of the reply.
+  """
+
+  def __init__(self, packet, upstream):
+    """ Starts connecting to upstream.  Raises socket.error if it
+    cannot. """
+    self.upstream = upstream
+    self._sock = socket(address_family(upstream._address), SOCK_STREAM)
+    self._sock.setblocking(0)
+    err = self._sock.connect_ex(upstream._address)
+    if err not in (0, errno.EINPROGRESS):
+      self._sock.close()
+      raise error(err, os.strerror(err))
+    self._out = struct.pack(">H", len(packet)) + packet
+    self._in = ""
+
+  def fileno(self):
+    return self._sock.fileno()
+
+  def writing(self):
+    """ Returns whether the query is still to be sent, so that the
+    socket is to be selected on for writing. """
+    return bool(self._out)
+
+  def step(self):
+    """ Send or receive what can be without waiting.  Returns the reply
+    once it has all arrived, and None until then.  Raises socket.error
+    if the connection fails. """
+    if self._out:
+      err = self._sock.getsockopt(SOL_SOCKET, SO_ERROR)
+      if err:
+        raise error(err, os.strerror(err))
+      try:
+        self._out = self._out[self._sock.send(self._out):]
+      except error, e:
+        if e.args[0] not in (errno.EAGAIN, errno.ENOTCONN):
+          raise
+      return None
+    try:
+      data = self._sock.recv(65535)
+    except error, e:
+      if e.args[0] == errno.EAGAIN:
+        return None
+      raise
+    if not data:
+      raise error("connection closed")
+    self._in += data
+    if len(self._in) < 2:
+      return None
+    (length,) = struct.unpack(">H", self._in[:2])
+    if len(self._in) < 2 + length:
+      return None
+    return self._in[2:2 + length]
+
+  def close(self):
+    self._sock.close()
+
+class Forward:
+  """
+  A query forwarded to a ForwarderPool, from when it is sent until it
+  is answered or times out.
+
+  Member variables:
+
+  packet -- the query sent.
+
+  reply, upstream -- the reply and the Upstream that sent it, once
+  answered; None if it timed out.
+
+  done -- whether it has been answered or has timed out.
+
+  _end -- the time to give up at.
+
+  _sent -- [Upstream --> time the query was sent to it].
+
+  _hedgeAt -- the time to ask another upstream, or None.
+
+  _callback -- called with the Forward once it is done, or None.
+
+  _tcp -- the TcpRetry under way after a truncated reply, or None.
+  """
+
+  def __init__(self, packet, end, callback):
+    self.packet = packet
+    self.reply = None
+    self.upstream = None
+    self.done = False
+    self._end = end
+    self._sent = dict()
+    self._hedgeAt = None
+    self._callback = callback
+    self._tcp = None
+
+class ForwarderPool:
+  """
+  Forwards queries to a set of upstream resolvers.  Any number of
+  queries may be under way at once: start() sends one, and poll()
+  takes in their replies and carries out their hedges and timeouts,
+  without waiting.
+
+  Member variables:
+
+  _upstreams -- the Upstreams.
+
+  _hedge -- a fixed hedge delay in seconds, or None to derive it from
+  the RTT of the upstream first asked.
+
+  _hedged -- the number of queries sent to a second upstream.
+
+  _forwards -- [query ID --> Forward] of the queries under way.
+
+  _socks -- [address family --> UDP socket] for the families of the
+  upstreams.
+  """
+
+  def __init__(self, addresses, hedge = None):
+    self._upstreams = [Upstream(a) for a in addresses]
+    self._byaddr = dict([(u._address, u) for u in self._upstreams])
+    self._hedge = hedge
+    self._hedged = 0
+    self._socks = dict()
+    for family in set([address_family(a) for a in addresses]):
+      self._socks[family] = socket(family, SOCK_DGRAM)
+      self._socks[family].setblocking(0)
+    self._forwards = dict()
+    self._prober = None
+
+  def __str__(self):
+    return ",".join([str(u) for u in self._upstreams])
+
+  def readers(self):
+    """ What to select() on for reading before poll(): the UDP sockets,
+    and the TCP connections under way. """
+    return self._socks.values() + \
+      [f._tcp for f in self._forwards.values() if f._tcp is not None]
+
+  def writers(self):
+    """ What to select() on for writing before poll(): the TCP
+    connections with a query still to send. """
+    return [f._tcp for f in self._forwards.values()
+            if f._tcp is not None and f._tcp.writing()]
+
+  def choose(self, exclude = ()):
+    """ Returns an upstream not in exclude, picked at random with
+    weight 1/srtt among those up, or None. """
+    candidates = [u for u in self._upstreams if u not in exclude and not u._down]
+    if not candidates:
+      # All down: try the ones not yet tried anyway, rather than fail.
+      candidates = [u for u in self._upstreams if u not in exclude]
+      if not candidates:
+        return None
+    measured = [u._srtt for u in candidates if u._srtt is not None]
+    # An unmeasured upstream is weighted as the fastest, so it gets
+    # tried.
+    best = min(measured) if measured else 0.1
+    weights = [1.0 / max(u._srtt if u._srtt is not None else best, 0.0001)
+               for u in candidates]
+    x = random.random() * sum(weights)
+    for (u, w) in zip(candidates, weights):
+      x -= w
+      if x <= 0:
+        return u
+    return candidates[-1]
+
+  def hedgeDelay(self, upstream):
+    if self._hedge is not None:
+      return self._hedge
+    if upstream._srtt is None:
+      return HEDGE_INITIAL
+    return min(HEDGE_MAX, max(HEDGE_MIN, HEDGE_RTT_FACTOR * upstream._srtt))
+
+  def start(self, packet, timeout, callback = None):
+    """ Send the query packet to the pool, to be answered within
+    timeout seconds, and return its Forward.  callback, if given, is
+    called with the Forward from poll() once it is done. """
+    id = packet[:2]
+    while id in self._forwards:
+      # Replies are told apart by ID.
+      id = struct.pack(">H", random.randint(0, 65535))
+    now = time.time()
+    f = Forward(id + packet[2:], now + timeout, callback)
+    self._forwards[id] = f
+    self._send(f, self.choose(), now)
+    if not f._sent:
+      self._finish(f, None, None)
+    return f
+
+  def _send(self, f, upstream, now):
+    """ Send f's query to upstream, and set when to hedge it. """
+    f._hedgeAt = None
+    if upstream is None:
+      return
+    f._sent[upstream] = now
+    upstream._queries += 1
+    try:
+      self._socks[address_family(upstream._address)].sendto(
+        f.packet, upstream._address)
+    except error, e:
+      _log.warning("cannot send to %s: %s", upstream, e)
+    f._hedgeAt = now + self.hedgeDelay(upstream)
+
+  def nextTimeout(self):
+    """ Returns the seconds until poll() next has a query to hedge or
+    give up on, or None if no query is under way. """
+    if not self._forwards:
+      return None
+    at = min([f._end if f._hedgeAt is None else min(f._end, f._hedgeAt)
+              for f in self._forwards.values()])
+    return max(at - time.time(), 0)
+
+  def poll(self):
+    """ Take in the replies that have arrived over UDP and TCP, then ask
+    another upstream, or give up, for the queries whose time has
+    come. """
+    for sock in self._socks.values():
+      while self._forwards:
+        try:
+          (data, address) = sock.recvfrom(512)
+        except error:
+          break
+        self._receive(data, address[:2], time.time())
+    tcp = [f._tcp for f in self._forwards.values() if f._tcp is not None]
+    if tcp:
+      try:
+        (rds, wds, xds) = select(tcp, [t for t in tcp if t.writing()], [], 0)
+      except select_error, e:
+        if e.args[0] != errno.EINTR:
+          raise
+        (rds, wds) = ([], []) # interrupted by a signal
+      for f in self._forwards.values():
+        if f._tcp is not None and (f._tcp in rds or f._tcp in wds):
+          self._stepTcp(f)
+    now = time.time()
+    for f in self._forwards.values():
+      if f.done:
+        continue
+      if now >= f._end:
+        for u in f._sent:
+          u.failure()
+        self.probe()
+        self._finish(f, None, None)
+      elif f._hedgeAt is not None and now >= f._hedgeAt:
+        upstream = self.choose(exclude=f._sent)
+        if upstream is not None:
+          self._hedged += 1
+        self._send(f, upstream, now)
+
+  def _receive(self, data, address, now):
+    """ Take in the reply data from address, if it answers a query
+    under way: the first valid reply wins. """
+    f = self._forwards.get(data[:2])
+    u = self._byaddr.get(address)
+    if f is None or u not in f._sent or not reply_matches(f.packet, data):
+      return # a late reply to an earlier query
+    u.success(now - f._sent[u])
+    for other in f._sent:
+      if other is not u:
+        # It was slower than this, at least, so is asked less
+        # often; only a timeout counts as a failure.
+        if other._srtt is None or other._srtt < now - f._sent[other]:
+          other.update_rtt(now - f._sent[other])
+    self.probe()
+    if ord(data[2]) & 0x02: # TC
+      if f._tcp is None:
+        try:
+          f._tcp = TcpRetry(f.packet, u)
+        except error, e:
+          _log.warning("TCP query to %s failed: %s", u, e)
+          return # wait for another upstream's reply, or the timeout
+        # The TCP reply is waited for rather than another upstream.
+        f._hedgeAt = None
+      return
+    self._finish(f, data, u)
+
+  def _stepTcp(self, f):
+    """ Carry on with f's TCP retry, and finish f once it has the
+    reply. """
+    try:
+      data = f._tcp.step()
+    except error, e:
+      _log.warning("TCP query to %s failed: %s", f._tcp.upstream, e)
+      f._tcp.close()
+      f._tcp = None
+      return # wait for another upstream's reply, or the timeout
+    if data is not None:
+      if reply_matches(f.packet, data):
+        self._finish(f, data, f._tcp.upstream)
+      else:
+        _log.warning("TCP reply from %s does not match the query",
+                     f._tcp.upstream)
+        f._tcp.close()
+        f._tcp = None
+
+  def _finish(self, f, reply, upstream):
+    del self._forwards[f.packet[:2]]
+    if f._tcp is not None:
+      f._tcp.close()
+      f._tcp = None
+    f.reply = reply
+    f.upstream = upstream
+    f.done = True
+    if f._callback is not None:
+      f._callback(f)
+
+  def probe(self):
+    """ Start the thread probing upstreams that are down, if it is not
+    running. """
+    if self._prober is not None and self._prober.is_alive():
+      return
+    if not [u for u in self._upstreams if u._down]:
+      return
+    self._prober = threading.Thread(target=self._probe, name="forwarder-probe")
+    self._prober.daemon = True
+    self._prober.start()
+
+  def _probe(self):
+    socks = dict([(family, socket(family, SOCK_DGRAM))
+                  for family in self._socks])
+    for s in socks.values():
+      s.settimeout(PROBE_INTERVAL)
+    question = QE(type=RR.TYPE_NS, dn=DomainName("."))
+    while True:
+      down = [u for u in self._upstreams if u._down]
+      if not down:
+        break
+      for u in down:
+        packet = Header(random.randint(0, 65535), Header.OPCODE_QUERY,
+                        Header.RCODE_NOERR, qdcount=1, rd=True).pack() + \
+                 question.pack()
+        start = time.time()
+        s = socks[address_family(u._address)]
+        try:
+          s.sendto(packet, u._address)
+          while True:
+            (data, address) = s.recvfrom(512)
+            if address[:2] == u._address and reply_matches(packet, data):
+              u.success(time.time() - start)
+              break
+        except error:
+          pass
+      time.sleep(PROBE_INTERVAL)
+    for s in socks.values():
+      s.close()
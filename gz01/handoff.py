@@ -0,0 +1,371 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Handing a running server's sockets and cache over to a new one. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# A server given a handoff path listens on it, as a Unix socket, for
+# the server to replace it.  A new server given the same path first
+# connects to it, if anything is listening there, and:
+#
+# 1. the old server sends the names, families and types of its
+#    listening sockets, then the descriptor of each (SCM_RIGHTS), so
+#    that both read from the same sockets and no query is refused;
+# 2. the old server sends its cache entries, CHUNK at a time, between
+#    answering queries, and then an empty chunk;
+# 3. the new server, having cached them, sends READY and starts
+#    answering; the old one stops reading queries, answers those it
+#    has queued and exits.
+#
+# Every message but the descriptors and READY is a 4-byte big-endian
+# length followed by plain data, never code: the sockets as lines of
+# "name family type", and the cache entries as records of their key,
+# the RRs they hold packed as on the wire, and when each expires (see
+# _packEntry()).  Only the owner of the server may connect to its
+# path, and each server checks that the other runs as the same user.
+# If either server goes away part way, the old one carries on as if
+# nothing had happened.
+
+import errno, logging, os, socket as _socket, struct
+from multiprocessing.reduction import send_handle, recv_handle
+from select import select, error as select_error
+from socket import socket, fromfd, error, AF_UNIX, SOCK_STREAM, SOL_SOCKET
+
+from gz01.dnslib.RR import RR, RR_A, RR_NS, RR_CNAME
+from gz01.inetlib.types import DomainName
+from gz01.resolver import ACacheEntry, CacheEntry, CnameCacheEntry, \
+  InfraCacheEntry, NegativeCacheEntry, RRsetCacheEntry
+
+_log = logging.getLogger(__name__)
+
+# Cache entries per message.
+CHUNK = 500
+
+READY = "R"
+
+# Seconds either server waits for the other to take a message.
+TIMEOUT = 10.0
+
+_LENGTH = struct.Struct(">I")
+
+# Not in the socket module of Python 2; the value is Linux's.
+SO_PEERCRED = getattr(_socket, "SO_PEERCRED", 17)
+_UCRED = struct.Struct("3i") # pid, uid, gid
+
+# A cache entry is a _HEAD of its cache, as an index into _LABELS, and
+# the length of its key's name (or server address), then the name and
+# a tail by cache:
+#
+# a, ns, cname -- a _COUNT of items;
+# rrset -- the type and class of the key (_QUESTION), then a _COUNT;
+# negative -- the type and class, then a _NEGATIVE of rcode and expiry;
+# infra -- an _INFRA of the server's health.
+#
+# Each item is an _EXPIRY followed by an RR packed as on the wire.
+_LABELS = ('a', 'ns', 'cname', 'rrset', 'negative', 'infra')
+_HEAD = struct.Struct(">BH")
+_COUNT = struct.Struct(">H")
+_QUESTION = struct.Struct(">HH")
+_EXPIRY = struct.Struct(">q")
+_NEGATIVE = struct.Struct(">Bq")
+_INFRA = struct.Struct(">?dddI") # whether there is an RTT, RTT, down
+                                 # until, backoff, failures
+
+def _send(conn, data):
+  conn.sendall(_LENGTH.pack(len(data)) + data)
+
+def _recvall(conn, n):
+  l = []
+  while n > 0:
+    data = conn.recv(n)
+    if not data:
+      raise error("connection closed")
+    l.append(data)
+    n -= len(data)
+  return "".join(l)
+
+def _receiveData(conn):
+  (length,) = _LENGTH.unpack(_recvall(conn, _LENGTH.size))
+  return _recvall(conn, length)
+
+def _select(conn, timeout):
+  """ Returns whether conn becomes readable within timeout seconds; a
+  signal counts as a timeout. """
+  try:
+    (rds, wds, xds) = select([conn], [], [], timeout)
+  except select_error, e:
+    if e.args[0] != errno.EINTR:
+      raise
+    return False
+  return bool(rds)
+
+def _checkPeer(conn):
+  """ Raises socket.error unless the other end of the Unix socket conn
+  runs as the same user. """
+  (pid, uid, gid) = _UCRED.unpack(conn.getsockopt(SOL_SOCKET, SO_PEERCRED,
+                                                  _UCRED.size))
+  if uid != os.getuid():
+    raise error("peer runs as uid %d, not %d" % (uid, os.getuid()))
+
+def _packItems(items):
+  """ Returns items, [(expiration, RR)], packed. """
+  return _COUNT.pack(len(items)) + \
+    "".join([_EXPIRY.pack(int(expiration)) + rr.pack()
+             for (expiration, rr) in items])
+
+def _packEntry(label, key, entry):
+  """ Returns the cache entry, as yielded by Cache.entries(), packed. """
+  if label in ('rrset', 'negative'):
+    (name, type, cls) = key
+    tail = _QUESTION.pack(type, cls)
+    if label == 'rrset':
+      tail += _packItems([(entry._expiration, rr) for rr in entry._rrs])
+    else:
+      tail += _NEGATIVE.pack(entry._rcode, int(entry._expiration))
+  elif label == 'infra':
+    name = key
+    tail = _INFRA.pack(entry._srtt is not None, entry._srtt or 0,
+                       entry._downUntil, entry._backoff, entry._failures)
+  else:
+    name = key
+    dn = DomainName.fromKey(key)
+    if label == 'a':
+      items = [(e._expiration, RR_A(dn, 0, _socket.inet_aton(ip)))
+               for (ip, e) in entry._dict.items()]
+    elif label == 'ns':
+      items = [(e._expiration, RR_NS(dn, 0, nsdn))
+               for (nsdn, e) in entry.items()]
+    else:
+      items = [(entry._expiration, RR_CNAME(dn, 0, entry._cname))]
+    tail = _packItems(items)
+  return _HEAD.pack(_LABELS.index(label), len(name)) + name + tail
+
+def _unpackItems(data, offset):
+  """ Returns ([(expiration, RR)], offset past them) of the items packed
+  at offset in data. """
+  (n,) = _COUNT.unpack_from(data, offset)
+  offset += _COUNT.size
+  items = []
+  for i in range(n):
+    (expiration,) = _EXPIRY.unpack_from(data, offset)
+    (rr, length) = RR.fromData(data, offset + _EXPIRY.size)
+    items.append((expiration, rr))
+    offset += _EXPIRY.size + length
+  return (items, offset)
+
+def _unpackEntries(data):
+  """ Yields (cache label, key, entry) of the entries packed in data,
+  for Cache.load().  Raises struct.error or ValueError if it is not
+  well formed. """
+  offset = 0
+  while offset < len(data):
+    (index, length) = _HEAD.unpack_from(data, offset)
+    offset += _HEAD.size
+    if index >= len(_LABELS) or offset + length > len(data):
+      raise ValueError("bad cache entry")
+    label = _LABELS[index]
+    name = data[offset:offset + length]
+    offset += length
+    if label in ('rrset', 'negative'):
+      (type, cls) = _QUESTION.unpack_from(data, offset)
+      offset += _QUESTION.size
+      key = (name, type, cls)
+      if label == 'rrset':
+        (items, offset) = _unpackItems(data, offset)
+        if not items:
+          raise ValueError("empty RRset")
+        entry = RRsetCacheEntry([rr for (expiration, rr) in items],
+                                expiration=items[0][0])
+      else:
+        (rcode, expiration) = _NEGATIVE.unpack_from(data, offset)
+        offset += _NEGATIVE.size
+        entry = NegativeCacheEntry(rcode, expiration)
+    elif label == 'infra':
+      key = name
+      (hasRtt, srtt, downUntil, backoff, failures) = \
+        _INFRA.unpack_from(data, offset)
+      offset += _INFRA.size
+      entry = InfraCacheEntry()
+      entry._srtt = srtt if hasRtt else None
+      (entry._downUntil, entry._backoff, entry._failures) = \
+        (downUntil, backoff, failures)
+    else:
+      key = name
+      (items, offset) = _unpackItems(data, offset)
+      if label == 'a':
+        entry = ACacheEntry(dict([(_socket.inet_ntoa(rr._inaddr),
+          CacheEntry(expiration, authoritative=True))
+          for (expiration, rr) in items if rr._type == RR.TYPE_A]))
+      elif label == 'ns':
+        entry = dict([(rr._nsdn, CacheEntry(expiration, authoritative=True))
+                      for (expiration, rr) in items if rr._type == RR.TYPE_NS])
+      else:
+        if len(items) != 1 or items[0][1]._type != RR.TYPE_CNAME:
+          raise ValueError("bad CNAME entry")
+        (expiration, rr) = items[0]
+        entry = CnameCacheEntry(rr._cname, expiration, authoritative=True)
+    yield (label, key, entry)
+
+class Handoff:
+  """
+  A handover under way to a new server, from the old one's side.
+
+  Member variables:
+
+  _conn -- the Unix socket connected to the new server.
+
+  _entries -- the iterator over the cache entries still to send, or
+  None once they all have been.
+
+  sent -- the number of cache entries sent.
+  """
+
+  def __init__(self, conn, sockets, cache):
+    """ Sends the new server on conn the sockets, [(name, socket)], and
+    starts on the entries of cache. """
+    self._conn = conn
+    self._conn.settimeout(TIMEOUT)
+    _checkPeer(conn)
+    _send(conn, "".join(["%s %d %d\n" % (name, s.family, s.type)
+                         for (name, s) in sockets]))
+    for (name, s) in sockets:
+      send_handle(conn, s.fileno(), None)
+    self._entries = cache.entries()
+    self.sent = 0
+
+  def fileno(self):
+    return self._conn.fileno()
+
+  def sending(self):
+    """ Returns whether cache entries are still to be sent. """
+    return self._entries is not None
+
+  def step(self):
+    """
+    Sends the next CHUNK cache entries, or once they have all been
+    sent, checks without waiting whether the new server is ready.
+    Returns whether it is.  Raises socket.error if the new server has
+    gone away.
+    """
+    if self._entries is not None:
+      chunk = []
+      for (label, key, entry) in self._entries:
+        chunk.append(_packEntry(label, key, entry))
+        if len(chunk) == CHUNK:
+          break
+      _send(self._conn, "".join(chunk))
+      self.sent += len(chunk)
+      if not chunk:
+        self._entries = None
+      return False
+    if not _select(self._conn, 0):
+      return False
+    data = self._conn.recv(1)
+    if data != READY:
+      raise error("new server went away")
+    return True
+
+  def close(self):
+    self._conn.close()
+
+class Listener:
+  """ The Unix socket a server listens on for the server to replace
+  it. """
+
+  def __init__(self, path):
+    try:
+      os.unlink(path) # left by a server that is gone, or handed over
+    except OSError:
+      pass
+    self._sock = socket(AF_UNIX, SOCK_STREAM)
+    # Whoever connects is sent the server's sockets and cache, so the
+    # socket is created accessible to the server's user only, rather
+    # than restricted once it exists.
+    umask = os.umask(0177)
+    try:
+      self._sock.bind(path)
+    finally:
+      os.umask(umask)
+    self._sock.listen(1)
+
+  def fileno(self):
+    return self._sock.fileno()
+
+  def accept(self, sockets, cache):
+    """ Returns the Handoff to the new server connecting, or None if it
+    could not be started. """
+    try:
+      (conn, address) = self._sock.accept()
+    except error:
+      return None
+    try:
+      handoff = Handoff(conn, sockets, cache)
+    except error, e:
+      _log.warning("cannot hand over to new server: %s", e)
+      conn.close()
+      return None
+    _log.info("handing over to new server")
+    return handoff
+
+def take_over(path, cache):
+  """
+  Takes over from the server listening on the Unix socket path, if
+  any: loads its cache entries into cache, and returns {name: socket}
+  of its listening sockets.  Returns None if no server is listening
+  there.  If it goes away part way, what was received is kept.
+  """
+  conn = socket(AF_UNIX, SOCK_STREAM)
+  try:
+    conn.connect(path)
+  except error:
+    conn.close()
+    return None
+  conn.settimeout(TIMEOUT)
+  sockets = dict()
+  loaded = 0
+  try:
+    _checkPeer(conn)
+    for line in _receiveData(conn).splitlines():
+      (name, family, type) = line.split()
+      # recv_handle() does not wait, as the socket is nonblocking.
+      _select(conn, TIMEOUT)
+      fd = recv_handle(conn)
+      sockets[name] = fromfd(fd, int(family), int(type))
+      os.close(fd)
+    while True:
+      data = _receiveData(conn)
+      if not data:
+        break
+      try:
+        entries = list(_unpackEntries(data))
+      except (struct.error, ValueError, IndexError), e:
+        _log.warning("skipping cache entries from old server: %s", e)
+        continue
+      for (label, key, entry) in entries:
+        cache.load(label, key, entry)
+      loaded += len(entries)
+    conn.sendall(READY)
+  except (error, OSError, struct.error, ValueError), e:
+    _log.warning("handover from old server cut short: %s", e)
+  conn.close()
+  _log.info("took over %s and %d cache entries from old server",
+            ", ".join(sorted(sockets)) or "no sockets", loaded)
+  return sockets
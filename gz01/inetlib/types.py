@@ -55,21 +55,75 @@ class InetAddr:
   def fromNetwork(n):
     return InetAddr(inet_ntoa(n))
 
-class DomainName:
-  """ Representation of a DNS domain name. """
+class DomainName(object):
+  """ Representation of a DNS domain name.
+
+  Member variables:
+
+  _namelist -- the list of labels making up this name, as they
+  appeared on the wire (case preserved).
+
+  _key -- the canonical key of this name: its lowercased, uncompressed
+  RFC 1035 wire format, interned.  Two DomainNames are equal iff their
+  keys are equal, and the key of a parent domain is a suffix (and a
+  slice) of the key of any of its subdomains.  Caches should be
+  indexed by this key rather than by the DomainName object itself.
+
+  _hash -- the cached hash of _key.
+  """
 
   def __init__(self, s = ""):
     """ Initialize from a user-supplied string (optionally empty). """
     self._namelist = s.lstrip(".").split(".") # XXX this is subtle
+    self._setKey(DomainName.keyFromLabels(self._namelist))
+
+  def _setKey(self, key):
+    self._key = intern(key)
+    self._hash = hash(self._key)
+
+  @staticmethod
+  def keyFromLabels(labels):
+    """ Return the canonical key for the user-supplied label list. """
+    l = []
+    for label in labels:
+      if label:
+        l.append(chr(len(label)))
+        l.append(label.lower())
+    l.append('\x00')
+    return "".join(l)
+
+  @staticmethod
+  def parentKey(key):
+    """ Return the canonical key of the parent of the domain whose
+    key is given, or None if key is the key of the root domain. """
+    if key == '\x00':
+      return None
+    return key[ord(key[0]) + 1:]
+
+  @staticmethod
+  def fromKey(key):
+    """ Return a DomainName object from a canonical key. """
+    dn = DomainName.__new__(DomainName)
+    labels = []
+    offset = 0
+    while key[offset] != '\x00':
+      labellen = ord(key[offset])
+      labels.append(key[offset + 1:offset + 1 + labellen])
+      offset += 1 + labellen
+    labels.append('')
+    dn._namelist = labels
+    dn._setKey(key)
+    return dn
 
   @staticmethod
   def fromData(data, offset = 0):
     """ Return a DomainName object from user-supplied packed binary
     data, with an optional offset modifier.  """
 
-    dn = DomainName()
+    dn = DomainName.__new__(DomainName)
     dn._namelist = [ ]
     dn._length = 0
+    key = [ ]
     followedPointer = False
     while offset < len(data): # loop over label sequence
       (labellen,) = struct.unpack_from("B", data, offset)
@@ -95,13 +149,19 @@ class DomainName:
         if not followedPointer:
           dn._length += 1 + labellen
         dn._namelist.append(labeldata)
+        key.append(chr(labellen))
+        key.append(labeldata.lower())
+    key.append('\x00')
+    dn._setKey("".join(key))
     return dn
 
   def parent(self):
     """ Return a DomainName object that represents the parent domain. """
-    if self != DomainName("."):
-      res = DomainName()
+    key = DomainName.parentKey(self._key)
+    if key is not None:
+      res = DomainName.__new__(DomainName)
       res._namelist = self._namelist[1:]
+      res._setKey(key)
       return res
     return None
 
@@ -109,7 +169,9 @@ class DomainName:
     """  Return a copy of this DomainName object that loses any
     pointer information that may exist in this object's rep.  """
 
-    res = DomainName(str(self))
+    res = DomainName.__new__(DomainName)
+    res._namelist = [n.lower() for n in self._namelist if n] + ['']
+    res._setKey(self._key)
     return res
 
   def __len__(self):
@@ -130,11 +192,17 @@ class DomainName:
     return ".".join([n.lower() for n in self._namelist]).rstrip(".") + "." 
 
   def __hash__(self):
-    """ Returns a hash of this object based on its string rep. """
-    return hash(str(self))
+    """ Returns a hash of this object based on its canonical key. """
+    return self._hash
+
+  def __eq__(self, other):
+    return isinstance(other, DomainName) and self._key == other._key
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
 
   def __cmp__(self, other):
-    return cmp(str(self).lower(), str(other).lower())
+    return cmp(self._key, other._key)
 
   def __repr__(self):
     return str(self)
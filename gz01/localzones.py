@@ -0,0 +1,365 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Names answered from local data: hosts-style files, blocklists and
+zone files, loaded into an index checked before the cache. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Every file is loaded into its own Index, keyed by the canonical keys
+# of gz01.inetlib.types.DomainName, whose values are plain tuples:
+#
+#   (TYPE_A, ttl, (packed address, ...))
+#   (TYPE_CNAME, ttl, canonical key of the target)
+#   BLOCKED                        -- answered NXDOMAIN
+#   NODATA                         -- answered with no RRs
+#
+# A blocklist of a million names is then a dict of a million short
+# strings that all share the single BLOCKED tuple.  Files are read, and
+# re-read when they change, by a background thread, which replaces a
+# file's Index in one assignment; queries keep being answered from the
+# previous data meanwhile.
+#
+# Hosts-style files hold lines of an address followed by names, as in
+# /etc/hosts, or of a name alone, which is blocked.  A name written
+# "*.example.com" matches every name below example.com (but not
+# example.com itself).
+#
+# Zone files hold a subset of the RFC 1035 master file format: $ORIGIN
+# and $TTL, and A, CNAME and SOA records; records of other types only
+# make their owner exist.  The apex, names that exist but have no
+# address, and the names between the apex and those defined (empty
+# non-terminals) are answered with no RRs; other names below the zone's
+# origin are answered NXDOMAIN.
+
+import logging, os, threading, time
+from socket import inet_aton, error as socket_error
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.RR import RR
+from gz01.inetlib.types import DomainName
+
+_log = logging.getLogger(__name__)
+
+BLOCKED = ("NXDOMAIN",)
+NODATA = ("NODATA",)
+
+# TTL of answers from hosts-style files.
+HOSTS_TTL = 300
+
+# Most CNAMEs followed within local data for one query.
+MAX_CNAMES = 8
+
+def name_key(name, origin = None):
+  """
+  Returns the canonical key of the domain name string name, relative
+  to the key origin unless it ends in '.'.  Raises ValueError if it is
+  not a valid name.
+  """
+  # This is DomainName.keyFromLabels, unrolled: it is the bulk of the
+  # time taken to load a large file.
+  absolute = name.endswith(".")
+  if name == ".":
+    return "\x00"
+  labels = (name[:-1] if absolute else name).lower().split(".")
+  if "" in labels or max(map(len, labels)) > 63:
+    raise ValueError("bad domain name %r" % (name,))
+  key = "".join([chr(len(label)) + label for label in labels]) + "\x00"
+  if origin is not None and not absolute:
+    key = key[:-1] + origin
+  if len(key) > 255:
+    raise ValueError("domain name too long: %r" % (name,))
+  return key
+
+class Index:
+  """
+  The names defined by one file.
+
+  Member variables:
+
+  _exact -- [key --> entry] for names matched exactly.
+
+  _wildcard -- [key of a domain --> entry] for names matched below
+  that domain.
+
+  _zones -- the keys of the zones this file is authoritative for.
+  """
+
+  def __init__(self):
+    self._exact = dict()
+    self._wildcard = dict()
+    self._zones = set()
+
+  def __len__(self):
+    return len(self._exact) + len(self._wildcard)
+
+  def lookup(self, key):
+    """ Returns the entry for key, or None if this file does not
+    define it. """
+    entry = self._exact.get(key)
+    if entry is not None or not (self._wildcard or self._zones):
+      return entry
+    if key in self._zones:
+      return NODATA # the apex has no address
+    parent = DomainName.parentKey(key)
+    while parent is not None:
+      entry = self._wildcard.get(parent)
+      if entry is not None:
+        return entry
+      if parent in self._zones:
+        return BLOCKED
+      parent = DomainName.parentKey(parent)
+    return None
+
+  def _add(self, key, entry, wildcard = False):
+    table = self._wildcard if wildcard else self._exact
+    old = table.get(key)
+    if old is not None and old[0] == RR.TYPE_A and entry[0] == RR.TYPE_A:
+      entry = (RR.TYPE_A, min(old[1], entry[1]), old[2] + entry[2])
+    table[key] = entry
+
+  def _addName(self, name, entry, origin = None):
+    if name.startswith("*."):
+      self._add(name_key(name[2:], origin), entry, True)
+    else:
+      self._add(name_key(name, origin), entry)
+
+  def _addEmptyNonTerminals(self):
+    """ Make the names between each zone's apex and the names defined
+    below it exist, with no RRs. """
+    # *.example.com makes example.com exist, as www.example.com does.
+    names = [DomainName.parentKey(key) for key in self._exact]
+    names.extend(self._wildcard)
+    for key in names:
+      between = []
+      while key is not None and key not in self._zones:
+        between.append(key)
+        key = DomainName.parentKey(key)
+      if key is not None:
+        for k in between:
+          self._exact.setdefault(k, NODATA)
+
+def load_hosts(path):
+  """ Returns an Index of the hosts-style file at path. """
+  index = Index()
+  exact = index._exact
+  f = open(path, "r", 1 << 16)
+  for (lineno, line) in enumerate(f):
+    if "#" in line:
+      line = line.split("#", 1)[0]
+    fields = line.split()
+    if not fields:
+      continue
+    try:
+      if len(fields) == 1:
+        if fields[0].startswith("*."):
+          index._addName(fields[0], BLOCKED)
+        else:
+          exact[name_key(fields[0])] = BLOCKED
+        continue
+      try:
+        addr = inet_aton(fields[0])
+      except socket_error:
+        # Not an IPv4 address; such names are not answered locally.
+        continue
+      entry = (RR.TYPE_A, HOSTS_TTL, (addr,))
+      for name in fields[1:]:
+        index._addName(name, entry)
+    except ValueError, e:
+      _log.warning("%s:%d: %s", path, lineno + 1, e)
+  f.close()
+  return index
+
+def _zone_lines(f):
+  """ Yields (line number, fields, whether the line starts with a
+  blank) for the records of a master file, joining parenthesized
+  continuation lines. """
+  fields = []
+  blank = False
+  start = 0
+  depth = 0
+  for (lineno, line) in enumerate(f):
+    line = line.split(";", 1)[0]
+    if depth == 0:
+      blank = line[:1] in (" ", "\t")
+      start = lineno + 1
+    depth += line.count("(") - line.count(")")
+    fields.extend(line.replace("(", " ").replace(")", " ").split())
+    if depth <= 0 and fields:
+      yield (start, fields, blank)
+      fields = []
+      depth = 0
+
+CLASSES = ("IN", "CH", "HS")
+
+def load_zone(path):
+  """ Returns an Index of the zone file at path. """
+  index = Index()
+  origin = None
+  ttl = 3600
+  owner = None
+  f = open(path)
+  for (lineno, fields, blank) in _zone_lines(f):
+    try:
+      if fields[0] == "$ORIGIN":
+        origin = name_key(fields[1] if fields[1].endswith(".") else fields[1] + ".")
+        continue
+      if fields[0] == "$TTL":
+        ttl = int(fields[1])
+        continue
+      if fields[0].startswith("$"):
+        _log.warning("%s:%d: unsupported directive %s", path, lineno, fields[0])
+        continue
+      if not blank:
+        owner = fields.pop(0)
+        if owner == "@":
+          if origin is None:
+            raise ValueError("@ before $ORIGIN")
+          owner = str(DomainName.fromKey(origin))
+      if owner is None:
+        raise ValueError("record without an owner")
+      rrttl = ttl
+      while fields and (fields[0].isdigit() or fields[0].upper() in CLASSES):
+        if fields[0].isdigit():
+          rrttl = int(fields[0])
+        fields.pop(0)
+      rrtype = fields[0].upper()
+      rdata = fields[1:]
+      if rrtype == "SOA":
+        zone = name_key(owner, origin)
+        if origin is None:
+          origin = zone
+        index._zones.add(zone)
+      elif rrtype == "A":
+        index._addName(owner, (RR.TYPE_A, rrttl, (inet_aton(rdata[0]),)), origin)
+      elif rrtype == "CNAME":
+        index._addName(owner, (RR.TYPE_CNAME, rrttl, name_key(rdata[0], origin)),
+                       origin)
+      elif not owner.startswith("*."):
+        index._exact.setdefault(name_key(owner, origin), NODATA)
+    except (ValueError, IndexError, socket_error), e:
+      _log.warning("%s:%d: %s", path, lineno, e)
+  f.close()
+  if not index._zones and origin is not None:
+    index._zones.add(origin)
+  index._addEmptyNonTerminals()
+  return index
+
+class LocalZones:
+  """
+  The local data of the server: an Index per file, consulted in the
+  order the files were given, the first to define a name winning.
+
+  Member variables:
+
+  _files -- [(path, loader function)].
+
+  _indexes -- [path --> Index] of the files loaded so far.  The dict is
+  replaced, never changed, so that lookups need no lock.
+
+  _stamps -- [path --> (mtime, size)] of each file when last loaded.
+  """
+
+  def __init__(self):
+    self._files = []
+    self._indexes = dict()
+    self._order = []
+    self._stamps = dict()
+    self._thread = None
+
+  def addHosts(self, path):
+    self._files.append((path, load_hosts))
+
+  def addZone(self, path):
+    self._files.append((path, load_zone))
+
+  def __len__(self):
+    return sum([len(index) for index in self._order])
+
+  def lookup(self, key):
+    """
+    Returns (rcode, key of the name answered, entry) for the name with
+    canonical key, following CNAMEs within the local data, or None if
+    no file defines the name.  entry is None for NXDOMAIN, NODATA for a
+    name with no address, or the CNAME entry if its target is not
+    local.
+    """
+    order = self._order
+    if not order:
+      return None
+    entry = None
+    for i in range(MAX_CNAMES):
+      for index in order:
+        found = index.lookup(key)
+        if found is not None:
+          break
+      else:
+        # A CNAME to a name without local data is resolved as usual.
+        return None if entry is None else (Header.RCODE_NOERR, key, entry)
+      entry = found
+      if entry is BLOCKED:
+        return (Header.RCODE_NAMEERR, key, None)
+      if entry[0] != RR.TYPE_CNAME:
+        return (Header.RCODE_NOERR, key, entry)
+      key = entry[2]
+    return None
+
+  def reload(self):
+    """ Load every file that has changed since it was last loaded.
+    Returns the number of files loaded. """
+    loaded = 0
+    for (path, loader) in self._files:
+      try:
+        st = os.stat(path)
+      except OSError, e:
+        _log.warning("cannot read %s: %s", path, e)
+        continue
+      stamp = (st.st_mtime, st.st_size)
+      if self._stamps.get(path) == stamp:
+        continue
+      start = time.time()
+      try:
+        index = loader(path)
+      except IOError, e:
+        _log.warning("cannot read %s: %s", path, e)
+        continue
+      indexes = dict(self._indexes)
+      indexes[path] = index
+      self._indexes = indexes
+      self._order = [indexes[p] for (p, l) in self._files if p in indexes]
+      self._stamps[path] = stamp
+      loaded += 1
+      _log.info("loaded %d names from %s in %.2fs", len(index), path,
+                time.time() - start)
+    return loaded
+
+  def watch(self, interval = 5.0):
+    """ Load the files, and reload them when they change, from a
+    background thread checking them every interval seconds. """
+    def run():
+      while True:
+        try:
+          self.reload()
+        except Exception:
+          _log.exception("reloading local data")
+        time.sleep(interval)
+    self._thread = threading.Thread(target=run, name="localzones")
+    self._thread.daemon = True
+    self._thread.start()
@@ -0,0 +1,213 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Counters, gauges and histograms, served in the Prometheus text
+format over HTTP. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Metrics are updated without locks: each one is only ever written by
+# the thread answering queries, and the HTTP thread only reads them.
+# Under the interpreter lock a read sees either the old or the new
+# value, which is all a scrape needs.
+
+from bisect import bisect_left
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import urllib2
+
+# Default histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Labels beyond this many distinct values per metric are folded into
+# the value OTHER, so that a flood of distinct upstream servers or
+# clients cannot grow a metric without bound.
+MAX_LABELS = 1000
+OTHER = "other"
+
+def _escape(v):
+  return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter:
+  """ A monotonically increasing count. """
+
+  def __init__(self, name, help):
+    self._name = name
+    self._help = help
+    self._value = 0
+
+  def inc(self, n = 1):
+    self._value += n
+
+  def render(self):
+    return ["# HELP %s %s" % (self._name, self._help),
+            "# TYPE %s counter" % (self._name,),
+            "%s %s" % (self._name, self._value)]
+
+class LabeledCounter:
+  """ A family of counts distinguished by the value of one label. """
+
+  def __init__(self, name, help, label):
+    self._name = name
+    self._help = help
+    self._label = label
+    self._values = dict()
+
+  def inc(self, value, n = 1):
+    if value not in self._values and len(self._values) >= MAX_LABELS:
+      value = OTHER
+    self._values[value] = self._values.get(value, 0) + n
+
+  def get(self, value):
+    return self._values.get(value, 0)
+
+  def render(self):
+    l = ["# HELP %s %s" % (self._name, self._help),
+         "# TYPE %s counter" % (self._name,)]
+    for (value, n) in sorted(self._values.items()):
+      l.append('%s{%s="%s"} %s' % (self._name, self._label, _escape(value), n))
+    return l
+
+class Gauge:
+  """ A value sampled at scrape time by calling a function, which
+  returns either a number or a dict [label value --> number]. """
+
+  def __init__(self, name, help, fn, label = None):
+    self._name = name
+    self._help = help
+    self._fn = fn
+    self._label = label
+
+  def render(self):
+    l = ["# HELP %s %s" % (self._name, self._help),
+         "# TYPE %s gauge" % (self._name,)]
+    value = self._fn()
+    if self._label is None:
+      l.append("%s %s" % (self._name, value))
+    else:
+      for (v, n) in sorted(value.items()):
+        l.append('%s{%s="%s"} %s' % (self._name, self._label, _escape(v), n))
+    return l
+
+class SampledCounter(Gauge):
+  """ A count kept elsewhere, sampled at scrape time as a Gauge is. """
+
+  def render(self):
+    l = Gauge.render(self)
+    l[1] = "# TYPE %s counter" % (self._name,)
+    return l
+
+class Histogram:
+  """ A distribution of observed values over fixed buckets, optionally
+  split by the value of one label. """
+
+  def __init__(self, name, help, buckets = LATENCY_BUCKETS, label = None):
+    self._name = name
+    self._help = help
+    self._buckets = tuple(buckets)
+    self._label = label
+    self._series = dict() # label value --> [counts, sum]
+
+  def observe(self, v, value = None):
+    series = self._series.get(value)
+    if series is None:
+      series = self._series[value] = [[0] * (len(self._buckets) + 1), 0.0]
+    series[0][bisect_left(self._buckets, v)] += 1
+    series[1] += v
+
+  def render(self):
+    l = ["# HELP %s %s" % (self._name, self._help),
+         "# TYPE %s histogram" % (self._name,)]
+    for (value, (counts, total)) in sorted(self._series.items()):
+      labels = "" if self._label is None else \
+               '%s="%s",' % (self._label, _escape(value))
+      cumulative = 0
+      for (bound, n) in zip(self._buckets + ("+Inf",), list(counts)):
+        cumulative += n
+        l.append('%s_bucket{%sle="%s"} %d' % (self._name, labels, bound, cumulative))
+      labels = labels.rstrip(",")
+      if labels:
+        labels = "{%s}" % (labels,)
+      l.append("%s_sum%s %s" % (self._name, labels, total))
+      l.append("%s_count%s %d" % (self._name, labels, cumulative))
+    return l
+
+class Registry:
+  """ The set of metrics a process exposes. """
+
+  def __init__(self):
+    self._metrics = []
+
+  def add(self, metric):
+    self._metrics.append(metric)
+    return metric
+
+  def render(self):
+    """ Returns all metrics in the Prometheus text exposition format. """
+    l = []
+    for metric in self._metrics:
+      l.extend(metric.render())
+    return "\n".join(l) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split("?")[0] not in ("/", "/metrics"):
+      self.send_error(404)
+      return
+    body = self.server.registry.render()
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+def serve(registry, port, addr = "127.0.0.1", sock = None):
+  """
+  Serve registry at http://addr:port/metrics from a daemon thread, or
+  on the listening socket sock, if given, such as one taken over from
+  another process.  Returns the HTTPServer.
+  """
+  if sock is not None:
+    httpd = HTTPServer(sock.getsockname(), _MetricsHandler,
+                       bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    (httpd.server_name, httpd.server_port) = sock.getsockname()[:2]
+  else:
+    httpd = HTTPServer((addr, port), _MetricsHandler)
+  httpd.registry = registry
+  t = Thread(target=httpd.serve_forever, name="metrics")
+  t.daemon = True
+  t.start()
+  return httpd
+
+def scrape(url):
+  """ Fetch url and return [(sample name with labels, value)] for every
+  sample in it, e.g. ('ncsdns_queries_total', 42.0). """
+  samples = []
+  for line in urllib2.urlopen(url, timeout=5).read().splitlines():
+    if line and not line.startswith("#"):
+      (name, value) = line.rsplit(" ", 1)
+      samples.append((name, float(value)))
+  return samples
@@ -0,0 +1,160 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" A sampling profiler that can be switched on in a running server
+and writes collapsed stacks for flame graphs. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Samples are taken by a background thread reading the stack of the
+# profiled thread with sys._current_frames(), rather than by a timer
+# signal: a signal arriving while the server waits on a socket with a
+# timeout would interrupt the wait with EINTR.  The profiled thread
+# does no extra work, so the cost is one stack walk per interval.
+#
+# The output has one line per distinct stack, root first, as read by
+# flamegraph.pl and speedscope:
+#
+#   <module> (ncsdns.py:10);main (server.py:889);run (server.py:831);_wait (server.py:800) 12
+#
+# Sampling is by wall clock, so time spent waiting for upstream replies
+# or for the next client query shows up as well as time computing.
+
+import logging, os, signal, sys, threading, time
+
+_log = logging.getLogger(__name__)
+
+# Default sampling interval and profile length, in seconds.
+INTERVAL = 0.005
+DURATION = 30
+
+class SamplingProfiler:
+  """
+  Samples the stack of one thread at a fixed interval.
+
+  Member variables:
+
+  _ident -- the thread identifier of the profiled thread.
+
+  _stacks -- [collapsed stack string --> number of samples].
+
+  _samples -- the number of samples taken so far.
+  """
+
+  def __init__(self, ident = None, interval = INTERVAL):
+    self._ident = ident if ident is not None else threading.current_thread().ident
+    self._interval = interval
+    self._stacks = dict()
+    self._samples = 0
+    self._labels = dict() # (code, line) --> frame label
+    self._thread = None
+    self._stop = threading.Event()
+
+  def running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def start(self, duration, path):
+    """ Sample for duration seconds, or until stop(), in a background
+    thread, then write the collapsed stacks to path. """
+    self._stacks = dict()
+    self._samples = 0
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, args=(duration, path),
+                                    name="profiler")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """ End the profile early; it is still written out. """
+    self._stop.set()
+
+  def _label(self, frame):
+    key = (frame.f_code, frame.f_lineno)
+    label = self._labels.get(key)
+    if label is None:
+      label = self._labels[key] = "%s (%s:%d)" % \
+        (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename),
+         frame.f_lineno)
+    return label
+
+  def sample(self):
+    """ Record the current stack of the profiled thread. """
+    frame = sys._current_frames().get(self._ident)
+    if frame is None:
+      return
+    labels = []
+    while frame is not None:
+      labels.append(self._label(frame))
+      frame = frame.f_back
+    labels.reverse()
+    stack = ";".join(labels)
+    self._stacks[stack] = self._stacks.get(stack, 0) + 1
+    self._samples += 1
+
+  def _run(self, duration, path):
+    _log.info("profiling for %gs, sampling every %gms", duration,
+              self._interval * 1000)
+    start = time.time()
+    deadline = start + duration
+    while not self._stop.is_set():
+      now = time.time()
+      if now >= deadline:
+        break
+      self.sample()
+      self._stop.wait(self._interval)
+    try:
+      self.write(path)
+    except IOError, e:
+      _log.error("could not write profile to %s: %s", path, e)
+    else:
+      _log.info("wrote %d samples over %.1fs to %s", self._samples,
+                time.time() - start, path)
+
+  def write(self, path):
+    """ Write the collapsed stacks to path. """
+    tmp = path + ".tmp"
+    f = open(tmp, "w")
+    for (stack, n) in sorted(self._stacks.items()):
+      f.write("%s %d\n" % (stack, n))
+    f.close()
+    os.rename(tmp, path)
+
+def install(signum = signal.SIGUSR1, duration = DURATION, interval = INTERVAL,
+            directory = "."):
+  """
+  Make signal signum toggle profiling of the calling thread: the first
+  signal starts a profile of duration seconds, written to
+  directory/ncsdns.<time>.folded, and a second one ends it early.
+  Call from the main thread.  Returns the SamplingProfiler.
+  """
+  profiler = SamplingProfiler(interval=interval)
+
+  def handler(signum, frame):
+    if profiler.running():
+      profiler.stop()
+      return
+    path = os.path.join(directory,
+                        "ncsdns.%s.folded" % (time.strftime("%Y%m%d-%H%M%S"),))
+    profiler.start(duration, path)
+
+  signal.signal(signum, handler)
+  # Let a blocking receive resume after the handler instead of failing.
+  signal.siginterrupt(signum, False)
+  return profiler
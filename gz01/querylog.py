@@ -0,0 +1,241 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Compact binary logs of client queries, and pcap query extraction. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# A query log is the 8-byte MAGIC followed by one record per query:
+#
+#   timestamp     8 bytes, IEEE double, seconds since the epoch
+#   addrlen       1 byte, 4 (IPv4) or 16 (IPv6)
+#   addr          addrlen bytes, client address in network order
+#   port          2 bytes, client port
+#   qtype         2 bytes
+#   namelen       1 byte
+#   name          namelen bytes, the canonical key of the query name
+#                 (see gz01.inetlib.types.DomainName)
+#
+# A log may also hold a record per reply, telling what the answer was
+# and for how long it could be cached, for gz01.testlib.cachesim to
+# learn TTLs from.  It has an addrlen of 0, and in place of the client
+# address and port:
+#
+#   rcode         1 byte
+#   ttl           4 bytes, seconds the answer could be cached for: the
+#                 least TTL of its RRs, or its negative TTL; 0 if it
+#                 was not cacheable or is not known
+#
+# followed by qtype, namelen and name as for a query.
+#
+# All integers are big-endian.  A typical record is 30-40 bytes.
+
+import struct
+from socket import inet_ntop, inet_pton, AF_INET, AF_INET6
+
+from gz01.inetlib.types import DomainName
+
+MAGIC = "NCSQLOG1"
+
+_RECORD = struct.Struct(">dB")
+_TAIL = struct.Struct(">HHB")
+_RESPONSE = struct.Struct(">BIHB")
+
+# The kinds of record read_records() yields.
+QUERY = "query"
+RESPONSE = "response"
+
+class QueryLogWriter:
+  """ Appends query records to a query log file. """
+
+  def __init__(self, path, bufsize = 1 << 16):
+    self._f = open(path, "wb", bufsize)
+    self._f.write(MAGIC)
+    self._records = 0
+
+  def write(self, timestamp, address, question):
+    """
+    Record a query.
+
+    address -- the (host, port) the query came from.
+    question -- the QE of the query.
+    """
+    (host, port) = address[:2]
+    addr = inet_pton(AF_INET6 if ":" in host else AF_INET, host)
+    key = question._dn._key
+    self._f.write("".join([_RECORD.pack(timestamp, len(addr)), addr,
+                           _TAIL.pack(port, question._type, len(key)), key]))
+    self._records += 1
+
+  def writeResponse(self, timestamp, question, rcode, ttl):
+    """ Record the reply to a query about question, with rcode, whose
+    answer could be cached for ttl seconds. """
+    key = question._dn._key
+    self._f.write("".join([_RECORD.pack(timestamp, 0),
+                           _RESPONSE.pack(rcode, max(0, min(ttl, 0xFFFFFFFF)),
+                                          question._type, len(key)), key]))
+    self._records += 1
+
+  def flush(self):
+    self._f.flush()
+
+  def close(self):
+    self._f.close()
+
+def read_records(path):
+  """
+  Yields every record of the query log at path, in order: (QUERY,
+  timestamp, packed client address, client port, qtype, name key) for
+  a query, and (RESPONSE, timestamp, rcode, ttl, qtype, name key) for
+  a reply.  Name keys are canonical keys (see
+  gz01.inetlib.types.DomainName).
+  """
+  f = open(path, "rb", 1 << 16)
+  if f.read(len(MAGIC)) != MAGIC:
+    f.close()
+    raise ValueError("%s is not a query log" % (path,))
+  while True:
+    head = f.read(_RECORD.size)
+    if len(head) < _RECORD.size:
+      break
+    (timestamp, addrlen) = _RECORD.unpack(head)
+    if addrlen == 0:
+      tail = f.read(_RESPONSE.size)
+      if len(tail) < _RESPONSE.size:
+        break
+      (rcode, ttl, qtype, namelen) = _RESPONSE.unpack(tail)
+      record = (RESPONSE, timestamp, rcode, ttl, qtype)
+    else:
+      addr = f.read(addrlen)
+      tail = f.read(_TAIL.size)
+      if len(tail) < _TAIL.size:
+        break
+      (port, qtype, namelen) = _TAIL.unpack(tail)
+      record = (QUERY, timestamp, addr, port, qtype)
+    key = f.read(namelen)
+    if len(key) < namelen:
+      break # truncated by a crash
+    yield record + (key,)
+  f.close()
+
+def read_querylog(path):
+  """
+  Yields a tuple (timestamp, client address, client port, query name,
+  qtype) for every query recorded in the query log at path.  Query
+  names are '.'-terminated strings.
+  """
+  for (kind, timestamp, addr, port, qtype, key) in read_records(path):
+    if kind == QUERY:
+      yield (timestamp, inet_ntop(AF_INET6 if len(addr) == 16 else AF_INET, addr),
+             port, str(DomainName.fromKey(key)), qtype)
+
+# pcap link-layer header types we can decode.
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPES = (LINKTYPE_NULL, LINKTYPE_ETHERNET, LINKTYPE_RAW,
+             LINKTYPE_LINUX_SLL, LINKTYPE_IPV4, LINKTYPE_IPV6)
+
+def read_pcap(path, port = 53):
+  """
+  Yields a tuple (timestamp, client address, client port, query name,
+  qtype), as read_querylog does, for every UDP DNS query to port
+  found in the classic-format pcap file at path.
+  """
+  f = open(path, "rb", 1 << 16)
+  head = f.read(24)
+  (magic,) = struct.unpack("<I", head[:4])
+  if magic in (0xa1b2c3d4, 0xa1b23c4d):
+    endian = "<"
+  elif magic in (0xd4c3b2a1, 0x4d3cb2a1):
+    endian = ">"
+  else:
+    f.close()
+    raise ValueError("%s is not a pcap file" % (path,))
+  nanos = magic in (0xa1b23c4d, 0x4d3cb2a1)
+  (linktype,) = struct.unpack(endian + "I", head[20:24])
+  if linktype not in LINKTYPES:
+    f.close()
+    raise ValueError("%s: unsupported pcap link type %d" % (path, linktype))
+  rechead = struct.Struct(endian + "4I")
+  while True:
+    h = f.read(rechead.size)
+    if len(h) < rechead.size:
+      break
+    (sec, frac, caplen, origlen) = rechead.unpack(h)
+    frame = f.read(caplen)
+    timestamp = sec + frac / (1e9 if nanos else 1e6)
+    try:
+      query = _decode_frame(frame, linktype, port)
+    except (struct.error, IndexError, ValueError):
+      continue # a malformed frame
+    if query is not None:
+      yield (timestamp,) + query
+  f.close()
+
+def _decode_frame(frame, linktype, port):
+  """ Returns (client, client port, query name, qtype) if frame holds
+  a DNS query to port, and None otherwise. """
+  if linktype == LINKTYPE_ETHERNET:
+    (ethertype,) = struct.unpack_from(">H", frame, 12)
+    offset = 14
+    while ethertype == 0x8100: # 802.1Q VLAN tag
+      (ethertype,) = struct.unpack_from(">H", frame, offset + 2)
+      offset += 4
+  elif linktype == LINKTYPE_LINUX_SLL:
+    (ethertype,) = struct.unpack_from(">H", frame, 14)
+    offset = 16
+  elif linktype == LINKTYPE_NULL:
+    (family,) = struct.unpack_from("=I", frame, 0)
+    ethertype = 0x0800 if family == 2 else 0x86dd
+    offset = 4
+  elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+    ethertype = 0x0800 if ord(frame[0]) >> 4 == 4 else 0x86dd
+    offset = 0
+  else:
+    raise ValueError("unsupported pcap link type %d" % (linktype,))
+
+  if ethertype == 0x0800:
+    ihl = (ord(frame[offset]) & 0xF) * 4
+    if ord(frame[offset + 9]) != 17: # UDP
+      return None
+    client = inet_ntop(AF_INET, frame[offset + 12:offset + 16])
+    offset += ihl
+  elif ethertype == 0x86dd:
+    if ord(frame[offset + 6]) != 17: # UDP, without extension headers
+      return None
+    client = inet_ntop(AF_INET6, frame[offset + 8:offset + 24])
+    offset += 40
+  else:
+    return None
+
+  (sport, dport) = struct.unpack_from(">2H", frame, offset)
+  if dport != port:
+    return None
+  dns = frame[offset + 8:]
+  (flags, qdcount) = struct.unpack_from(">2H", dns, 2)
+  if flags & 0x8000 or qdcount < 1: # a response, or no question
+    return None
+  dn = DomainName.fromData(dns, 12)
+  (qtype,) = struct.unpack_from(">H", dns, 12 + len(dn))
+  return (client, sport, str(dn), qtype)
@@ -0,0 +1,88 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Token-bucket rate limits per client address prefix. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import OrderedDict
+from socket import inet_ntop, inet_pton, AF_INET, AF_INET6
+
+# What to do with a query or response over its client's limit.
+ACTION_DROP = "drop"         # send nothing
+ACTION_TRUNCATE = "truncate" # an empty reply with TC set, so that a
+                             # real client retries over TCP
+ACTION_REFUSE = "refuse"     # an empty REFUSED reply
+ACTIONS = (ACTION_DROP, ACTION_TRUNCATE, ACTION_REFUSE)
+
+def client_prefix(host, prefixlen = 24, prefixlen6 = 56):
+  """ Returns the network of host, e.g. "192.0.2.0/24", that clients
+  are grouped by: spoofed sources are usually spread over a network
+  rather than a single address. """
+  if ":" in host:
+    (family, addrlen, prefixlen) = (AF_INET6, 16, prefixlen6)
+  else:
+    (family, addrlen) = (AF_INET, 4)
+  addr = inet_pton(family, host)
+  (full, rest) = divmod(prefixlen, 8)
+  masked = addr[:full]
+  if rest:
+    masked += chr(ord(addr[full]) & (0xFF << (8 - rest)) & 0xFF)
+  masked += "\x00" * (addrlen - len(masked))
+  return "%s/%d" % (inet_ntop(family, masked), prefixlen)
+
+class RateLimiter:
+  """
+  A token bucket per client prefix: each prefix may send rate events a
+  second on average, in bursts of up to burst.
+
+  Member variables:
+
+  _buckets -- [prefix --> [tokens, time of last update]], least
+  recently used first.  At most _maxclients prefixes are tracked; the
+  least recently used is forgotten to make room for a new one, which
+  only ever lets that prefix start again with a full bucket.
+  """
+
+  def __init__(self, rate, burst = None, maxclients = 10000):
+    self._rate = float(rate)
+    self._burst = float(burst if burst is not None else max(rate, 1))
+    self._maxclients = maxclients
+    self._buckets = OrderedDict()
+
+  def allow(self, prefix, now):
+    """ Take a token from prefix's bucket at time now; returns whether
+    there was one. """
+    bucket = self._buckets.pop(prefix, None)
+    if bucket is None:
+      if len(self._buckets) >= self._maxclients:
+        self._buckets.popitem(last=False)
+      bucket = [self._burst, now]
+    else:
+      bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+      bucket[1] = now
+    self._buckets[prefix] = bucket
+    if bucket[0] >= 1.0:
+      bucket[0] -= 1.0
+      return True
+    return False
+
+  def __len__(self):
+    return len(self._buckets)
@@ -0,0 +1,1992 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" An iterative resolver with its caches, usable outside the server:
+
+  from gz01.resolver import Resolver
+  resolver = Resolver()
+  results = resolver.resolve_many(["www.example.com", "example.org"])
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Every name is resolved by a Resolution, which only decides what to do
+# next; Resolver._run() does the I/O for any number of them at once,
+# from one socket, waiting for whichever reply or timeout comes first.
+# Resolutions running together share the cache, and also their work:
+#
+#  - the same question to the same server is sent once, and its reply
+#    given to every Resolution that asked it;
+#  - a lookup of a name server address needed by several Resolutions
+#    is done once;
+#  - while the first query to a zone's servers for names below one of
+#    its children (say, for www.example.com to the servers of com) is
+#    outstanding, other Resolutions about to ask the zone about names
+#    below the same child wait for it.  If it brings a referral to a
+#    zone they are below as well, they carry on from there, so that
+#    resolving a thousand names in one domain asks the root and the
+#    TLD servers once rather than a thousand times.
+#
+# Results are dicts, as used by the server:
+#
+#   {'rcode': Header.RCODE_NOERR, 'answers': [RR], 'authority': [RR_NS],
+#    'additional': [RR_A]}
+#
+# with only 'rcode' if there is no answer.  The answers are the RRset
+# of the type asked for, owned by the name asked about even when it
+# was found through CNAMEs.
+#
+# Names below a domain that has forwarders are resolved by a
+# Forwarding instead, which asks the domain's ForwarderPool once.  Its
+# reply is waited for alongside those of name servers, and a question
+# already being forwarded is not forwarded again.
+
+import errno, heapq, logging, os, random, time
+from collections import OrderedDict
+from copy import copy
+from select import select, error as select_error
+from socket import socket, inet_aton, inet_ntoa, inet_pton, inet_ntop, \
+  has_ipv6, AF_INET, AF_INET6, SOCK_DGRAM, IPPROTO_IPV6, IPV6_V6ONLY, error
+from sys import maxint as MAXINT
+
+from gz01.clock import Clock
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import RR, RR_A, RR_AAAA, RR_NS, RR_CNAME
+from gz01.inetlib.types import DomainName
+from gz01.metrics import Counter, LabeledCounter, Gauge, Registry
+from gz01 import tracing
+from gz01.tracing import traced
+
+_log = logging.getLogger(__name__)
+
+# timeout in seconds to wait for reply
+TIMEOUT = 5
+DNS_PORT = 53
+
+# Tries multiple times to send a packet
+MAX_TRY = 3
+
+# Each try waits RTO_FACTOR times the server's smoothed RTT, at least
+# RTO_MIN seconds, or INITIAL_RTO seconds if its RTT is not known,
+# doubling with every try, up to TIMEOUT.  A query that times out is
+# only sent again if the Resolutions waiting on it have no other
+# server to ask.
+RTO_FACTOR = 4
+RTO_MIN = 0.05
+INITIAL_RTO = 1.0
+
+# Seconds a name is resolved for at most, unless told otherwise.
+RESOLVE_TIMEOUT = 4.0
+
+# Work budget of one name's resolution, lookups of name server
+# addresses included: at most MAX_QUERIES upstream queries, retries
+# included, and MAX_CNAME_DEPTH CNAMEs followed, done by its deadline.
+# A name server address lookup may itself need lookups, at most
+# MAX_LOOKUP_DEPTH deep.
+MAX_QUERIES = 64
+MAX_CNAME_DEPTH = 8
+MAX_LOOKUP_DEPTH = 3
+
+# Names resolve_many() resolves at once, by default.
+CONCURRENCY = 100
+
+# A server that times out, gives a lame referral or fails with REFUSED,
+# SERVFAIL or NOTIMP is marked down for INFRA_BACKOFF seconds, doubling
+# with every further failure up to INFRA_BACKOFF_MAX.  Down servers are
+# not queried, except for one probe each time the backoff runs out.
+INFRA_BACKOFF = 5
+INFRA_BACKOFF_MAX = 600
+INFRA_MAX = 10000
+
+# TTL of addresses served after they expired.
+STALE_TTL = 30
+
+# What makes room in a Cache limited to a number of entries, once it is
+# full: the least recently used entry, the one cached first, or the one
+# closest to expiring.
+POLICY_LRU = "lru"
+POLICY_FIFO = "fifo"
+POLICY_TTL = "ttl"
+POLICIES = (POLICY_LRU, POLICY_FIFO, POLICY_TTL)
+
+# Most seconds a negative answer (NXDOMAIN, or no RRs of the type
+# asked for) is cached for, whatever its SOA says (RFC 2308).
+NEGATIVE_TTL_MAX = 3600
+
+# Name servers whose smoothed RTT is within RTT_BAND seconds of the
+# fastest one's are asked in random order, to spread the load among
+# them.  Servers not measured yet count as the fastest, so that they
+# get measured.
+RTT_BAND = 0.05
+
+# The root hints file, naming the root name servers to start from.  At
+# startup, and whenever the root name servers cached expire, the root
+# is asked for its current servers (primed, RFC 8109); until that has
+# been done, the hints are used.  Priming that fails is tried again
+# after PRIME_RETRY seconds.
+ROOT_HINTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "named.root")
+PRIME_RETRY = 60
+
+# domain name given to a root name server known only by its address
+ROOTNS_DN = "f.root-servers.net."
+ROOT_KEY = DomainName(".")._key
+
+def load_root_hints(path = ROOT_HINTS):
+  """
+  Returns [(DomainName, [address])] of the root name servers in the
+  root hints file at path, which is in the master file format of
+  named.root.  Raises IOError if the file cannot be read, and
+  ValueError if it gives no root name server an address.
+  """
+  names = []
+  addrs = dict()
+  f = open(path)
+  for line in f:
+    fields = line.split(";", 1)[0].split()
+    # NAME [TTL] [CLASS] TYPE RDATA
+    if len(fields) < 3:
+      continue
+    (rrtype, rdata) = (fields[-2].upper(), fields[-1].lower())
+    dn = DomainName(fields[0].lower())
+    if rrtype == "NS" and dn._key == ROOT_KEY:
+      names.append(DomainName(rdata))
+    elif rrtype in ("A", "AAAA"):
+      try:
+        inet_pton(AF_INET if rrtype == "A" else AF_INET6, rdata)
+      except error:
+        raise ValueError("%s: bad address %r" % (path, rdata))
+      addrs.setdefault(dn._key, []).append(rdata)
+  f.close()
+  hints = [(nsdn, addrs[nsdn._key]) for nsdn in names if nsdn._key in addrs]
+  if not hints:
+    raise ValueError("%s: no root name server with an address" % (path,))
+  return hints
+
+def is_ipv6(address):
+  """ Returns whether the address string address is an IPv6 one. """
+  return ":" in address
+
+def parseSectionList(data, length, offset):
+  """
+  The answer section and the additional section might contain multiple records
+  This method iterates over the data and adds the records to the array
+  """
+  array = []
+
+  for i in range(length):
+    (rr, length) = RR.fromData(data, offset)
+    offset += length
+    array.append(rr)
+
+  return (array, offset)
+
+def parseDNSPacket(data):
+  """
+  Extracts useful DNS information from a binary format
+  """
+  newData = {
+    'header': None, 'question': None, 'answers': None, 'authority': None, 'additional': None
+  }
+  offset = 0
+
+  newData['header'] = Header.fromData(data, offset)
+  offset += newData['header'].__len__()
+  newData['question'] = QE.fromData(data, offset)
+  offset += newData['question'].__len__()
+
+  (newData['answers'], offset) = parseSectionList(data, newData['header']._ancount, offset)
+  (newData['authority'], offset) = parseSectionList(data, newData['header']._nscount, offset)
+  (newData['additional'], offset) = parseSectionList(data, newData['header']._arcount, offset)
+
+  return newData
+
+def constructDNSQuery(id, question):
+  """
+  Construct a query (in binary format), given an id and a QE object
+  """
+  header = Header(id, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1)
+  query = header.pack()
+  query += question.pack()
+  return query
+
+def rrsets(rrs):
+  """ Returns the RRs rrs grouped into RRsets, lists of the RRs with the
+  same owner, type and class, in the order they first appear. """
+  sets = dict()
+  order = []
+  for rr in rrs:
+    k = (rr._dn._key, rr._type, rr._class)
+    if k not in sets:
+      sets[k] = []
+      order.append(k)
+    sets[k].append(rr)
+  return [sets[k] for k in order]
+
+def renamed(rrs, dn, ttl = None):
+  """ Returns copies of the RRs rrs owned by dn, and with the TTL ttl
+  if it is given. """
+  l = []
+  for rr in rrs:
+    rr = copy(rr)
+    rr._dn = dn
+    if ttl is not None:
+      rr._ttl = ttl
+    l.append(rr)
+  return l
+
+def isSubdomainKey(key, zone):
+  """ Returns whether key is the key of a name strictly below zone's. """
+  key = DomainName.parentKey(key)
+  while key is not None:
+    if key == zone:
+      return True
+    key = DomainName.parentKey(key)
+  return False
+
+def childKey(key, zone):
+  """ Returns the key of the name one label below zone on the way to
+  key, which is zone's or below it. """
+  parent = DomainName.parentKey(key)
+  while parent is not None and parent != zone:
+    key = parent
+    parent = DomainName.parentKey(key)
+  return key
+
+class ACacheEntry:
+  ALPHA = 0.8
+
+  def __init__(self, dict, srtt = None):
+    self._srtt = srtt
+    self._dict = dict
+
+  def __repr__(self):
+    return "<ACE %s, srtt=%s>" % \
+      (self._dict, ("*" if self._srtt is None else self._srtt),)
+
+  def update_rtt(self, rtt):
+    old_srtt = self._srtt
+    self._srtt = rtt if self._srtt is None else \
+      (rtt*(1.0 - self.ALPHA) + self._srtt*self.ALPHA)
+    _log.debug("update_rtt: rtt %f updates srtt %s --> %s",
+       rtt, ("*" if old_srtt is None else old_srtt), self._srtt)
+
+class InfraCacheEntry:
+  """
+  What is known of one name server's health.
+
+  Member variables:
+
+  _downUntil -- the time until which the server is not queried, or 0.
+
+  _backoff -- the time it is marked down for after its next failure.
+
+  _failures -- failures since the server last answered properly.
+  """
+
+  def __init__(self):
+    self._srtt = None
+    self._downUntil = 0
+    self._backoff = INFRA_BACKOFF
+    self._failures = 0
+
+  def __repr__(self):
+    return "<ICE srtt=%s failures=%d down until %d>" % \
+      (("*" if self._srtt is None else self._srtt), self._failures,
+       self._downUntil,)
+
+  def usable(self, now):
+    """ Returns whether the server may be queried at time now; once
+    its backoff has run out, it may be probed by one query. """
+    if self._downUntil == 0:
+      return True
+    if now < self._downUntil:
+      return False
+    # Allow this probe, and keep others off until it has failed or
+    # succeeded.
+    self._downUntil = now + self._backoff
+    return True
+
+  def success(self, rtt):
+    self._srtt = rtt if self._srtt is None else \
+      (rtt*(1.0 - ACacheEntry.ALPHA) + self._srtt*ACacheEntry.ALPHA)
+    self._failures = 0
+    self._downUntil = 0
+    self._backoff = INFRA_BACKOFF
+
+  def failure(self, now):
+    self._failures += 1
+    self._downUntil = now + self._backoff
+    self._backoff = min(self._backoff * 2, INFRA_BACKOFF_MAX)
+
+class CacheEntry:
+  def __init__(self, expiration = MAXINT, authoritative = False):
+    self._expiration = expiration
+    self._authoritative = authoritative
+
+  def __repr__(self):
+    return "<CE exp=%d auth=%s>" % (self._expiration, self._authoritative,)
+
+class CnameCacheEntry:
+  def __init__(self, cname, expiration = MAXINT, authoritative = False):
+    self._cname = cname
+    self._expiration = expiration
+    self._authoritative = authoritative
+
+  def __repr__(self):
+    return "<CCE cname=%s exp=%d auth=%s>" % \
+           (self._cname, self._expiration, self._authoritative,)
+
+class RRsetCacheEntry:
+  def __init__(self, rrs, expiration = MAXINT):
+    self._rrs = rrs
+    self._expiration = expiration
+
+  def __repr__(self):
+    return "<RCE %s exp=%d>" % (self._rrs, self._expiration,)
+
+class NegativeCacheEntry:
+  def __init__(self, rcode, expiration):
+    self._rcode = rcode
+    self._expiration = expiration
+
+  def __repr__(self):
+    return "<NCE rcode=%d exp=%d>" % (self._rcode, self._expiration,)
+
+class Cache:
+  """
+  The address, name server, CNAME, RRset, negative answer and
+  infrastructure caches.
+
+  Member variables:
+
+  nscache -- [domain name key --> [nsdn --> CacheEntry]].
+
+  acache -- [domain name key --> ACacheEntry of [in_addr --> CacheEntry]].
+
+  cnamecache -- [domain name key --> CnameCacheEntry].
+
+  rrcache -- [(domain name key, type, class) --> RRsetCacheEntry] for
+  the RRsets answered of every other type and class; NS RRsets
+  answered are kept here too, apart from the delegations in nscache.
+
+  negcache -- [(domain name key, type, class) --> NegativeCacheEntry]
+  for names that do not exist, or have no RRs of the type.
+
+  infracache -- [server address --> InfraCacheEntry].
+
+  _hints -- [(DomainName, [address])] of the root name servers to fall
+  back on when none is cached.
+
+  _serveStale -- seconds that expired addresses are kept for
+  searchStale().
+
+  _maxEntries -- the most entries the address, CNAME, RRset and
+  negative caches hold together, or None for no limit.  The name
+  server and infrastructure caches, and the root hints, do not count.
+
+  _policy -- which entry makes room when they are full, one of
+  POLICIES.
+
+  _order -- [(cache label, key) --> expiration time] of the entries
+  that count, least recently used (or cached) first.
+
+  _expiries -- heap of (expiration time, cache label, key) of the
+  entries that count, for POLICY_TTL; items of entries since replaced
+  or removed are skipped.
+
+  _rrtypes -- the (type, class)es ever cached in the RRset and negative
+  caches, to find a name's entries there without going through them
+  all.
+
+  ipv6 -- whether the IPv6 addresses of name servers are used, besides
+  their IPv4 ones.
+
+  hits, misses, evictions, displaced -- counters by cache.
+  """
+
+  def __init__(self, hints = None, serveStale = 0, clock = time.time,
+               maxEntries = None, policy = POLICY_LRU):
+    """
+    hints -- the root name servers to start from, as returned by
+    load_root_hints(), by default those of ROOT_HINTS.
+    clock -- a function returning the current time in seconds, such
+    as the Clock of the Resolver using the cache.
+    """
+    if policy not in POLICIES:
+      raise ValueError("unknown cache policy %r" % (policy,))
+    self._hints = hints if hints is not None else load_root_hints()
+    self._serveStale = serveStale
+    self._clock = clock
+    self._maxEntries = maxEntries
+    self._policy = policy
+    self._order = OrderedDict()
+    self._expiries = []
+    self._rrtypes = set()
+    self.ipv6 = True
+    self.nscache = dict()
+    self.acache = dict()
+    self.rrcache = dict()
+    self.setHints()
+    self.cnamecache = dict()
+    self.negcache = dict()
+    self.infracache = dict()
+    self._tables = {'a': self.acache, 'cname': self.cnamecache,
+                    'rrset': self.rrcache, 'negative': self.negcache}
+    self.hits = LabeledCounter("ncsdns_cache_hits_total",
+      "Cache lookups that found an unexpired entry.", "cache")
+    self.misses = LabeledCounter("ncsdns_cache_misses_total",
+      "Cache lookups that found no unexpired entry.", "cache")
+    self.evictions = LabeledCounter("ncsdns_cache_evictions_total",
+      "Cache entries removed because they expired.", "cache")
+    self.displaced = LabeledCounter("ncsdns_cache_displaced_total",
+      "Cache entries removed to make room for others.", "cache")
+
+  def setHints(self):
+    """ Cache the root hints as the root name servers, until the root
+    is primed. """
+    self.nscache[ROOT_KEY] = dict([(nsdn,
+      CacheEntry(expiration=MAXINT, authoritative=True))
+      for (nsdn, addrs) in self._hints])
+    for (nsdn, addrs) in self._hints:
+      self.acache[nsdn._key] = ACacheEntry(dict([(ip,
+        CacheEntry(expiration=MAXINT, authoritative=True))
+        for ip in addrs if not is_ipv6(ip)]))
+      aaaa = [RR_AAAA(nsdn, 0, inet_pton(AF_INET6, ip))
+              for ip in addrs if is_ipv6(ip)]
+      if aaaa:
+        self._rrtypes.add((RR.TYPE_AAAA, RR.CLASS_IN))
+        self.rrcache[(nsdn._key, RR.TYPE_AAAA, RR.CLASS_IN)] = \
+          RRsetCacheEntry(aaaa, expiration=MAXINT)
+
+  def prime(self, ns, additional):
+    """
+    Replace the root name servers with the RR_NSs ns of a priming
+    reply, whose glue is additional.  Returns the time they expire.
+    """
+    now = int(self._clock())
+    self.nscache[ROOT_KEY] = dict([(rr._nsdn,
+      CacheEntry(expiration=rr._ttl+now, authoritative=True)) for rr in ns])
+    self.addAdditional(additional)
+    return min([rr._ttl for rr in ns]) + now
+
+  def __len__(self):
+    """ The number of entries in the address, CNAME, RRset and negative
+    caches. """
+    return len(self.acache) + len(self.cnamecache) + len(self.rrcache) + \
+           len(self.negcache)
+
+  def _cached(self, label, key, expiration):
+    """ Count the entry just cached under key in the cache label, until
+    expiration, making room for it if the cache is full. """
+    if self._maxEntries is None:
+      return
+    order = self._order
+    k = (label, key)
+    if k in order:
+      del order[k]
+    order[k] = expiration
+    if self._policy == POLICY_TTL:
+      heapq.heappush(self._expiries, (expiration, label, key))
+      if len(self._expiries) > 2 * len(order) + 64:
+        self._expiries = [(e, l, k1) for ((l, k1), e) in order.items()]
+        heapq.heapify(self._expiries)
+    while len(order) > self._maxEntries:
+      if self._policy == POLICY_TTL:
+        (e, l, k1) = heapq.heappop(self._expiries)
+        if order.get((l, k1)) != e:
+          continue
+        k = (l, k1)
+      else:
+        k = iter(order).next()
+      del order[k]
+      self._tables[k[0]].pop(k[1], None)
+      self.displaced.inc(k[0])
+
+  def _used(self, label, key):
+    """ Note a cache hit on the entry under key in the cache label. """
+    if self._policy == POLICY_LRU and self._maxEntries is not None:
+      expiration = self._order.pop((label, key), None)
+      if expiration is not None:
+        self._order[(label, key)] = expiration
+
+  def _forget(self, label, key):
+    """ Stop counting the entry under key in the cache label, once it
+    has been removed. """
+    if self._maxEntries is not None:
+      self._order.pop((label, key), None)
+
+  def keys(self, key, qtype = None, cls = QE.CLASS_IN):
+    """ Returns [(cache label, key)] under which RRs of type qtype of
+    the name whose key is key, and answers that it has none, may be
+    cached; those of every type if qtype is None. """
+    keys = []
+    if cls == QE.CLASS_IN and qtype in (None, RR.TYPE_A):
+      keys.append(('a', key))
+    if cls == QE.CLASS_IN and qtype in (None, RR.TYPE_CNAME):
+      keys.append(('cname', key))
+    if qtype is not None:
+      rrtypes = [(qtype, cls)]
+    else:
+      rrtypes = list(self._rrtypes)
+    for (t, c) in rrtypes:
+      keys.append(('rrset', (key, t, c)))
+      keys.append(('negative', (key, t, c)))
+    return keys
+
+  def cached(self, dn):
+    """ Returns [(cache label, key, entry)] of everything cached of dn,
+    its name servers included. """
+    found = [(label, key, self._tables[label][key])
+             for (label, key) in self.keys(dn._key)
+             if key in self._tables[label]]
+    if dn._key in self.nscache:
+      found.append(('ns', dn._key, self.nscache[dn._key]))
+    return found
+
+  def remove(self, dn, qtype = None, cls = QE.CLASS_IN, nameServers = False):
+    """ Removes what is cached of dn: its RRs of type qtype, and answers
+    that it has none, or everything if qtype is None, its name servers
+    only if nameServers.  Returns the number of entries removed. """
+    n = 0
+    for (label, key) in self.keys(dn._key, qtype, cls):
+      if self._tables[label].pop(key, None) is not None:
+        self._forget(label, key)
+        n += 1
+    if nameServers and dn._key != ROOT_KEY and \
+       self.nscache.pop(dn._key, None) is not None:
+      n += 1
+    return n
+
+  def removeKey(self, label, key):
+    """ Removes the entry under key in the cache label, as yielded by
+    entries(); returns whether there was one. """
+    if label == 'ns':
+      return key != ROOT_KEY and self.nscache.pop(key, None) is not None
+    table = self.infracache if label == 'infra' else self._tables[label]
+    if table.pop(key, None) is None:
+      return False
+    self._forget(label, key)
+    return True
+
+  def entries(self):
+    """ Yields (cache label, key, entry) for everything cached, name
+    servers and server health included, for load() into the Cache of
+    another process.  The keys of each cache are copied when it is
+    reached, so the caches may change while this is gone through. """
+    tables = dict(self._tables, ns=self.nscache, infra=self.infracache)
+    for (label, table) in tables.items():
+      for key in table.keys():
+        entry = table.get(key)
+        if entry is not None:
+          yield (label, key, entry)
+
+  def load(self, label, key, entry):
+    """ Cache entry, as yielded by entries(), in place of what is
+    cached under key. """
+    if label == 'ns':
+      self.nscache[key] = entry
+    elif label == 'infra':
+      self.infracache[key] = entry
+    else:
+      self._tables[label][key] = entry
+      if label == 'a':
+        self._cached(label, key, max([e._expiration
+                                      for e in entry._dict.values()] or [0]))
+      else:
+        if label in ('rrset', 'negative'):
+          self._rrtypes.add(key[1:])
+        self._cached(label, key, entry._expiration)
+
+  def addA(self, dn, ip, ttl):
+    value = CacheEntry(expiration=ttl+int(self._clock()), authoritative=True)
+    self.acache[dn._key] = ACacheEntry(dict([(ip, value)]))
+    self._cached('a', dn._key, value._expiration)
+
+  def addNS(self, dn, dn1, ttl):
+    value = CacheEntry(expiration=ttl+int(self._clock()), authoritative=True)
+    if dn._key in self.nscache:
+      self.nscache[dn._key][dn1] = value
+    else:
+      self.nscache[dn._key] = dict([(dn1, value)])
+
+  def addCNAME(self, dn, dn1, ttl):
+    entry = self.cnamecache[dn._key] = CnameCacheEntry(dn1,
+      expiration=ttl+int(self._clock()), authoritative=True)
+    self._cached('cname', dn._key, entry._expiration)
+
+  def addRRset(self, rrs):
+    """ Cache the RRset rrs, in place of what was cached of it. """
+    rr = rrs[0]
+    if rr._class == RR.CLASS_IN and rr._type == RR.TYPE_A:
+      now = int(self._clock())
+      self.acache[rr._dn._key] = ACacheEntry(dict([(inet_ntoa(a._addr),
+        CacheEntry(expiration=a._ttl+now, authoritative=True)) for a in rrs]))
+      self._cached('a', rr._dn._key, max([a._ttl for a in rrs]) + now)
+    elif rr._class == RR.CLASS_IN and rr._type == RR.TYPE_CNAME:
+      self.addCNAME(rr._dn, rr._cname, rr._ttl)
+    else:
+      key = (rr._dn._key, rr._type, rr._class)
+      self._rrtypes.add(key[1:])
+      entry = self.rrcache[key] = RRsetCacheEntry(rrs,
+        expiration=min([r._ttl for r in rrs])+int(self._clock()))
+      self._cached('rrset', key, entry._expiration)
+
+  def addNegative(self, dn, qtype, rcode, authority, cls = QE.CLASS_IN):
+    """ Cache that dn does not exist (rcode NAMEERR), or has no RRs of
+    type qtype (NOERR), for as long as the SOA in authority says.
+    Without an SOA, nothing is cached. """
+    for rr in authority:
+      if rr._type == RR.TYPE_SOA:
+        ttl = min(rr._ttl, rr._minimum, NEGATIVE_TTL_MAX)
+        key = (dn._key, qtype, cls)
+        self._rrtypes.add(key[1:])
+        expiration = ttl+int(self._clock())
+        self.negcache[key] = NegativeCacheEntry(rcode, expiration)
+        self._cached('negative', key, expiration)
+        return
+
+  def addAuthority(self, authorities):
+    for authority in authorities:
+      if authority._type != RR.TYPE_NS:
+        continue
+      self.addNS(authority._dn, authority._nsdn, authority._ttl)
+
+  def addAdditional(self, additionals):
+    for rrset in rrsets(additionals):
+      if rrset[0]._type in (RR.TYPE_A, RR.TYPE_AAAA):
+        self.addRRset(rrset)
+
+  def searchA(self, dn):
+    """
+    Searches if there is a direct answer in the acache
+    Returns False if no answer is found
+    """
+    entry = self.acache.get(dn._key)
+    if entry is not None:
+      now = int(self._clock())
+      answers = []
+      for ip in entry._dict.keys():
+        if entry._dict[ip]._expiration < now - self._serveStale:
+          del entry._dict[ip]
+          self.evictions.inc('a')
+        elif entry._dict[ip]._expiration < now:
+          continue # kept only for searchStale
+        else:
+          answers.append(RR_A(dn, entry._dict[ip]._expiration - now, inet_aton(ip)))
+      if answers:
+        self.hits.inc('a')
+        self._used('a', dn._key)
+        return {'answers': answers, 'authority': [], 'additional': [], 'rcode': Header.RCODE_NOERR}
+    self.misses.inc('a')
+    return False
+
+  def searchRRset(self, dn, qtype, cls = QE.CLASS_IN):
+    """
+    Searches the rrcache for the RRs of type qtype of dn
+    Returns False if none are found
+    """
+    entry = self.rrcache.get((dn._key, qtype, cls))
+    if entry is not None:
+      now = int(self._clock())
+      if entry._expiration < now - self._serveStale:
+        del self.rrcache[(dn._key, qtype, cls)]
+        self._forget('rrset', (dn._key, qtype, cls))
+        self.evictions.inc('rrset')
+      elif entry._expiration >= now:
+        self.hits.inc('rrset')
+        self._used('rrset', (dn._key, qtype, cls))
+        return {'answers': renamed(entry._rrs, dn, entry._expiration - now),
+                'authority': [], 'additional': [], 'rcode': Header.RCODE_NOERR}
+    self.misses.inc('rrset')
+    return False
+
+  def searchNegative(self, dn, qtype, cls = QE.CLASS_IN):
+    """
+    Searches the negcache for an answer that dn does not exist or has
+    no RRs of type qtype
+    Returns False if there is none
+    """
+    entry = self.negcache.get((dn._key, qtype, cls))
+    if entry is not None:
+      if entry._expiration < int(self._clock()):
+        del self.negcache[(dn._key, qtype, cls)]
+        self._forget('negative', (dn._key, qtype, cls))
+        self.evictions.inc('negative')
+      else:
+        self.hits.inc('negative')
+        self._used('negative', (dn._key, qtype, cls))
+        return {'rcode': entry._rcode}
+    self.misses.inc('negative')
+    return False
+
+  def searchStale(self, dn, qtype = RR.TYPE_A, cls = QE.CLASS_IN):
+    """
+    Returns an answer from RRs that expired less than serveStale
+    seconds ago, with a TTL of STALE_TTL, and False if there is none
+    """
+    now = int(self._clock())
+    if qtype == RR.TYPE_A and cls == QE.CLASS_IN:
+      entry = self.acache.get(dn._key)
+      answers = []
+      if entry is not None:
+        answers = [RR_A(dn, STALE_TTL, inet_aton(ip))
+                   for (ip, value) in entry._dict.items()
+                   if value._expiration >= now - self._serveStale]
+    else:
+      entry = self.rrcache.get((dn._key, qtype, cls))
+      answers = []
+      if entry is not None and entry._expiration >= now - self._serveStale:
+        answers = renamed(entry._rrs, dn, STALE_TTL)
+    if answers:
+      return {'answers': answers, 'authority': [], 'additional': [], 'rcode': Header.RCODE_NOERR}
+    return False
+
+  def searchCNAME(self, dn, qtype, addAuthority, depth = 0):
+    """
+    If no RRs of type qtype are found, try to find a cname and add the
+    appropriate NS and glue records, following at most
+    MAX_CNAME_DEPTH of them
+    @param addAuthority [Boolean value that shows whether it should add the authority]
+    """
+    entry = self.cnamecache.get(dn._key)
+    if entry is not None:
+      now = int(self._clock())
+      if entry._expiration < now:
+        del self.cnamecache[dn._key]
+        self._forget('cname', dn._key)
+        self.evictions.inc('cname')
+      elif qtype == RR.TYPE_CNAME:
+        self.hits.inc('cname')
+        self._used('cname', dn._key)
+        answer = RR_CNAME(dn, entry._expiration - now, entry._cname)
+        return {'answers': [answer], 'authority': [], 'additional': [], 'rcode': Header.RCODE_NOERR}
+      elif depth < MAX_CNAME_DEPTH:
+        self.hits.inc('cname')
+        self._used('cname', dn._key)
+        result = self.search(entry._cname, qtype, depth=depth + 1)
+        if result != False and 'answers' in result:
+          result['answers'] = renamed(result['answers'], dn)
+          if len(result['additional']) == 0 and len(result['authority']) == 0 and addAuthority:
+            result['authority'] = self.searchNS(entry._cname)
+            result['additional'] = self.findGlueRecords(result['authority'])
+        return result
+
+    self.misses.inc('cname')
+    return False
+
+  def searchNS(self, dn):
+    """
+    Searches the NS cache for the authority records, walking up
+    to the closest enclosing zone that has unexpired entries
+    Returns a list of RR_NS records
+    """
+    answer = []
+    key = dn._key
+    now = int(self._clock())
+    while key is not None:
+      entries = self.nscache.get(key)
+      if entries:
+        zone = dn if key is dn._key else DomainName.fromKey(key)
+        for dn1 in entries.keys():
+          if entries[dn1]._expiration < now:
+            del entries[dn1]
+            self.evictions.inc('ns')
+          else:
+            answer.append(RR_NS(zone, entries[dn1]._expiration - now, dn1))
+        if len(answer) > 0:
+          break
+      key = DomainName.parentKey(key)
+
+    if len(answer) > 0:
+      self.hits.inc('ns')
+    else:
+      self.misses.inc('ns')
+    return answer
+
+  def cachedAddresses(self, dn):
+    """
+    Returns the unexpired addresses cached for dn, IPv6 ones included
+    if they are used, without counting a cache lookup
+    """
+    now = int(self._clock())
+    addrs = []
+    entry = self.acache.get(dn._key)
+    if entry is not None:
+      addrs = [ip for (ip, value) in entry._dict.items() if value._expiration >= now]
+    if self.ipv6:
+      entry = self.rrcache.get((dn._key, RR.TYPE_AAAA, RR.CLASS_IN))
+      if entry is not None and entry._expiration >= now:
+        addrs.extend([inet_ntop(AF_INET6, rr._inaddr) for rr in entry._rrs])
+    return addrs
+
+  def serverAddresses(self, rrs):
+    """
+    Returns the addresses given by the A RRs of rrs, and by its AAAA
+    RRs if IPv6 addresses are used, as strings
+    """
+    addrs = []
+    for rr in rrs:
+      if rr._type == RR.TYPE_A:
+        addrs.append(inet_ntoa(rr._addr))
+      elif rr._type == RR.TYPE_AAAA and self.ipv6:
+        addrs.append(inet_ntop(AF_INET6, rr._inaddr))
+    return addrs
+
+  def findZoneCut(self, dn):
+    """
+    Returns (zone key, server addresses, names of servers without
+    addresses) for the closest enclosing zone of dn with unexpired name
+    servers in the cache, at least one of them with a known address
+    """
+    key = dn._key
+    while key is not None:
+      entries = self.nscache.get(key)
+      if entries:
+        now = int(self._clock())
+        addrs = []
+        glueless = []
+        for (nsdn, value) in entries.items():
+          if value._expiration < now:
+            continue
+          found = self.cachedAddresses(nsdn)
+          if found:
+            addrs.extend(found)
+          else:
+            glueless.append(nsdn)
+        if addrs:
+          return (key, self.orderServers(addrs), glueless)
+      key = DomainName.parentKey(key)
+    addrs = []
+    for (nsdn, hint) in self._hints:
+      addrs.extend([ip for ip in hint if self.ipv6 or not is_ipv6(ip)])
+    return (ROOT_KEY, self.orderServers(addrs), [])
+
+  def findGlueRecords(self, authorities):
+    """
+    Gets a list of RR_NS records and tries to find the
+    matching RR_A records.
+    """
+    answer = []
+    for authority in authorities:
+      result = self.search(authority._nsdn, addAuthority=False)
+      if result != False and 'answers' in result:
+        answer.extend(result['answers'])
+
+    return answer
+
+  @traced("cache", lambda self, dn, qtype=RR.TYPE_A, addAuthority=True, depth=0,
+                            cls=QE.CLASS_IN: {'name': str(dn), 'qtype': qtype},
+          detailed=True)
+  def search(self, dn, qtype=RR.TYPE_A, addAuthority=True, depth=0,
+             cls=QE.CLASS_IN):
+    """
+    Returns a dictionary when an answer to a question of type qtype
+    and class cls about dn is found in cache, negative ones included,
+    and False otherwise
+    """
+    if cls != QE.CLASS_IN:
+      result = self.searchRRset(dn, qtype, cls)
+      if result != False:
+        return result
+      return self.searchNegative(dn, qtype, cls)
+    if qtype == RR.TYPE_A:
+      result = self.searchA(dn)
+    elif qtype != RR.TYPE_CNAME:
+      result = self.searchRRset(dn, qtype)
+    else:
+      result = False
+    if result != False:
+      return result
+    result = self.searchCNAME(dn, qtype, addAuthority, depth)
+    if result != False:
+      return result
+    return self.searchNegative(dn, qtype)
+
+  def infraEntry(self, address):
+    """ Returns the InfraCacheEntry of the server at address. """
+    entry = self.infracache.get(address)
+    if entry is None:
+      if len(self.infracache) >= INFRA_MAX:
+        # Forget healthy servers first; they have the least to remember.
+        for a in [a for (a, e) in self.infracache.items() if e._downUntil == 0]:
+          del self.infracache[a]
+      entry = self.infracache[address] = InfraCacheEntry()
+    return entry
+
+  def serverOrder(self, address):
+    """ Sort key putting usable servers first, fastest first. """
+    entry = self.infracache.get(address)
+    if entry is None:
+      return (0, 0)
+    return (1 if entry._downUntil > self._clock() else 0, entry._srtt or 0)
+
+  def orderServers(self, addrs):
+    """ Sorts the server addresses addrs by serverOrder(), the servers
+    within RTT_BAND of the best one in random order, and returns
+    them. """
+    addrs.sort(key=self.serverOrder)
+    (down, best) = self.serverOrder(addrs[0]) if addrs else (0, 0)
+    n = 1
+    while n < len(addrs):
+      (d, srtt) = self.serverOrder(addrs[n])
+      if d != down or srtt > best + RTT_BAND:
+        break
+      n += 1
+    if n > 1:
+      band = addrs[:n]
+      random.shuffle(band)
+      addrs[:n] = band
+    return addrs
+
+class UdpTransport:
+  """
+  Sends queries to name servers, and receives their replies, on one
+  UDP socket: an IPv6 one, which reaches IPv4 addresses too as
+  IPv4-mapped ones, or an IPv4 one if IPv6 is not available or not
+  wanted.
+
+  Member variables:
+
+  ipv6 -- whether name servers can be sent to at IPv6 addresses.
+  """
+
+  def __init__(self, port = DNS_PORT, ipv6 = True):
+    self._port = port
+    self._sock = None
+    if ipv6 and has_ipv6:
+      try:
+        self._sock = socket(AF_INET6, SOCK_DGRAM)
+        self._sock.setsockopt(IPPROTO_IPV6, IPV6_V6ONLY, 0)
+      except error, e:
+        _log.warning("cannot open an IPv6 socket, using IPv4 only: %s", e)
+        if self._sock is not None:
+          self._sock.close()
+          self._sock = None
+    self.ipv6 = self._sock is not None
+    if self._sock is None:
+      self._sock = socket(AF_INET, SOCK_DGRAM)
+
+  def fileno(self):
+    return self._sock.fileno()
+
+  def send(self, packet, address):
+    """ Sends packet to the name server at the address string address.
+    Raises socket.error if it cannot be sent. """
+    if self.ipv6 and not is_ipv6(address):
+      address = "::ffff:" + address
+    self._sock.sendto(packet, (address, self._port))
+
+  def receive(self, timeout):
+    """ Returns (data, server address) of the next datagram to arrive
+    within timeout seconds, or None. """
+    try:
+      (rds, wds, xds) = select([self._sock], [], [], max(timeout, 0))
+    except select_error, e:
+      if e.args[0] != errno.EINTR:
+        raise
+      return None # interrupted by a signal; the caller waits again
+    if not rds:
+      return None
+    try:
+      (data, address) = self._sock.recvfrom(512)
+    except error:
+      return None
+    address = address[0]
+    if address.startswith("::ffff:") and "." in address:
+      address = address[7:]
+    return (data, address)
+
+  def close(self):
+    self._sock.close()
+
+class Budget:
+  """
+  The work that resolving one name may take, the lookups of name
+  server addresses it needs included.
+
+  Member variables:
+
+  _queries -- upstream queries sent so far.
+
+  _deadline -- the time by which resolution is to be done.
+  """
+
+  def __init__(self, deadline, maxQueries = MAX_QUERIES,
+               maxCnames = MAX_CNAME_DEPTH):
+    self._queries = 0
+    self._deadline = deadline
+    self._maxQueries = maxQueries
+    self._maxCnames = maxCnames
+
+  def charge(self, queries):
+    self._queries += queries
+
+  def exceeded(self, now):
+    """ Returns which limit has been reached at time now, or None. """
+    if self._queries >= self._maxQueries:
+      return "queries"
+    if now >= self._deadline:
+      return "time"
+    return None
+
+class Resolution:
+  """
+  The state of resolving one question iteratively, from the closest
+  zone cut in the cache down.  It does no I/O itself: step() says what
+  is to be done next, and the caller does it and reports back with
+  receive().  Lookups of name server addresses are Resolutions of their
+  own, which the caller runs alongside and reports on with
+  lookupDone().
+
+  Member variables:
+
+  _question -- the QE being asked: the original question, or the
+  target of the last CNAME followed.
+
+  _chain -- the CNAME RRs followed so far.
+
+  _zone -- the key of the current zone cut.
+
+  _servers -- addresses of the zone's name servers not yet asked, best
+  first.
+
+  _glueless -- names of the zone's name servers whose addresses are
+  not known, to be looked up if the servers run out.
+
+  _pending -- the number of lookups for the current zone cut started
+  and not done yet.
+
+  _cut -- counts the zone cuts this Resolution has been at, so that a
+  lookup done for an earlier one is told apart.
+
+  _parent -- the Resolution this one looks up a name server address
+  for, or None.
+
+  _budget -- the Budget shared with the parent and its other lookups.
+
+  server -- the address to send the question to, when step() returned
+  QUERY.
+
+  children -- lookups started since the caller last took them, for it
+  to run and report on with lookupDone().
+
+  waiting -- whether step() returned WAIT: nothing is to be done until
+  a lookup is done.
+
+  result -- the result dict, once step() returned DONE.
+  """
+
+  QUERY = "query"
+  WAIT = "wait"
+  DONE = "done"
+
+  def __init__(self, resolver, question, budget, parent = None):
+    self._resolver = resolver
+    self._cache = resolver.cache
+    self._dn = question._dn
+    self._question = question
+    self._chain = []
+    self._budget = budget
+    self._parent = parent
+    self._depth = 0 if parent is None else parent._depth + 1
+    self._pending = 0
+    self._cut = 0
+    self.server = None
+    self.children = []
+    self.waiting = False
+    self.result = None
+    self._start(question._dn)
+
+  def _start(self, dn):
+    self._setCut(*self._cache.findZoneCut(dn))
+
+  def _setCut(self, zone, servers, glueless):
+    self._zone = zone
+    self._servers = servers
+    self._glueless = glueless
+    self._pending = 0
+    self._cut += 1
+
+  def restart(self):
+    """ Carry on from a closer zone cut, if one has been cached since
+    this Resolution found its current one. """
+    cut = self._cache.findZoneCut(self._question._dn)
+    if cut[0] != self._zone and isSubdomainKey(cut[0], self._zone):
+      self._setCut(*cut)
+
+  def _finish(self, result):
+    self.result = result
+    return Resolution.DONE
+
+  def _fail(self, limit):
+    self._resolver.statBudgetExceeded.inc(limit)
+    _log.debug("resolution of %s over its %s limit", self._dn, limit)
+    return self._finish({'rcode': Header.RCODE_SRVFAIL})
+
+  def _looksUp(self, key):
+    """ Returns whether key is being looked up by this Resolution or
+    one of its parents, so that a lookup of it would never end. """
+    r = self
+    while r is not None:
+      if r._question._dn._key == key:
+        return True
+      r = r._parent
+    return False
+
+  def step(self, now):
+    """ Returns what is to be done next: QUERY, WAIT or DONE. """
+    self.waiting = False
+    if self.result is not None:
+      return Resolution.DONE
+    limit = self._budget.exceeded(now)
+    if limit == "time":
+      self._resolver.statDeadline.inc()
+      return self._finish({'rcode': Header.RCODE_SRVFAIL})
+    elif limit is not None:
+      return self._fail(limit)
+    if self._servers:
+      self.server = self._servers.pop(0)
+      return Resolution.QUERY
+    if self._glueless:
+      self._lookUp(self._budget)
+      if self.result is not None:
+        return Resolution.DONE
+    if self._pending:
+      self.waiting = True
+      return Resolution.WAIT
+    return self._finish({'rcode': Header.RCODE_SRVFAIL})
+
+  def _lookUp(self, budget):
+    """ Start lookups of the addresses of all the glueless servers at
+    once, within budget. """
+    names = [nsdn for nsdn in self._glueless if not self._looksUp(nsdn._key)]
+    self._glueless = []
+    if not names:
+      return
+    if self._depth >= MAX_LOOKUP_DEPTH:
+      if not self._servers:
+        self._fail("depth")
+      return
+    for nsdn in names:
+      child = Resolution(self._resolver, QE(dn=nsdn), budget, self)
+      child._forCut = self._cut
+      self.children.append(child)
+    self._pending += len(names)
+
+  def lookupDone(self, child, cut):
+    """ Takes the addresses child found, if any, as servers to ask,
+    unless the lookup was for a zone cut other than the current one,
+    the cut-th.  A server found to have no IPv4 address has its IPv6
+    addresses looked up next, if they are used. """
+    if cut != self._cut:
+      return
+    self._pending -= 1
+    addrs = self._cache.serverAddresses(child.result.get('answers', []))
+    self._servers.extend(addrs)
+    if not addrs and child._question._type == RR.TYPE_A and self._cache.ipv6 \
+       and child.result.get('rcode') == Header.RCODE_NOERR:
+      lookup = Resolution(self._resolver, QE(type=RR.TYPE_AAAA, dn=child._dn),
+                          child._budget, self)
+      lookup._forCut = cut
+      self.children.append(lookup)
+      self._pending += 1
+
+  def receive(self, data):
+    """ Takes the reply from server, or None if it did not answer. """
+    server = self.server
+    self.server = None
+    if data is None:
+      return
+    reply = parseDNSPacket(data)
+    rcode = reply['header']._rcode
+    if rcode == Header.RCODE_NAMEERR:
+      self._cache.addNegative(self._question._dn, self._question._type,
+                              rcode, reply['authority'], self._question._class)
+      self._finish({'rcode': Header.RCODE_NAMEERR})
+    elif rcode != Header.RCODE_NOERR:
+      # REFUSED, SERVFAIL and the like: try another server.
+      self._resolver.serverFailed(server, "rcode")
+    elif reply['answers']:
+      self._answer(reply['answers'])
+    else:
+      self._referral(server, reply)
+
+  def _answer(self, answers):
+    qtype = self._question._type
+    key = self._question._dn._key
+    followed = False
+    # The reply may hold the whole CNAME chain and the RRset at its
+    # end, or only its first links.
+    for i in range(len(answers)):
+      found = [rr for rr in answers if rr._type == qtype and rr._dn._key == key]
+      if found:
+        self._cache.addRRset(found)
+        result = {'answers': renamed(found, self._dn),
+                  'authority': [], 'additional': [],
+                  'rcode': Header.RCODE_NOERR}
+        if self._chain:
+          result['authority'] = self._cache.searchNS(found[0]._dn)
+          result['additional'] = self._cache.findGlueRecords(result['authority'])
+        self._finish(result)
+        return
+      for rr in answers:
+        if rr._type == RR.TYPE_CNAME and rr._dn._key == key:
+          break
+      else:
+        break
+      self._cache.addCNAME(rr._dn, rr._cname, rr._ttl)
+      if len(self._chain) >= self._budget._maxCnames or \
+         self._looksUp(rr._cname._key) or \
+         rr._cname._key in [c._dn._key for c in self._chain]:
+        self._fail("cnames")
+        return
+      self._chain.append(rr)
+      self._question = QE(type=qtype, dn=rr._cname)
+      key = rr._cname._key
+      followed = True
+    if followed:
+      # Resolve the target afresh, from its own closest zone cut.
+      self._start(self._question._dn)
+
+  def _referral(self, server, reply):
+    ns = [rr for rr in reply['authority'] if rr._type == RR.TYPE_NS]
+    if not ns:
+      # The name exists but has no RRs of the type asked for.
+      self._cache.addNegative(self._question._dn, self._question._type,
+                              Header.RCODE_NOERR, reply['authority'],
+                              self._question._class)
+      self._finish({'rcode': Header.RCODE_NOERR})
+      return
+    zone = ns[0]._dn._key
+    key = self._question._dn._key
+    if not isSubdomainKey(zone, self._zone) or \
+       not (key == zone or isSubdomainKey(key, zone)):
+      # A referral to the zone itself, upward or sideways: the server
+      # does not serve the zone it was delegated.
+      self._resolver.serverFailed(server, "lame")
+      return
+    self._cache.addAuthority(ns)
+    self._cache.addAdditional(reply['additional'])
+    glue = dict()
+    for rr in reply['additional']:
+      for addr in self._cache.serverAddresses([rr]):
+        glue.setdefault(rr._dn._key, []).append(addr)
+    self._setCut(zone, [], [])
+    for rr in ns:
+      addrs = glue.get(rr._nsdn._key) or self._cache.cachedAddresses(rr._nsdn)
+      if addrs:
+        self._servers.extend(addrs)
+      else:
+        self._glueless.append(rr._nsdn)
+    # Try servers known to be down last; they are skipped until their
+    # backoff runs out.
+    self._cache.orderServers(self._servers)
+    # Look up the addresses of the servers without glue now: all of
+    # them at once if there is no other server to ask, the first to be
+    # found to be asked first; otherwise in the background, with a
+    # budget of their own, so that the zone's next query has them all.
+    if self._glueless:
+      if self._servers:
+        self._lookUp(Budget(self._resolver._clock() + RESOLVE_TIMEOUT,
+                            self._budget._maxQueries, self._budget._maxCnames))
+      else:
+        self._lookUp(self._budget)
+
+class Priming(Resolution):
+  """
+  Asks the root name servers for the current set of root name
+  servers, and caches them in place of the root hints (RFC 8109).
+
+  Member variables:
+
+  expires -- the time the root name servers expire, once primed.
+  """
+
+  def __init__(self, resolver, budget):
+    Resolution.__init__(self, resolver,
+                        QE(type=RR.TYPE_NS, dn=DomainName(".")), budget)
+    self.expires = None
+
+  def receive(self, data):
+    server = self.server
+    self.server = None
+    if data is None:
+      return
+    reply = parseDNSPacket(data)
+    ns = [rr for rr in reply['answers']
+          if rr._type == RR.TYPE_NS and rr._dn._key == ROOT_KEY]
+    if reply['header']._rcode != Header.RCODE_NOERR:
+      self._resolver.serverFailed(server, "rcode")
+    elif not ns:
+      self._resolver.serverFailed(server, "lame")
+    else:
+      self.expires = self._cache.prime(ns, reply['additional'])
+      self._finish({'rcode': Header.RCODE_NOERR})
+
+class Forwarding(Resolution):
+  """
+  The state of resolving one question through a ForwarderPool: step()
+  says to forward it, the first time, and the reply, or None if none
+  came, ends it through receive().
+
+  Member variables:
+
+  pool -- the ForwarderPool to forward the question to.
+
+  forward -- the gz01.forwarder.Forward under way, once sent.
+
+  start -- the time it was sent.
+  """
+
+  FORWARD = "forward"
+
+  def __init__(self, resolver, question, budget, pool):
+    Resolution.__init__(self, resolver, question, budget)
+    self.pool = pool
+    self.forward = None
+    self.start = None
+
+  def _start(self, dn):
+    pass # no zone cut: the forwarders resolve the name
+
+  def step(self, now):
+    self.waiting = False
+    if self.result is not None:
+      return Resolution.DONE
+    if self.forward is not None:
+      self.waiting = True
+      return Resolution.WAIT
+    if now >= self._budget._deadline:
+      self._resolver.statDeadline.inc()
+      return self._finish({'rcode': Header.RCODE_SRVFAIL})
+    return Forwarding.FORWARD
+
+  def receive(self, data):
+    self._finish(self._resolver.forwardResult(self._question, data))
+
+class _Query:
+  """
+  A question outstanding at one server, for the Resolutions in
+  waiters.  sent is whether its latest try could be sent at all.
+  """
+
+  def __init__(self, server, question, packet, start, probe):
+    self.server = server
+    self.question = question
+    self.packet = packet
+    self.start = start
+    self.probe = probe
+    self.tries = 1
+    self.sent = True
+    self.expires = None
+    self.waiters = []
+
+class Resolver:
+  """
+  Resolves names iteratively from the root, or through forwarders,
+  caching what it learns.
+
+  Member variables:
+
+  cache -- the Cache.
+
+  forwarders -- [domain name key --> ForwarderPool]; the pool for the
+  root key, if any, takes every name not in a more specific domain.
+
+  metrics -- the Registry of the resolver's metrics.
+
+  queries -- upstream queries sent so far.
+
+  _priming -- the Priming under way, or None.
+
+  _primeAt -- the time the root is to be primed next.
+  """
+
+  def __init__(self, root = None, port = DNS_PORT, transport = None,
+               clock = None, cache = None, metrics = None,
+               timeout = TIMEOUT, maxQueries = MAX_QUERIES,
+               maxCnames = MAX_CNAME_DEPTH, serveStale = 0, hints = None,
+               ipv6 = True, cacheSize = None, cachePolicy = POLICY_LRU):
+    """
+    root -- the address of a root name server to start from instead of
+    those of the root hints.
+    hints -- the root hints, as returned by load_root_hints(), by
+    default those of ROOT_HINTS.
+    transport -- what queries are sent with, by default a UdpTransport
+    sending them to port.  Its ipv6 member says whether it reaches
+    IPv6 addresses.
+    ipv6 -- whether to send queries to name servers over IPv6 too, if
+    the default transport can.
+    clock -- a Clock, ticked once per iteration of the resolver's
+    loop, or a function returning the current time in seconds to make
+    one of; by default the real time.  The cache shares it.
+    cache -- a Cache to share, instead of a new one starting at root.
+    metrics -- a Registry to add the resolver's metrics to.
+    timeout -- seconds to wait for each reply.
+    cacheSize, cachePolicy -- the most entries a new cache holds, or
+    None for no limit, and which makes room when it is full.
+    """
+    if root is not None:
+      hints = [(DomainName(ROOTNS_DN), [root])]
+    if not isinstance(clock, Clock):
+      clock = Clock(clock) if clock is not None else Clock()
+    self.cache = cache if cache is not None else \
+      Cache(hints, serveStale=serveStale, clock=clock, maxEntries=cacheSize,
+            policy=cachePolicy)
+    self._transport = transport if transport is not None else \
+      UdpTransport(port, ipv6)
+    self.cache.ipv6 = self._transport.ipv6
+    self._clock = clock
+    self._timeout = timeout
+    self._maxQueries = maxQueries
+    self._maxCnames = maxCnames
+    self.forwarders = dict()
+    self.queries = 0
+
+    # The Resolutions under way, for _run() and work().
+    self._active = set()     # unfinished Resolutions of questions
+    self._runnable = []
+    self._outstanding = dict() # (server, question bytes) --> _Query
+    self._expiries = []      # heap of (expiry time, sequence, _Query)
+    self._sequence = 0
+    self._lookups = dict()   # (key of a name server name, type) --> Resolution
+    self._forwarding = dict() # (name key, type, class) --> Forwarding
+    self._forwardsDone = []  # Forwardings whose pool is done with them
+    self._waiters = dict()   # lookup --> [(Resolution waiting, its cut)]
+    self._probing = dict()   # (zone key, child key) --> Resolutions
+                             # waiting on the first query about the child
+    self._probed = set()     # (zone key, child key) asked about already
+    self._trace = None
+    self._spans = dict()     # lookup --> its trace span
+    self._priming = None
+    self._primeAt = 0
+
+    self.metrics = metrics if metrics is not None else Registry()
+    for counter in (self.cache.hits, self.cache.misses, self.cache.evictions,
+                    self.cache.displaced):
+      self.metrics.add(counter)
+    self.metrics.add(Gauge("ncsdns_cache_entries", "Entries in each cache.",
+      lambda: {'a': len(self.cache.acache), 'ns': len(self.cache.nscache),
+               'cname': len(self.cache.cnamecache),
+               'rrset': len(self.cache.rrcache),
+               'negative': len(self.cache.negcache)}, label="cache"))
+    self.statUpstream = self.metrics.add(Counter("ncsdns_upstream_queries_total",
+      "Queries sent to other name servers, retries included."))
+    self.statUpstreamFamily = self.metrics.add(LabeledCounter(
+      "ncsdns_upstream_family_queries_total",
+      "Queries sent to other name servers, by address family.", "family"))
+    self.statUpstreamTimeouts = self.metrics.add(LabeledCounter(
+      "ncsdns_upstream_timeouts_total",
+      "Upstream queries that got no reply, by server.", "server"))
+    self.statForwarded = self.metrics.add(LabeledCounter(
+      "ncsdns_forwarded_queries_total",
+      "Queries forwarded, by the forwarder that answered (none if none did).",
+      "upstream"))
+    self.statServerFailures = self.metrics.add(LabeledCounter(
+      "ncsdns_server_failures_total",
+      "Name servers that timed out, could not be sent to, gave a lame "
+      "referral or failed, by kind.",
+      "kind"))
+    self.statServerSkipped = self.metrics.add(Counter("ncsdns_server_skipped_total",
+      "Queries not sent because their name server was marked down."))
+    self.metrics.add(Gauge("ncsdns_servers_down", "Name servers marked down.",
+      lambda: len([e for e in self.cache.infracache.values()
+                   if e._downUntil > self._clock()])))
+    self.statDeadline = self.metrics.add(Counter("ncsdns_deadline_exceeded_total",
+      "Resolutions abandoned at the query deadline."))
+    self.statBudgetExceeded = self.metrics.add(LabeledCounter(
+      "ncsdns_budget_exceeded_total",
+      "Resolutions abandoned for reaching a limit of their work budget other "
+      "than the deadline: upstream queries, CNAMEs followed or depth of name "
+      "server address lookups.", "limit"))
+    self.statPrimings = self.metrics.add(LabeledCounter(
+      "ncsdns_root_primings_total",
+      "Queries of the root for its name servers, by outcome.", "outcome"))
+    self.metrics.add(Gauge("ncsdns_root_servers",
+      "Root name servers cached, the root hints counted until primed.",
+      lambda: len(self.cache.nscache.get(ROOT_KEY, ()))))
+
+  def serverFailed(self, address, kind):
+    """ Records that the server at address answered badly. """
+    self.cache.infraEntry(address).failure(self._clock())
+    self.statServerFailures.inc(kind)
+    _log.debug("server %s failed: %s", address, kind)
+
+  def findForwarder(self, dn):
+    """
+    Returns the ForwarderPool for the closest enclosing domain of dn
+    that has one, or None if dn is to be resolved from the root
+    """
+    if not self.forwarders:
+      return None
+    key = dn._key
+    while key is not None:
+      pool = self.forwarders.get(key)
+      if pool is not None:
+        return pool
+      key = DomainName.parentKey(key)
+    return None
+
+  def forwardResult(self, question, data):
+    """
+    Caches the addresses and CNAMEs of data, a forwarder's reply to
+    question, and returns the result for question; SERVFAIL if data is
+    None, as when no forwarder replied
+    """
+    if data is None:
+      return {'rcode': Header.RCODE_SRVFAIL}
+    data = parseDNSPacket(data)
+    rcode = data['header']._rcode
+    if rcode == Header.RCODE_NAMEERR or \
+       (rcode == Header.RCODE_NOERR and not data['answers']):
+      self.cache.addNegative(question._dn, question._type, rcode,
+                             data['authority'], question._class)
+    if rcode != Header.RCODE_NOERR:
+      return {'rcode': rcode}
+    answers = []
+    for rrset in rrsets(data['answers']):
+      self.cache.addRRset(rrset)
+      if rrset[0]._type == question._type and not answers:
+        answers = rrset
+    if not answers: # no RRs of the type asked for
+      return {'rcode': Header.RCODE_NOERR}
+    return {'answers': renamed(answers, question._dn),
+            'authority': [], 'additional': [], 'rcode': Header.RCODE_NOERR}
+
+  @traced("resolve", lambda self, question, deadline=None: {'question': str(question._dn)})
+  def resolve(self, question, deadline = None):
+    """
+    Returns the result for question, from the cache if it is there,
+    resolving it by deadline (by default RESOLVE_TIMEOUT from now)
+    otherwise
+    """
+    now = self._clock.tick()
+    if deadline is None:
+      deadline = now + RESOLVE_TIMEOUT
+    result = self.cache.search(question._dn, question._type,
+                               cls=question._class)
+    if result != False:
+      return result
+    return self._run([question], deadline=deadline)[0]
+
+  def prefetch(self, question, timeout = RESOLVE_TIMEOUT):
+    """
+    Starts resolving question in the background, within timeout
+    seconds, so that its answer gets cached; work() carries it on.
+    Returns the Resolution, whose result is set once it is done, or
+    None if the answer is cached already.
+    """
+    now = self._clock.tick()
+    if self.cache.search(question._dn, question._type,
+                         cls=question._class) != False:
+      return None
+    r = self._resolution(question, Budget(now + timeout, self._maxQueries,
+                                          self._maxCnames))
+    self._runnable.append(r)
+    return r
+
+  def resolve_many(self, names, qtype = RR.TYPE_A, timeout = RESOLVE_TIMEOUT,
+                   concurrency = CONCURRENCY):
+    """
+    Resolves the RRs of type qtype of the domain name strings names,
+    up to concurrency at a time, each within timeout seconds, whether
+    from the root or through forwarders.  Returns [name --> result].
+    """
+    self._clock.tick()
+    results = dict()
+    todo = []
+    for name in names:
+      if name in results:
+        continue
+      dn = DomainName(name if name.endswith(".") else name + ".")
+      question = QE(type=qtype, dn=dn)
+      result = self.cache.search(dn, qtype)
+      if result != False:
+        results[name] = result
+        continue
+      results[name] = None
+      todo.append((name, question))
+    resolved = self._run([question for (name, question) in todo],
+                         timeout=timeout, concurrency=concurrency)
+    for ((name, question), result) in zip(todo, resolved):
+      results[name] = result
+    return results
+
+  def _run(self, questions, deadline = None, timeout = RESOLVE_TIMEOUT,
+           concurrency = None):
+    """
+    Resolves questions, concurrency at a time (all by default), each
+    by deadline, or timeout seconds after it is started.  Returns their
+    results in order.
+    """
+    self._trace = tracing.tracer.current if tracing.tracer is not None else None
+    top = [None] * len(questions)
+    admitted = 0
+    while 1:
+      now = self._clock.tick()
+      self._prime(now)
+      while admitted < len(questions) and \
+            (concurrency is None or len(self._active) < concurrency):
+        budget = Budget(deadline if deadline is not None else now + timeout,
+                        self._maxQueries, self._maxCnames)
+        r = top[admitted] = self._resolution(questions[admitted], budget)
+        admitted += 1
+        self._active.add(r)
+        self._runnable.append(r)
+      self._advance()
+      if not self._active:
+        if admitted < len(questions):
+          continue
+        break
+      if not self._outstanding and not self._forwarding:
+        # The Resolutions left wait on each other's lookups, which
+        # will never end.
+        for r in self._active:
+          r._finish({'rcode': Header.RCODE_SRVFAIL})
+        self._active.clear()
+        self._idle()
+        continue
+      self._wait(self.nextTimeout())
+    # Lookups still going on carry on in the background.
+    if self._trace is not None:
+      for span in self._spans.values():
+        self._trace.end(span, background=True)
+    self._spans.clear()
+    self._trace = None
+    return [r.result for r in top]
+
+  def _resolution(self, question, budget):
+    """ Returns a new Resolution of question within budget, or, if it
+    is to be forwarded, the Forwarding of it under way, if any. """
+    pool = self.findForwarder(question._dn)
+    if pool is None:
+      return Resolution(self, question, budget)
+    key = (question._dn._key, question._type, question._class)
+    r = self._forwarding.get(key)
+    if r is None:
+      r = self._forwarding[key] = Forwarding(self, question, budget, pool)
+    return r
+
+  def busy(self):
+    """ Returns whether lookups are going on in the background. """
+    return bool(self._outstanding or self._runnable or self._forwarding)
+
+  def fileno(self):
+    """ The transport's file descriptor. """
+    return self._transport.fileno()
+
+  def readers(self):
+    """ What to select() on for reading before work(): the transport,
+    and the sockets of the ForwarderPools with queries under way. """
+    return [self._transport] + sum([pool.readers() for pool in self._pools()],
+                                   [])
+
+  def writers(self):
+    """ What to select() on for writing before work(): the forwarders'
+    TCP connections with a query still to send. """
+    return sum([pool.writers() for pool in self._pools()], [])
+
+  def _pools(self):
+    return list(set([r.pool for r in self._forwarding.values()
+                     if r.forward is not None]))
+
+  def nextTimeout(self):
+    """ Returns the seconds until the next upstream query times out, or
+    None if there is no query outstanding. """
+    while self._expiries and self._expiries[0][2].expires is None:
+      heapq.heappop(self._expiries)
+    timeouts = [pool.nextTimeout() for pool in self._pools()]
+    if self._expiries:
+      timeouts.append(max(self._expiries[0][0] - self._clock(), 0))
+    timeouts = [t for t in timeouts if t is not None]
+    return min(timeouts) if timeouts else None
+
+  def work(self, timeout = 0):
+    """ Carry on with background lookups, waiting up to timeout seconds
+    for a reply. """
+    self._prime(self._clock.tick())
+    self._advance()
+    if self._outstanding or self._forwarding:
+      next = self.nextTimeout()
+      self._wait(timeout if next is None else min(timeout, next))
+      self._advance()
+    if not self.busy():
+      self._idle()
+
+  def _idle(self):
+    """ Forget what was kept to share work between Resolutions, once
+    none is left; any waiting now never will be woken. """
+    self._lookups.clear()
+    self._waiters.clear()
+    self._probing.clear()
+    self._probed.clear()
+
+  def _prime(self, now):
+    """ Start priming the root in the background, if it is time to. """
+    if now < self._primeAt or ROOT_KEY in self.forwarders:
+      return
+    self._primeAt = MAXINT
+    self._priming = Priming(self, Budget(now + RESOLVE_TIMEOUT,
+                                         self._maxQueries, self._maxCnames))
+    self._runnable.append(self._priming)
+
+  def _primed(self, r):
+    """ Schedule the next priming after the Priming r is done. """
+    self._priming = None
+    if r.expires is not None:
+      self.statPrimings.inc("ok")
+      self._primeAt = r.expires
+      _log.info("primed %d root name servers",
+                len(self.cache.nscache.get(ROOT_KEY, ())))
+    else:
+      self.statPrimings.inc("failed")
+      self._primeAt = self._clock() + PRIME_RETRY
+      _log.warning("root priming failed, using the root hints")
+
+  def _launch(self, r):
+    """ Start the lookups r has asked for, or wait on the same lookups
+    of other Resolutions. """
+    for child in r.children:
+      key = (child._dn._key, child._question._type)
+      other = self._lookups.get(key)
+      if other is not None:
+        self._waiters[other].append((r, child._forCut))
+        continue
+      self._lookups[key] = child
+      self._waiters[child] = [(r, child._forCut)]
+      self._runnable.append(child)
+      if self._trace is not None:
+        self._spans[child] = self._trace.begin("lookup", question=str(child._dn))
+    r.children = []
+
+  def _advance(self):
+    """ Step the runnable Resolutions until each one waits. """
+    while self._runnable or self._forwardsDone:
+      while self._forwardsDone:
+        self._forwarded(self._forwardsDone.pop())
+      r = self._runnable.pop()
+      now = self._clock()
+      while r is not None:
+        if isinstance(r, Forwarding):
+          state = r.step(now)
+          if state == Forwarding.FORWARD:
+            self._forward(r, now)
+          elif state == Resolution.DONE:
+            self._done(r)
+          break
+        if r.children:
+          self._launch(r)
+        probe = (r._zone, childKey(r._question._dn._key, r._zone))
+        if probe not in self._probed and probe in self._probing and \
+           r.result is None:
+          self._probing[probe].append(r)
+          break
+        state = r.step(now)
+        if r.children:
+          self._launch(r)
+        if state == Resolution.QUERY:
+          if not self.cache.infraEntry(r.server).usable(now):
+            self.statServerSkipped.inc()
+            _log.debug("skipping %s, which is down", r.server)
+            r.receive(None)
+            continue
+          self._query(r, probe, now)
+          break
+        elif state == Resolution.WAIT:
+          break
+        self._done(r)
+        break
+
+  def _query(self, r, probe, now):
+    """ Send r's question to r.server, unless it is outstanding there
+    already. """
+    qbytes = r._question.pack().lower()
+    q = self._outstanding.get((r.server, qbytes))
+    if q is None:
+      if probe not in self._probed:
+        self._probing.setdefault(probe, [])
+      q = _Query(r.server, r._question,
+                 constructDNSQuery(random.randint(0, 65535), r._question),
+                 now, probe)
+      self._outstanding[(r.server, qbytes)] = q
+      self._send(q, r._budget)
+      q.expires = now + (min(self._rto(q), r._budget._deadline - now)
+                         if q.sent else 0)
+      self._sequence += 1
+      heapq.heappush(self._expiries, (q.expires, self._sequence, q))
+    q.waiters.append(r)
+
+  def _forward(self, r, now):
+    """ Send the question of the Forwarding r to its pool. """
+    self.queries += 1
+    self.statUpstream.inc()
+    r._budget.charge(1)
+    packet = Header(random.randint(0, 65535), Header.OPCODE_QUERY,
+                    Header.RCODE_NOERR, qdcount=1, rd=True).pack() + \
+             r._question.pack()
+    r.start = now
+    r.forward = r.pool.start(packet,
+                             min(self._timeout, r._budget._deadline - now),
+                             lambda f: self._forwardsDone.append(r))
+
+  def _forwarded(self, r):
+    """ Hand the Forwarding r its pool's reply. """
+    f = r.forward
+    self.statForwarded.inc(str(f.upstream) if f.upstream else "none")
+    if self._trace is not None:
+      self._trace.upstream(r.start, server=str(f.upstream or r.pool),
+                           question=str(r._question._dn), sent=len(f.packet),
+                           received=len(f.reply or ""),
+                           rcode=ord(f.reply[3]) & 0xF if f.reply
+                                 else Header.RCODE_SRVFAIL)
+    r.receive(f.reply)
+    self._runnable.append(r)
+
+  def _done(self, r):
+    """ Report the end of r to the Resolutions waiting on it. """
+    self._active.discard(r)
+    if isinstance(r, Forwarding):
+      key = (r._question._dn._key, r._question._type, r._question._class)
+      if self._forwarding.get(key) is r:
+        del self._forwarding[key]
+    if r is self._priming:
+      self._primed(r)
+    parents = self._waiters.pop(r, None)
+    if parents is None:
+      return
+    del self._lookups[(r._dn._key, r._question._type)]
+    span = self._spans.pop(r, None)
+    if span is not None:
+      self._trace.end(span, rcode=r.result.get('rcode'))
+    for (parent, cut) in parents:
+      if parent.result is not None:
+        continue
+      parent.lookupDone(r, cut)
+      if parent.waiting:
+        parent.waiting = False
+        self._runnable.append(parent)
+
+  def _wait(self, timeout):
+    """ Wait up to timeout seconds for a reply, and handle it and the
+    queries that have timed out by then. """
+    got = self._clock.wait(self._receive, timeout)
+    now = self._clock()
+    if got is not None:
+      (data, address) = got
+      try:
+        length = len(QE.fromData(data, 12))
+      except Exception:
+        length = None
+      q = self._outstanding.get((address, data[12:12 + (length or 0)].lower()))
+      if q is None or data[:2] != q.packet[:2]:
+        _log.debug("discarding unexpected reply from %s", address)
+      else:
+        self.cache.infraEntry(q.server).success(now - q.start)
+        self._deliver(q, data)
+    while self._expiries and self._expiries[0][0] <= now:
+      (expires, seq, q) = heapq.heappop(self._expiries)
+      if q.expires != expires:
+        continue # answered, or sent again
+      if not q.sent:
+        # No route to the server, as when its address family is not
+        # reachable: there is no point in sending again.
+        self.cache.infraEntry(q.server).failure(now)
+        self.statServerFailures.inc("unreachable")
+        self._deliver(q, None)
+        continue
+      self.statUpstreamTimeouts.inc(q.server)
+      remaining = max([r._budget._deadline for r in q.waiters]) - now
+      if q.tries < MAX_TRY and remaining > 0 and \
+         not all([r._servers for r in q.waiters]):
+        q.tries += 1
+        self._send(q, q.waiters[0]._budget)
+        q.expires = now + (min(self._rto(q), remaining) if q.sent else 0)
+        self._sequence += 1
+        heapq.heappush(self._expiries, (q.expires, self._sequence, q))
+        continue
+      self.cache.infraEntry(q.server).failure(now)
+      self.statServerFailures.inc("timeout")
+      _log.error("Could not send data")
+      self._deliver(q, None)
+
+  def _receive(self, timeout):
+    """ Waits up to timeout seconds for a reply, and returns (data,
+    server address) of one from a name server, or None.  Those from
+    forwarders are taken in by their pools. """
+    pools = self._pools()
+    if not pools:
+      return self._transport.receive(timeout)
+    try:
+      (rds, wds, xds) = select(self.readers(), self.writers(), [],
+                               max(timeout, 0))
+    except select_error, e:
+      if e.args[0] != errno.EINTR:
+        raise
+      rds = [] # interrupted by a signal
+    for pool in pools:
+      pool.poll()
+    if self._transport in rds:
+      return self._transport.receive(0)
+    return None
+
+  def _rto(self, q):
+    """ Returns the seconds to wait for a reply to the latest try of
+    q. """
+    entry = self.cache.infracache.get(q.server)
+    if entry is None or entry._srtt is None:
+      rto = INITIAL_RTO
+    else:
+      rto = max(RTO_MIN, RTO_FACTOR * entry._srtt)
+    return min(self._timeout, rto * 2 ** (q.tries - 1))
+
+  def _deliver(self, q, data):
+    """ Hand the reply to q, or None if there was none, to the
+    Resolutions that asked it. """
+    del self._outstanding[(q.server, q.packet[12:].lower())]
+    q.expires = None
+    if self._trace is not None:
+      self._trace.upstream(q.start, server=q.server, retries=q.tries - 1,
+                           question=str(q.question._dn), sent=len(q.packet),
+                           received=len(data or ""),
+                           rcode=ord(data[3]) & 0xF if data else Header.RCODE_SRVFAIL)
+    for r in q.waiters:
+      r.receive(data)
+    self._runnable.extend(q.waiters)
+    if q.probe in self._probing and q.probe not in self._probed:
+      # Without a reply, the next of the waiting Resolutions to ask a
+      # server becomes the probe.
+      if data is not None:
+        self._probed.add(q.probe)
+      for r in self._probing.pop(q.probe):
+        r.restart()
+        self._runnable.append(r)
+
+  def _send(self, q, budget):
+    self.queries += 1
+    self.statUpstream.inc()
+    self.statUpstreamFamily.inc("ipv6" if is_ipv6(q.server) else "ipv4")
+    budget.charge(1)
+    try:
+      self._transport.send(q.packet, q.server)
+      q.sent = True
+    except error, e:
+      _log.warning("cannot send to %s: %s", q.server, e)
+      q.sent = False
@@ -0,0 +1,884 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" The caching DNS server run by ncsdns.py. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# main() parses the command line, sets up a Server and runs it until
+# it is interrupted or hands over to a new server.  Nothing is started
+# by importing this module.
+
+import atexit
+from collections import deque
+from optparse import OptionParser, OptionValueError
+import select
+import signal
+from socket import *
+import sys
+from time import time
+
+from gz01.clock import Clock
+from gz01.control import ControlServer
+from gz01.collections_backport import OrderedDict
+from gz01.dnslib.RR import *
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.inetlib.types import *
+from gz01.forwarder import ForwarderPool, parse_upstream
+from gz01.handoff import Listener, take_over
+from gz01.localzones import LocalZones, NODATA
+from gz01.metrics import *
+from gz01 import profiler
+from gz01.ratelimit import *
+from gz01.querylog import QueryLogWriter
+from gz01.resolver import Resolver, DNS_PORT, ROOT_HINTS, MAX_QUERIES, \
+                          MAX_CNAME_DEPTH, POLICIES, POLICY_LRU, \
+                          load_root_hints, parseDNSPacket, renamed
+from gz01 import tracing
+from gz01.tracing import Tracer
+from gz01 import util
+from gz01.util import logger, poll_signals, set_log_level, start_logging
+
+# Admission control.  Up to MAX_RESOLVING client queries that miss the
+# cache are resolved at once; others wait in a queue of at most
+# MAX_PENDING, and further misses are shed at once.  A resolution is
+# abandoned QUERY_DEADLINE seconds after its query arrived, and a query
+# that has waited longer than CLIENT_TIMEOUT is dropped unanswered, as
+# its client has given up on it.
+MAX_RESOLVING = 100
+MAX_PENDING = 100
+QUERY_DEADLINE = 4.0
+CLIENT_TIMEOUT = 5.0
+
+# Expired addresses are kept this many seconds longer, to be served to
+# queries that are shed; 0 disables serving stale data.
+SERVE_STALE = 0
+
+# Most queries taken off the sockets between two rounds of resolving
+MAX_DRAIN = 64
+
+# Client retransmissions.  A query with the same client address and
+# port, ID and question as one queued for resolution, or answered while
+# it was waiting on the socket, is a retransmission of it: it is
+# absorbed, as the client gets the one reply.  Answered queries are
+# forgotten once the socket has been drained.  At most MAX_INFLIGHT
+# queries are remembered, the oldest being forgotten first.
+MAX_INFLIGHT = 1000
+
+def check_port(option, opt_str, value, parser):
+  if value < 32768 or value > 61000:
+    raise OptionValueError("need 32768 <= port <= 61000")
+  parser.values.port = value
+
+def make_parser():
+  """ Returns the OptionParser for the server's command line """
+  parser = OptionParser()
+  parser.add_option("-p", "--port", dest="port", type="int", action="callback",
+                    callback=check_port, metavar="PORTNO", default=0,
+                    help="UDP port to listen on (default: use an unused ephemeral port)")
+  parser.add_option("-l", "--log-level", dest="loglevels", action="append",
+                    metavar="LOGGER=LEVEL", default=[],
+                    help="set the verbosity of one logger, e.g. gz01.dnslib.RR=DEBUG2 (repeatable)")
+  parser.add_option("--root", dest="root", metavar="ADDR",
+                    help="address of a root name server to start resolution at, instead of those of --root-hints")
+  parser.add_option("--root-hints", dest="roothints", metavar="FILE", default=ROOT_HINTS,
+                    help="root hints file naming the root name servers (default: %default)")
+  parser.add_option("-4", "--ipv4-only", dest="ipv4only", action="store_true",
+                    default=False,
+                    help="listen on, and send queries to other DNS servers over, IPv4 only, not IPv6 as well")
+  parser.add_option("--upstream-port", dest="upstreamport", type="int", metavar="PORTNO",
+                    default=DNS_PORT,
+                    help="port to send queries to other DNS servers on (default: %default)")
+  parser.add_option("--capture", dest="capture", metavar="FILE",
+                    help="record every client query, and how long its answer could be cached, to the query log FILE")
+  parser.add_option("--trace-slow", dest="traceslow", type="float", metavar="MS",
+                    help="trace client queries and log those taking at least MS milliseconds")
+  parser.add_option("--trace-sample", dest="tracesample", type="float", default=0.01,
+                    metavar="FRACTION",
+                    help="fraction of traced queries that also record cache lookups (default: %default)")
+  parser.add_option("--trace-file", dest="tracefile", default="./ncsdns.trace", metavar="FILE",
+                    help="file to write slow query traces to (default: %default)")
+  parser.add_option("--handoff", dest="handoff", metavar="PATH",
+                    help="take over the sockets and cache of the server listening on the Unix socket PATH, if any, and listen on PATH for a server to hand over to in turn")
+  parser.add_option("--control", dest="control", metavar="PATH",
+                    help="take commands to look into, flush, preload and dump the cache on the Unix socket PATH")
+  parser.add_option("--metrics-port", dest="metricsport", type="int", metavar="PORTNO",
+                    help="serve Prometheus metrics on http://127.0.0.1:PORTNO/metrics")
+  parser.add_option("--profile-seconds", dest="profileseconds", type="float",
+                    default=profiler.DURATION, metavar="SECONDS",
+                    help="length of the profile taken on SIGUSR1 (default: %default)")
+  parser.add_option("--profile-interval", dest="profileinterval", type="float",
+                    default=profiler.INTERVAL * 1000, metavar="MS",
+                    help="sampling interval of the SIGUSR1 profiler (default: %default)")
+  parser.add_option("--ratelimit-queries", dest="ratequeries", type="float", metavar="QPS",
+                    help="limit the queries each client network may send per second")
+  parser.add_option("--ratelimit-responses", dest="rateresponses", type="float", metavar="RPS",
+                    help="limit the replies sent to each client network per second")
+  parser.add_option("--ratelimit-burst", dest="rateburst", type="float", metavar="N",
+                    help="queries or replies a client network may burst above its rate (default: one second's worth)")
+  parser.add_option("--ratelimit-action", dest="rateaction", type="choice",
+                    choices=ACTIONS, default=ACTION_TRUNCATE,
+                    help="what to send a client over its limit: %s (default: %%default)" %
+                         (", ".join(ACTIONS),))
+  parser.add_option("--ratelimit-prefix", dest="rateprefix", type="int", default=24,
+                    metavar="BITS",
+                    help="IPv4 prefix length that clients are grouped by (default: %default)")
+  parser.add_option("--ratelimit-clients", dest="rateclients", type="int", default=10000,
+                    metavar="N",
+                    help="client networks to track at most (default: %default)")
+  parser.add_option("--max-resolving", dest="maxresolving", type="int",
+                    default=MAX_RESOLVING, metavar="N",
+                    help="cache misses to resolve at once (default: %default)")
+  parser.add_option("--max-pending", dest="maxpending", type="int", default=MAX_PENDING,
+                    metavar="N",
+                    help="cache misses to queue, once --max-resolving are being resolved, before shedding new ones (default: %default)")
+  parser.add_option("--deadline", dest="deadline", type="float", default=QUERY_DEADLINE,
+                    metavar="SECONDS",
+                    help="give up resolving a query this long after it arrived (default: %default)")
+  parser.add_option("--client-timeout", dest="clienttimeout", type="float",
+                    default=CLIENT_TIMEOUT, metavar="SECONDS",
+                    help="drop queued queries older than this unanswered (default: %default)")
+  parser.add_option("--serve-stale", dest="servestale", type="int", default=SERVE_STALE,
+                    metavar="SECONDS",
+                    help="answer shed queries with addresses expired at most this long ago (default: %default)")
+  parser.add_option("--cache-size", dest="cachesize", type="int", metavar="N",
+                    help="entries the cache holds at most (default: no limit)")
+  parser.add_option("--cache-policy", dest="cachepolicy", type="choice",
+                    choices=POLICIES, default=POLICY_LRU,
+                    help="what makes room in a full cache: %s (default: %%default)" %
+                         (", ".join(POLICIES),))
+  parser.add_option("--max-queries", dest="maxqueries", type="int", default=MAX_QUERIES,
+                    metavar="N",
+                    help="upstream queries one client query may cause at most (default: %default)")
+  parser.add_option("--max-cnames", dest="maxcnames", type="int", default=MAX_CNAME_DEPTH,
+                    metavar="N",
+                    help="CNAMEs to follow at most for one client query (default: %default)")
+  parser.add_option("--hosts", dest="hosts", action="append", default=[], metavar="FILE",
+                    help="answer the names in the hosts-style FILE locally; a name alone on a line is blocked (repeatable)")
+  parser.add_option("--zone", dest="zones", action="append", default=[], metavar="FILE",
+                    help="answer the names of the zone file FILE locally (repeatable)")
+  parser.add_option("--local-reload", dest="localreload", type="float", default=5.0,
+                    metavar="SECONDS",
+                    help="how often to check --hosts and --zone files for changes (default: %default)")
+  parser.add_option("--forward", dest="forward", metavar="ADDR[:PORT],...",
+                    help="forward queries to these recursive resolvers instead of resolving them from the root")
+  parser.add_option("--forward-zone", dest="forwardzones", action="append", default=[],
+                    metavar="DOMAIN=ADDR[:PORT],...",
+                    help="forward queries for names in DOMAIN to these resolvers (repeatable)")
+  parser.add_option("--forward-hedge", dest="forwardhedge", type="float", metavar="MS",
+                    help="also ask another forwarder after MS milliseconds without a reply (default: three times the first one's RTT)")
+  return parser
+
+def make_forwarders(options):
+  """
+  Returns the forwarders given by options: [domain name key -->
+  ForwarderPool]; the pool for the root key, if any, takes every name
+  not in a more specific domain.  Raises ValueError for a bad
+  forwarder list.
+  """
+  hedge = None if options.forwardhedge is None else options.forwardhedge / 1000.0
+  def pool(spec):
+    try:
+      return ForwarderPool([parse_upstream(a) for a in spec.split(",")], hedge)
+    except ValueError:
+      raise ValueError("bad forwarder list %r" % (spec,))
+  forwarders = dict()
+  if options.forward:
+    forwarders[DomainName(".")._key] = pool(options.forward)
+  for spec in options.forwardzones:
+    (domain, sep, upstreams) = spec.partition("=")
+    if not sep:
+      raise ValueError("need DOMAIN=ADDR[:PORT],... for --forward-zone")
+    forwarders[DomainName(domain if domain.endswith(".") else domain + ".")._key] = \
+      pool(upstreams)
+  return forwarders
+
+def createDNSReply(id, question, result):
+  header = Header(id, Header.OPCODE_QUERY, Header.RCODE_NOERR,
+    qdcount=1, ancount=len(result['answers']), nscount=len(result['authority']),
+    arcount=len(result['additional']), qr=1)
+
+  query = header.pack()
+  query += question.pack()
+
+  for answer in result['answers']:
+    query += answer.pack()
+
+  for authority in result['authority']:
+    query += authority.pack()
+
+  for additional in result['additional']:
+    query += additional.pack()
+
+  return query
+
+def createDNSErrorReply(id, question, rcode):
+  header = Header(id, Header.OPCODE_QUERY, rcode, qdcount=1, qr=1)
+
+  query = header.pack()
+  query += question.pack()
+
+  return query
+
+def createLimitedReply(id, question, action):
+  """
+  Returns the reply to send instead of an answer to a client over its
+  rate limit, or None to send nothing
+  """
+  if action == ACTION_TRUNCATE:
+    header = Header(id, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1,
+                    qr=1, tc=True)
+    return header.pack() + question.pack()
+  elif action == ACTION_REFUSE:
+    return createDNSErrorReply(id, question, Header.RCODE_REFUSED)
+  return None
+
+def renameAnswer(result, dn):
+  """
+  Returns result with its answers given the owner name dn, as a CNAME
+  is answered with its target's RRs
+  """
+  if result and 'answers' in result and result['answers'] and \
+     result['answers'][0]._dn._key != dn._key:
+    result['answers'] = renamed(result['answers'], dn)
+  return result
+
+def retransmitKey(address, DNSPacket):
+  """ Returns the key of the client query DNSPacket from address in
+  Server._inflight """
+  question = DNSPacket['question']
+  return (address, DNSPacket['header']._id, question._dn._key,
+          question._type, question._class)
+
+class Server:
+  """
+  A caching DNS server listening on the loopback addresses.  It is a
+  single-threaded server: each iteration of run()'s loop takes in the
+  queries that have arrived, answering those it can from the cache,
+  starts resolving the cache misses queued, as many at a time as it
+  may, and answers those whose resolution is done.  The resolutions
+  carry on alongside each other, and alongside lookups the resolver
+  has left going on in the background, such as of name server
+  addresses, so that a slow one holds up no other query.  A handover to
+  a new server, and control commands, carry on between iterations.
+
+  Member variables:
+
+  port -- the UDP port listened on.
+
+  resolver -- the Resolver, with its caches and its socket for queries
+  to other DNS servers.
+
+  metrics -- the Registry of the server's and the resolver's metrics;
+  they are only served if a metrics port is given, but are cheap
+  enough to keep up to date regardless.
+
+  _clock -- the time, sampled once per iteration of the loop; the
+  resolver and its caches read it too.
+
+  _pending -- cache misses waiting to be resolved, oldest first:
+  [(arrival time, client address, client prefix, DNSPacket, name to
+  resolve, Trace)].
+
+  _resolving -- cache misses being resolved, oldest first:
+  [(Resolution, arrival time, client address, client prefix,
+  DNSPacket, Trace)].
+
+  _inflight -- client queries in flight, to absorb retransmissions of:
+  [key from retransmitKey() --> whether it has been answered], oldest
+  first.
+
+  _answered -- the keys of those answered since the sockets were last
+  drained.
+
+  _queryUpstream -- upstream queries sent for the client query being
+  answered.
+
+  _listening -- the sockets client queries arrive on: _ss, for IPv4,
+  and _ss6, for IPv6, if any.
+
+  _listener, _handoff -- the Listener for a server to hand over to,
+  and the handover under way to one; each None if none.
+
+  _control -- the ControlServer, or None.
+  """
+
+  def __init__(self, options):
+    """
+    Sets up the server given by the parsed command line options, taking
+    over the sockets and cache of the server to be replaced, if any.
+    Raises ValueError if the options cannot be used.
+    """
+    self._options = options
+    self._maxResolving = options.maxresolving
+    self._maxPending = options.maxpending
+    self._deadline = options.deadline
+    self._clientTimeout = options.clienttimeout
+    self._pending = deque()
+    self._resolving = []
+    self._inflight = OrderedDict()
+    self._answered = []
+    self._queryUpstream = 0
+    self._handoff = None
+
+    # Per-client rate limits on queries received and replies sent; None
+    # when not limited.
+    self._queryLimiter = None
+    if options.ratequeries is not None:
+      self._queryLimiter = RateLimiter(options.ratequeries, options.rateburst,
+                                       options.rateclients)
+    self._responseLimiter = None
+    if options.rateresponses is not None:
+      self._responseLimiter = RateLimiter(options.rateresponses,
+                                          options.rateburst,
+                                          options.rateclients)
+
+    self._forwarders = make_forwarders(options)
+    hints = None
+    if options.root is None:
+      try:
+        hints = load_root_hints(options.roothints)
+      except (IOError, ValueError), e:
+        raise ValueError("cannot load root hints: %s" % (e,))
+
+    # Names answered from local files, before the cache; the files are
+    # loaded, and reloaded when changed, in the background.
+    self._localZones = None
+    if options.hosts or options.zones:
+      self._localZones = LocalZones()
+      for path in options.hosts:
+        self._localZones.addHosts(path)
+      for path in options.zones:
+        self._localZones.addZone(path)
+      self._localZones.watch(options.localreload)
+
+    # Open the query log, if capturing; it is flushed and closed at exit.
+    self._querylog = None
+    if options.capture:
+      self._querylog = QueryLogWriter(options.capture)
+      atexit.register(self._querylog.close)
+
+    if options.traceslow is not None:
+      tracing.tracer = Tracer(options.traceslow / 1000.0, options.tracesample,
+                              path=options.tracefile)
+
+    self.metrics = Registry()
+    self._clock = Clock()
+
+    # The resolver primes the root name servers in the background as
+    # soon as it is idle.
+    self.resolver = Resolver(options.root, options.upstreamport,
+                             clock=self._clock, metrics=self.metrics,
+                             maxQueries=options.maxqueries,
+                             maxCnames=options.maxcnames,
+                             serveStale=options.servestale, hints=hints,
+                             ipv6=not options.ipv4only,
+                             cacheSize=options.cachesize,
+                             cachePolicy=options.cachepolicy)
+    self.resolver.forwarders = self._forwarders
+    self._addMetrics()
+
+    # Take over the listening sockets and the cache of the server being
+    # replaced, if any; it answers queries until its cache is loaded
+    # here.
+    inherited = dict()
+    if options.handoff:
+      inherited = take_over(options.handoff, self.resolver.cache) or dict()
+
+    self._httpd = None
+    if options.metricsport is not None:
+      self._httpd = serve(self.metrics, options.metricsport,
+                          sock=inherited.get('metrics'))
+
+    # Create a server socket to accept incoming connections from DNS
+    # client resolvers (stub resolvers):
+    self._ss = inherited.get('dns')
+    if self._ss is None:
+      self._ss = socket(AF_INET, SOCK_DGRAM)
+      self._ss.bind(("127.0.0.1", options.port))
+    self.port = self._ss.getsockname()[1]
+
+    # And one on the same port of the IPv6 loopback address, if the host
+    # has one.  Replies go out on the socket their query came in on.
+    self._ss6 = inherited.get('dns6')
+    if self._ss6 is None and has_ipv6 and not options.ipv4only:
+      self._ss6 = socket(AF_INET6, SOCK_DGRAM)
+      try:
+        self._ss6.bind(("::1", self.port))
+      except error, e:
+        logger.warning("not listening on ::1: %s", e)
+        self._ss6.close()
+        self._ss6 = None
+    self._listening = [sock for sock in (self._ss, self._ss6)
+                       if sock is not None]
+
+    self._listener = Listener(options.handoff) if options.handoff else None
+
+    # Take commands to inspect and change the cache, if asked to.
+    self._control = None
+    if options.control:
+      self._control = ControlServer(options.control, self.resolver,
+                                    self._clock)
+
+  def _addMetrics(self):
+    metrics = self.metrics
+    forwarders = self._forwarders
+    self._statQueries = metrics.add(Counter("ncsdns_queries_total",
+      "Client queries received."))
+    self._statResponses = metrics.add(LabeledCounter("ncsdns_responses_total",
+      "Replies sent to clients, by rcode.", "rcode"))
+    self._statLatency = metrics.add(Histogram("ncsdns_query_duration_seconds",
+      "Time to answer a client query, by whether it was answered from cache.",
+      label="cache"))
+    self._statUpstreamPerQuery = metrics.add(Histogram(
+      "ncsdns_upstream_queries_per_query",
+      "Upstream queries needed to answer a client query.",
+      buckets=(0, 1, 2, 4, 8, 16, 32, 64)))
+    self._statLocal = metrics.add(LabeledCounter("ncsdns_local_answers_total",
+      "Queries answered from --hosts and --zone files, by rcode.", "rcode"))
+    metrics.add(Gauge("ncsdns_local_names",
+      "Names defined by --hosts and --zone files.",
+      lambda: len(self._localZones or ())))
+    metrics.add(SampledCounter("ncsdns_forward_hedged_total",
+      "Forwarded queries also sent to a second forwarder.",
+      lambda: sum([pool._hedged for pool in forwarders.values()])))
+    metrics.add(SampledCounter("ncsdns_forward_timeouts_total",
+      "Queries a forwarder did not answer in time, by forwarder.",
+      lambda: dict([(str(u), u._timeouts) for pool in forwarders.values()
+                    for u in pool._upstreams]), label="upstream"))
+    metrics.add(Gauge("ncsdns_forward_srtt_seconds",
+      "Smoothed RTT of each forwarder.",
+      lambda: dict([(str(u), u._srtt or 0) for pool in forwarders.values()
+                    for u in pool._upstreams]), label="upstream"))
+    metrics.add(Gauge("ncsdns_forward_up",
+      "Whether each forwarder is in use (1) or down (0).",
+      lambda: dict([(str(u), int(not u._down)) for pool in forwarders.values()
+                    for u in pool._upstreams]), label="upstream"))
+    metrics.add(Gauge("ncsdns_inflight_queries",
+      "Client queries being answered: cache misses queued or being resolved.",
+      lambda: len(self._pending) + len(self._resolving)))
+    metrics.add(Gauge("ncsdns_pending_queries",
+      "Cache misses waiting to be resolved.", lambda: len(self._pending)))
+    self._statRetransmits = metrics.add(Counter(
+      "ncsdns_retransmits_absorbed_total",
+      "Client retransmissions of queries queued or being answered, absorbed "
+      "without a reply of their own."))
+    metrics.add(Gauge("ncsdns_inflight_table_entries",
+      "Queued and just answered queries remembered to absorb retransmissions.",
+      lambda: len(self._inflight)))
+    self._statShed = metrics.add(LabeledCounter("ncsdns_shed_queries_total",
+      "Queries not resolved because of overload, by outcome: answered with "
+      "stale data or SERVFAIL when the queue was full, or dropped after "
+      "waiting longer than the client timeout.", "outcome"))
+    self._statRateLimitedQueries = metrics.add(LabeledCounter(
+      "ncsdns_ratelimited_queries_total",
+      "Queries over their client's rate limit, by client network.", "client"))
+    self._statRateLimitedResponses = metrics.add(LabeledCounter(
+      "ncsdns_ratelimited_responses_total",
+      "Replies withheld by their client's rate limit, by client network.",
+      "client"))
+    metrics.add(Gauge("ncsdns_ratelimit_clients",
+      "Client networks tracked by the rate limiters.",
+      lambda: {'query': len(self._queryLimiter or ()),
+               'response': len(self._responseLimiter or ())},
+      label="limiter"))
+    metrics.add(Gauge("ncsdns_log_records_dropped",
+      "Log records dropped because the log writer fell behind.",
+      lambda: util.afh._dropped if util.afh is not None else 0))
+
+  def answerTTL(self, question, result):
+    """
+    Returns the seconds the answer result to question could be cached
+    for: the least TTL of its answers, or what is left of its negative
+    TTL in the cache; 0 if it could not be cached or is not known
+    """
+    if not result:
+      return 0
+    if result.get('answers'):
+      return min([rr._ttl for rr in result['answers']])
+    entry = self.resolver.cache.negcache.get((question._dn._key,
+                                              question._type,
+                                              question._class))
+    if entry is not None:
+      return max(0, entry._expiration - int(self._clock()))
+    return 0
+
+  def sendReply(self, DNSPacket, address, result, arrival, prefix):
+    """
+    Sends the reply for result to the client's query DNSPacket, subject
+    to the response rate limit, and records the query's metrics
+    """
+    if result is None or 'rcode' not in result:
+        reply = createDNSErrorReply(DNSPacket['header']._id, DNSPacket['question'], Header.RCODE_SRVFAIL)
+    elif result['rcode'] == Header.RCODE_NOERR and 'answers' in result:
+      reply = createDNSReply(DNSPacket['header']._id, DNSPacket['question'], result)
+    else:
+      reply = createDNSErrorReply(DNSPacket['header']._id, DNSPacket['question'], result['rcode'])
+    if self._responseLimiter is not None and \
+       not self._responseLimiter.allow(prefix, self._clock()):
+      self._statRateLimitedResponses.inc(prefix)
+      reply = createLimitedReply(DNSPacket['header']._id, DNSPacket['question'],
+                                 self._options.rateaction)
+    if reply is not None:
+      self.sendto(reply, address)
+      rcode = ord(reply[3]) & 0xF
+      self._statResponses.inc(Header.RCODE_NAMES.get(rcode, rcode))
+    else:
+      rcode = None
+    # Latency is measured in real time, not that of the current tick.
+    self._statLatency.observe(time() - arrival,
+                              "miss" if self._queryUpstream else "hit")
+    self._statUpstreamPerQuery.observe(self._queryUpstream)
+    if self._querylog is not None:
+      question = DNSPacket['question']
+      self._querylog.writeResponse(self._clock(), question,
+        (result or {}).get('rcode', Header.RCODE_SRVFAIL),
+        self.answerTTL(question, result))
+    if tracing.tracer is not None:
+      tracing.tracer.finish(rcode=rcode, bytes=len(reply or ""))
+
+  def sendto(self, reply, address):
+    """ Sends reply to address on the socket of its address family """
+    (self._ss6 if len(address) == 4 else self._ss).sendto(reply, address)
+
+  def receiveQuery(self, data, address, arrival):
+    """
+    Takes in a client query: answers it at once if its client is over
+    its rate limit or the answer is cached, absorbs it if it is a
+    retransmission of a query in flight, sheds it if too many misses
+    are already pending, and queues it for resolveQuery otherwise
+    """
+    self._queryUpstream = 0
+    self._statQueries.inc()
+    prefix = None
+    if self._queryLimiter is not None or self._responseLimiter is not None:
+      prefix = client_prefix(address[0], self._options.rateprefix)
+    if not data:
+      logger.error("client provided no data")
+      return
+    if self._queryLimiter is not None and \
+       not self._queryLimiter.allow(prefix, arrival):
+      # Answer nothing on behalf of a client over its limit; even the
+      # truncated or refused reply is subject to the response limit.
+      self._statRateLimitedQueries.inc(prefix)
+      DNSPacket = parseDNSPacket(data)
+      reply = createLimitedReply(DNSPacket['header']._id, DNSPacket['question'],
+                                 self._options.rateaction)
+      if reply is not None and (self._responseLimiter is None or
+                                self._responseLimiter.allow(prefix, arrival)):
+        self.sendto(reply, address)
+        rcode = ord(reply[3]) & 0xF
+        self._statResponses.inc(Header.RCODE_NAMES.get(rcode, rcode))
+      return
+
+    DNSPacket = parseDNSPacket(data)
+    if self._querylog is not None:
+      self._querylog.write(arrival, address, DNSPacket['question'])
+    key = retransmitKey(address, DNSPacket)
+    if key in self._inflight:
+      self._statRetransmits.inc()
+      return
+    if tracing.tracer is not None:
+      tracing.tracer.start(id=DNSPacket['header']._id, client=address[0],
+                           qname=str(DNSPacket['question']._dn),
+                           qtype=DNSPacket['question']._type)
+    question = DNSPacket['question']
+    dn = question._dn
+    local = None
+    if self._localZones is not None:
+      local = self._localZones.lookup(dn._key)
+    if local is not None:
+      (rcode, localKey, entry) = local
+      self._statLocal.inc(Header.RCODE_NAMES.get(rcode, rcode))
+      if rcode != Header.RCODE_NOERR:
+        self.sendReply(DNSPacket, address, {'rcode': rcode}, arrival, prefix)
+        return
+      elif entry is NODATA or entry[0] == RR.TYPE_A:
+        # Local names only have addresses; other types, and names that
+        # have none, are answered with no RRs.
+        result = {'rcode': Header.RCODE_NOERR}
+        if question._type == RR.TYPE_A and entry is not NODATA:
+          result = {'answers': [RR_A(dn, entry[1], addr) for addr in entry[2]],
+                    'authority': [], 'additional': [], 'rcode': Header.RCODE_NOERR}
+        self.sendReply(DNSPacket, address, result, arrival, prefix)
+        return
+      # A local CNAME to a name without local data: resolve its target.
+      dn = DomainName.fromKey(localKey)
+
+    cache = self.resolver.cache
+    result = renameAnswer(cache.search(dn, question._type,
+                                       cls=question._class),
+                          question._dn)
+    if result != False:
+      self.sendReply(DNSPacket, address, result, arrival, prefix)
+    elif len(self._pending) >= self._maxPending:
+      result = cache.searchStale(dn, question._type, question._class) \
+               if self._options.servestale else False
+      self._statShed.inc("stale" if result != False else "servfail")
+      self.sendReply(DNSPacket, address,
+                     renameAnswer(result, DNSPacket['question']._dn) or None,
+                     arrival, prefix)
+    else:
+      # The trace, if any, is resumed by resolveQuery.
+      trace = None
+      if tracing.tracer is not None:
+        (trace, tracing.tracer.current) = (tracing.tracer.current, None)
+      self._pending.append((arrival, address, prefix, DNSPacket, dn, trace))
+      self._inflight[key] = False
+      if len(self._inflight) > MAX_INFLIGHT:
+        self._inflight.dequeueitem()
+
+  def resolveQuery(self, arrival, address, prefix, DNSPacket, dn, trace):
+    """
+    Starts resolving dn, the name queried or the target of its local
+    CNAME, for a queued cache miss, unless its client has given up on
+    it; answers it at once if an earlier query has cached the answer
+    while this one was queued
+    """
+    self._queryUpstream = 0
+    if tracing.tracer is not None:
+      tracing.tracer.current = trace
+    key = retransmitKey(address, DNSPacket)
+    if self._clock() - arrival > self._clientTimeout:
+      # Unanswered: a retransmission is a query of its own.
+      self._inflight.pop(key, None)
+      self._statShed.inc("expired")
+      if tracing.tracer is not None:
+        tracing.tracer.finish(shed="expired")
+      return
+    question = DNSPacket['question']
+    if dn is not question._dn:
+      question = QE(type=question._type, dn=dn)
+      question._class = DNSPacket['question']._class
+    r = self.resolver.prefetch(question,
+                               arrival + self._deadline - self._clock())
+    if r is not None:
+      if tracing.tracer is not None:
+        tracing.tracer.current = None
+      self._resolving.append((r, arrival, address, prefix, DNSPacket, trace))
+      return
+    result = renameAnswer(self.resolver.cache.search(dn, question._type,
+                                                     cls=question._class),
+                          DNSPacket['question']._dn)
+    self._answer(key, DNSPacket, address, result, arrival, prefix)
+
+  def _answer(self, key, DNSPacket, address, result, arrival, prefix):
+    """ Replies to the resolved query DNSPacket, and remembers it as
+    answered """
+    self.sendReply(DNSPacket, address, result, arrival, prefix)
+    if key in self._inflight:
+      self._inflight[key] = True
+      self._answered.append(key)
+
+  def _admit(self):
+    """ Starts resolving the queued cache misses, oldest first, while
+    fewer than the most allowed are being resolved """
+    while self._pending and len(self._resolving) < self._maxResolving:
+      self.resolveQuery(*self._pending.popleft())
+
+  def _resolved(self):
+    """ Returns whether a query being resolved can be answered or
+    given up on now """
+    if self._resolving and not self.resolver.busy():
+      return True
+    for (r, arrival, address, prefix, DNSPacket, trace) in self._resolving:
+      if r.result is not None:
+        return True
+    return False
+
+  def answerResolved(self):
+    """
+    Answers the queries being resolved whose resolution is done, with
+    SERVFAIL those whose resolution can no longer end, and drops those
+    whose client has given up on them
+    """
+    now = self._clock()
+    stalled = not self.resolver.busy()
+    resolving = []
+    for entry in self._resolving:
+      (r, arrival, address, prefix, DNSPacket, trace) = entry
+      expired = now - arrival > self._clientTimeout
+      if r.result is None and not stalled and not expired:
+        resolving.append(entry)
+        continue
+      if tracing.tracer is not None:
+        tracing.tracer.current = trace
+      key = retransmitKey(address, DNSPacket)
+      if r.result is None and expired:
+        self._inflight.pop(key, None)
+        self._statShed.inc("expired")
+        if tracing.tracer is not None:
+          tracing.tracer.finish(shed="expired")
+        continue
+      # Queries for the same question to a forwarder share one
+      # resolution, and so its result: each is renamed in a copy.
+      result = dict(r.result) if r.result is not None else None
+      self._queryUpstream = r._budget._queries
+      self._answer(key, DNSPacket, address,
+                   renameAnswer(result, DNSPacket['question']._dn),
+                   arrival, prefix)
+    self._resolving = resolving
+
+  def handOver(self):
+    """
+    Carries on handing over to the new server: sends it more of the
+    cache, and once it is ready, answers the queries still queued or
+    being resolved and exits
+    """
+    try:
+      if not self._handoff.step():
+        return
+    except error, e:
+      logger.warning("handover failed, carrying on: %s", e)
+      self._handoff.close()
+      self._handoff = None
+      return
+    logger.info("handed over %d cache entries; answering %d queued queries "
+                "and exiting", self._handoff.sent,
+                len(self._pending) + len(self._resolving))
+    while self._pending or self._resolving:
+      self._clock.tick()
+      self._admit()
+      self.resolver.work(0 if self._resolved() else self._deadline)
+      self.answerResolved()
+    util.afh.flush()
+    sys.exit(0)
+
+  def _wait(self):
+    """
+    Waits for a client query to arrive, carrying on with the resolver's
+    lookups, the handover and control commands meanwhile, and returns
+    the socket it is ready on; returns None instead once the resolver
+    has made progress, while client queries are being resolved
+    """
+    clock = self._clock
+    resolver = self.resolver
+    control = self._control
+    resolver.work()
+    while 1:
+      waitfor = self._listening + resolver.readers()
+      writefor = resolver.writers()
+      timeout = resolver.nextTimeout()
+      if self._resolving:
+        # Wake up to drop a query its client has given up on.
+        expiry = max(0, self._resolving[0][1] + self._clientTimeout - clock())
+        timeout = expiry if timeout is None else min(timeout, expiry)
+        if self._resolved():
+          timeout = 0
+      if self._handoff is not None:
+        waitfor.append(self._handoff)
+        if self._handoff.sending():
+          timeout = 0
+      elif self._listener is not None:
+        waitfor.append(self._listener)
+      if control is not None:
+        waitfor.extend(control.readers())
+        writefor.extend(control.writers())
+        if control.busy():
+          timeout = 0
+      try:
+        (rds, wds, xds) = select.select(waitfor, writefor, [], timeout)
+      except select.error:
+        poll_signals()
+        continue # interrupted by a signal
+      ready = [sock for sock in self._listening if sock in rds]
+      if ready:
+        return ready[0]
+      if self._handoff is not None:
+        self.handOver()
+      elif self._listener in rds:
+        self._handoff = self._listener.accept([('dns', self._ss)] +
+          ([('dns6', self._ss6)] if self._ss6 is not None else []) +
+          ([('metrics', self._httpd.socket)] if self._httpd is not None else []),
+          resolver.cache)
+      if control is not None:
+        control.step()
+      resolver.work()
+      if self._resolving:
+        return None
+
+  def run(self):
+    """ Serves client queries until the process exits """
+    clock = self._clock
+    while 1:
+      clock.tick()
+      poll_signals()
+      if self._handoff is not None:
+        self.handOver()
+      if self._control is not None:
+        self._control.step()
+      self._admit()
+      sock = self._wait()
+      self.answerResolved()
+      if sock is not None:
+        (data, address) = sock.recvfrom(512) # DNS limits UDP msgs to 512 bytes
+        self.receiveQuery(data, address, clock.tick())
+      for i in range(MAX_DRAIN):
+        for sock in self._listening:
+          try:
+            (data, address) = sock.recvfrom(512, MSG_DONTWAIT)
+            break
+          except error:
+            pass
+        else:
+          # Drained: retransmissions of the queries answered so far have
+          # been absorbed, and later ones are new queries.
+          for key in self._answered:
+            self._inflight.pop(key, None)
+          self._answered = []
+          break
+        self.receiveQuery(data, address, clock())
+
+def main(argv = None):
+  """
+  Runs the server with the command line arguments argv (by default
+  those of the process)
+  """
+  start_logging()
+  parser = make_parser()
+  (options, args) = parser.parse_args(argv)
+  for spec in options.loglevels:
+    (name, sep, level) = spec.partition("=")
+    try:
+      set_log_level(name, level)
+    except ValueError, e:
+      parser.error(str(e))
+  if not 0 <= options.rateprefix <= 32:
+    parser.error("--ratelimit-prefix must be between 0 and 32")
+  if options.maxresolving < 1:
+    parser.error("--max-resolving must be at least 1")
+
+  # SIGUSR1 starts (or ends early) a sampling profile of the main loop,
+  # written to ./ncsdns.<time>.folded.
+  profiler.install(signal.SIGUSR1, options.profileseconds,
+                   options.profileinterval / 1000.0)
+
+  try:
+    server = Server(options)
+  except ValueError, e:
+    parser.error(str(e))
+
+  # NOTE: In order to pass the test suite, the following must be the
+  # first line that your dns server prints and flushes within one
+  # second, to sys.stdout:
+  print "%s: listening on port %d" % (sys.argv[0], server.port)
+  sys.stdout.flush()
+  server.run()
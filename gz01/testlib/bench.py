@@ -0,0 +1,221 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+"""
+Offline benchmark of ncsdns.py against a stand-in DNS hierarchy.
+
+Usage: python -m gz01.testlib.bench [options]
+
+Starts the stand-in servers of gz01.testlib.standin on loopback, runs
+ncsdns.py against them and reports throughput and latency percentiles
+for cold-cache, warm-cache and mixed workloads.  No network access,
+dig or strace is needed.
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from optparse import OptionParser
+import json, os, random, re, shutil, signal, sys, tempfile, time
+from select import select
+from subprocess import Popen, PIPE
+
+from gz01.dnslib.Header import Header
+from gz01.testlib.loadgen import LoadGenerator, sequence
+from gz01.testlib.standin import build_hierarchy, ROOT_ADDR
+
+SERVERPATH = os.path.join(os.path.dirname(os.path.dirname(
+  os.path.dirname(os.path.abspath(__file__)))), "ncsdns.py")
+
+def start_resolver(hierarchy, serverpath = SERVERPATH, extraargs = ()):
+  """
+  Run serverpath with the Python running this script, pointed at the
+  stand-in root of hierarchy.  The server runs in a scratch directory
+  so that its log files do not clobber those in the source tree.
+  Returns a tuple (server, serverport, workdir).
+  """
+  workdir = tempfile.mkdtemp(prefix="ncsdns-bench-")
+  cmd = [sys.executable, serverpath, "--root", ROOT_ADDR,
+         "--upstream-port", str(hierarchy._port)] + list(extraargs)
+  se = open(os.path.join(workdir, "ncsdns.stderr"), "w")
+  server = Popen(cmd, stdout=PIPE, stderr=se, cwd=workdir)
+  rds, wds, xds = select([server.stdout], [], [], 5.0)
+  line = server.stdout.readline() if rds else ""
+  m = re.search(r'listening on port (\d+)$', line)
+  if m is None:
+    stop_resolver(server, workdir, keep=True)
+    raise RuntimeError("server did not report its port; see %s" % (workdir,))
+  return (server, int(m.group(1)), workdir)
+
+def stop_resolver(server, workdir, keep = False):
+  if server.poll() is None:
+    os.kill(server.pid, signal.SIGINT)
+    for i in range(20):
+      if server.poll() is not None:
+        break
+      time.sleep(0.05)
+    else:
+      server.kill()
+  server.wait()
+  if not keep:
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def run_workload(serverport, workload, timeout, outstanding = 1):
+  """
+  Issue the (name, expected addresses) pairs of workload, at most
+  outstanding at a time, and return a dict of results.
+  """
+  expected = dict([(name.lower(), addrs) for (name, addrs) in workload])
+  gen = LoadGenerator(("127.0.0.1", serverport), outstanding=outstanding,
+                      timeout=timeout, expected=expected)
+  r = gen.run(sequence([name for (name, addrs) in workload]))
+  failed = sum([n for (rcode, n) in r._rcodes.items()
+                if rcode != Header.RCODE_NOERR])
+  return {'queries': r._sent, 'errors': failed + r._invalid + r._malformed,
+          'timeouts': r._timeouts, 'qps': r.qps(),
+          'p50': r._latency.percentile(50), 'p99': r._latency.percentile(99),
+          'p999': r._latency.percentile(99.9)}
+
+def workloads(names, nqueries, seed):
+  """
+  Returns [(workload name, warm-up queries, timed queries)] for the
+  standard cold, warm and mixed workloads over names.
+  """
+  rnd = random.Random(seed)
+  cold = list(names)
+  rnd.shuffle(cold)
+  warm = [rnd.choice(names) for i in range(nqueries)]
+  # mixed: half the names are warmed up first, and the timed run draws
+  # uniformly from all of them.
+  mixedwarmup = cold[:len(cold) // 2]
+  mixed = [rnd.choice(names) for i in range(nqueries)]
+  return [("cold", [], cold), ("warm", list(names), warm),
+          ("mixed", mixedwarmup, mixed)]
+
+def run_benchmark(hierarchy, nqueries, timeout, seed, serverpath = SERVERPATH,
+                  extraargs = ()):
+  """
+  Run every standard workload against a fresh server and return
+  [(workload name, results dict)].
+  """
+  results = []
+  for (name, warmup, timed) in workloads(hierarchy._names, nqueries, seed):
+    (server, serverport, workdir) = start_resolver(hierarchy, serverpath,
+                                                   extraargs)
+    try:
+      run_workload(serverport, warmup, timeout)
+      upstream = hierarchy.queries()
+      result = run_workload(serverport, timed, timeout)
+      result['upstream'] = hierarchy.queries() - upstream
+      results.append((name, result))
+    finally:
+      stop_resolver(server, workdir)
+  return results
+
+def report(results, out = sys.stdout):
+  out.write("%-8s %8s %6s %8s %10s %9s %9s %9s %9s\n" %
+            ("workload", "queries", "errors", "timeouts", "qps",
+             "p50(ms)", "p99(ms)", "p999(ms)", "upstream"))
+  for (name, r) in results:
+    out.write("%-8s %8d %6d %8d %10.1f %9.2f %9.2f %9.2f %9d\n" %
+              (name, r['queries'], r['errors'], r['timeouts'], r['qps'],
+               r['p50'] * 1000, r['p99'] * 1000, r['p999'] * 1000,
+               r['upstream']))
+
+def compare(results, baseline, tolerance):
+  """
+  Returns a list of messages describing every workload whose QPS fell,
+  or whose p50/p99 latency rose, by more than tolerance (a fraction)
+  relative to baseline.
+  """
+  regressions = []
+  for (name, r) in results:
+    if name not in baseline:
+      continue
+    b = baseline[name]
+    if r['qps'] < b['qps'] * (1.0 - tolerance):
+      regressions.append("%s: qps %.1f < baseline %.1f" % (name, r['qps'], b['qps']))
+    for p in ('p50', 'p99'):
+      if r[p] > b[p] * (1.0 + tolerance):
+        regressions.append("%s: %s %.2fms > baseline %.2fms" %
+                           (name, p, r[p] * 1000, b[p] * 1000))
+    if r['errors'] + r['timeouts'] > b['errors'] + b['timeouts']:
+      regressions.append("%s: %d failed queries, baseline %d" %
+                         (name, r['errors'] + r['timeouts'],
+                          b['errors'] + b['timeouts']))
+  return regressions
+
+def main(argv):
+  parser = OptionParser(usage="%prog [options]")
+  parser.add_option("--tlds", type="int", default=2)
+  parser.add_option("--domains", type="int", default=10, help="domains per TLD")
+  parser.add_option("--hosts", type="int", default=5, help="hosts per domain")
+  parser.add_option("--chains", type="int", default=2, help="CNAME chains per domain")
+  parser.add_option("--chain-length", dest="chainlength", type="int", default=2)
+  parser.add_option("--glueless", type="float", default=0.0,
+                    help="fraction of delegations without glue")
+  parser.add_option("--latency", type="float", default=0.0,
+                    help="seconds added to every upstream reply")
+  parser.add_option("--jitter", type="float", default=0.0)
+  parser.add_option("--loss", type="float", default=0.0,
+                    help="probability that an upstream query is dropped")
+  parser.add_option("--ipv6", action="store_true", default=False,
+                    help="serve the first TLD over IPv6 only, on ::1")
+  parser.add_option("-n", "--queries", type="int", default=1000,
+                    help="timed queries in the warm and mixed workloads")
+  parser.add_option("--timeout", type="float", default=20.0,
+                    help="seconds to wait for each reply")
+  parser.add_option("--seed", type="int", default=0)
+  parser.add_option("--server", default=SERVERPATH, help="server script to run")
+  parser.add_option("--save", metavar="FILE", help="write the results to FILE as JSON")
+  parser.add_option("--compare", metavar="FILE",
+                    help="fail if the results regress against those saved in FILE")
+  parser.add_option("--tolerance", type="float", default=0.2,
+                    help="allowed fractional regression (default: %default)")
+  (options, args) = parser.parse_args(argv)
+
+  hierarchy = build_hierarchy(options.tlds, options.domains, options.hosts,
+                              options.chains, options.chainlength,
+                              options.glueless, options.latency,
+                              options.jitter, options.loss, seed=options.seed,
+                              ipv6=options.ipv6)
+  hierarchy.start()
+  try:
+    results = run_benchmark(hierarchy, options.queries, options.timeout,
+                            options.seed, options.server)
+  finally:
+    hierarchy.stop()
+  report(results)
+
+  if options.save:
+    f = open(options.save, "w")
+    json.dump(dict(results), f, indent=2, sort_keys=True)
+    f.close()
+  if options.compare:
+    f = open(options.compare)
+    regressions = compare(results, json.load(f), options.tolerance)
+    f.close()
+    for r in regressions:
+      print "REGRESSION: %s" % (r,)
+    if regressions:
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
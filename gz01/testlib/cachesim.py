@@ -0,0 +1,299 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+"""
+Simulate the resolver's cache against a recorded query trace.
+
+Usage: python -m gz01.testlib.cachesim [options] TRACE
+
+TRACE is a query log written by ncsdns.py --capture, or a pcap file.
+Every query in it is looked up in, and on a miss its answer added to,
+the Cache of gz01.resolver itself, on a virtual clock set to the time
+the query was recorded, once for every cache size in --sizes and
+eviction policy in --policies; no server is run and nothing is sent.
+How long an answer may be cached for is learned from the reply records
+of a query log, and is --default-ttl seconds for names whose reply has
+not been seen.  The trace is streamed in a single pass, so that its
+length is bounded by patience rather than memory.
+
+For every size and policy, the hit ratio, the most entries cached at
+once, an estimate of the memory they took, and the rate of queries a
+server with that cache would have sent upstream are reported.
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import OrderedDict
+from optparse import OptionParser
+import sys
+
+from gz01.clock import VirtualClock
+from gz01.dnslib.Header import Header
+from gz01.dnslib.RR import RR, RR_CNAME, RR_SOA, RR_UNKNOWN
+from gz01.inetlib.types import DomainName
+from gz01.querylog import MAGIC, QUERY, RESPONSE, read_records, read_pcap
+from gz01.resolver import Cache, POLICIES
+
+DEFAULT_TTL = 300
+MAX_NAMES = 1000000
+
+# What the simulated answers hold; only their TTLs matter.
+ANSWER_ADDR = "192.0.2.1"
+ANSWER_NAME = DomainName("cachesim.invalid.")
+
+# One cached entry in this many is measured for the memory estimate.
+SAMPLE_EVERY = 512
+
+def read_trace(path):
+  """ Yields the records of the query log or pcap file at path, as
+  read_records() does; a pcap holds only queries. """
+  f = open(path, "rb")
+  magic = f.read(len(MAGIC))
+  f.close()
+  if magic == MAGIC:
+    return read_records(path)
+  return ((QUERY, timestamp, client, port, qtype, DomainName(name)._key)
+          for (timestamp, client, port, name, qtype) in read_pcap(path))
+
+def deep_size(obj, seen = None):
+  """ Returns the bytes taken by obj and everything it refers to that
+  has not been seen. """
+  if seen is None:
+    seen = set()
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum([deep_size(k, seen) + deep_size(v, seen)
+                 for (k, v) in obj.iteritems()])
+  elif isinstance(obj, (list, tuple, set)):
+    size += sum([deep_size(x, seen) for x in obj])
+  elif hasattr(obj, '__dict__'):
+    size += deep_size(obj.__dict__, seen)
+  return size
+
+class TTLTable:
+  """
+  What the replies of a trace said about the names asked, for the most
+  recently answered names.
+
+  Member variables:
+
+  _answers -- [(name key, qtype) --> (rcode, ttl)], least recently
+  answered first.  The TTL is the longest seen with that rcode, since
+  replies from the cache give what is left of it.
+
+  _max -- how many names are remembered at most.
+  """
+
+  def __init__(self, max = MAX_NAMES):
+    self._answers = OrderedDict()
+    self._max = max
+
+  def get(self, key, qtype):
+    return self._answers.get((key, qtype))
+
+  def learn(self, key, qtype, rcode, ttl):
+    """ Note a reply; returns whether it is the first one remembered
+    for key and qtype. """
+    old = self._answers.pop((key, qtype), None)
+    if old is not None and old[0] == rcode:
+      ttl = max(ttl, old[1])
+    self._answers[(key, qtype)] = (rcode, ttl)
+    if len(self._answers) > self._max:
+      self._answers.popitem(last=False)
+    return old is None
+
+def cache_answer(cache, dn, qtype, rcode, ttl):
+  """ Add to cache an answer to the query about dn of type qtype, with
+  rcode, that can be cached for ttl seconds. """
+  if ttl <= 0:
+    return
+  if rcode == Header.RCODE_NAMEERR:
+    cache.addNegative(dn, qtype, rcode, [RR_SOA(dn, ttl, ANSWER_NAME,
+      ANSWER_NAME, 0, 0, 0, 0, ttl)])
+  elif rcode != Header.RCODE_NOERR:
+    return
+  elif qtype == RR.TYPE_A:
+    cache.addA(dn, ANSWER_ADDR, ttl)
+  elif qtype == RR.TYPE_CNAME:
+    cache.addCNAME(dn, ANSWER_NAME, ttl)
+  else:
+    cache.addRRset([RR_UNKNOWN(dn, ttl, qtype, "")])
+
+class Simulation:
+  """
+  A cache of one size and eviction policy, and what happened to it.
+
+  Member variables:
+
+  cache -- the gz01.resolver.Cache.
+
+  hits, misses -- queries answered from the cache, and not.
+
+  peak -- the most entries cached at once.
+
+  _sampled, _sampledBytes -- entries measured, and their total size.
+  """
+
+  def __init__(self, size, policy, clock):
+    self.size = size
+    self.policy = policy
+    self.cache = Cache(hints=[], clock=clock, maxEntries=size, policy=policy)
+    self.hits = 0
+    self.misses = 0
+    self.peak = 0
+    self._sampled = 0
+    self._sampledBytes = 0
+
+  def query(self, dn, qtype, answer):
+    """ Look up the query about dn of type qtype, adding answer, (rcode,
+    ttl), to the cache if it is not there. """
+    if self.cache.search(dn, qtype, addAuthority=False) != False:
+      self.hits += 1
+      return
+    self.misses += 1
+    self.add(dn, qtype, answer)
+
+  def learned(self, dn, qtype, answer):
+    """ Replace what was cached of dn and qtype before its answer was
+    known with answer. """
+    if self.cache.remove(dn, qtype):
+      self.add(dn, qtype, answer)
+
+  def add(self, dn, qtype, answer):
+    cache_answer(self.cache, dn, qtype, answer[0], answer[1])
+    n = len(self.cache)
+    if n > self.peak:
+      self.peak = n
+    if (self.misses % SAMPLE_EVERY) == 1:
+      self._sample(dn, qtype)
+
+  def _sample(self, dn, qtype):
+    """ Measure the entry just cached for dn and qtype. """
+    cache = self.cache
+    for (table, key) in ((cache.acache, dn._key), (cache.cnamecache, dn._key),
+                         (cache.rrcache, (dn._key, qtype, RR.CLASS_IN)),
+                         (cache.negcache, (dn._key, qtype, RR.CLASS_IN))):
+      if key in table:
+        # The key, the entry, a slot in the table and, for a bounded
+        # cache, in its order of eviction.
+        size = deep_size((key, table[key])) + 3 * sys.getsizeof(0)
+        if self.size is not None:
+          size += deep_size(((None, key), 0.0))
+        self._sampled += 1
+        self._sampledBytes += size
+        return
+
+  def entryBytes(self):
+    """ The mean bytes taken by an entry, or 0 if none was measured. """
+    return self._sampledBytes / float(self._sampled) if self._sampled else 0
+
+def simulate(records, simulations, ttls, defaultTTL = DEFAULT_TTL, limit = None):
+  """
+  Run the queries of records, as read_trace() yields them, through
+  simulations, sharing their virtual clock, learning TTLs from the
+  replies into the TTLTable ttls.  Stops after limit queries, if given.
+  Returns (queries, seconds of trace time they spanned).
+  """
+  clock = simulations[0].cache._clock
+  queries = 0
+  first = last = None
+  for record in records:
+    (kind, timestamp, qtype, key) = (record[0], record[1], record[4], record[5])
+    clock.advanceTo(timestamp)
+    if kind == RESPONSE:
+      if ttls.learn(key, qtype, record[2], record[3]):
+        dn = DomainName.fromKey(key)
+        answer = ttls.get(key, qtype)
+        for s in simulations:
+          s.learned(dn, qtype, answer)
+      continue
+    if limit is not None and queries >= limit:
+      break
+    queries += 1
+    if first is None:
+      first = timestamp
+    last = timestamp
+    dn = DomainName.fromKey(key)
+    answer = ttls.get(key, qtype) or (Header.RCODE_NOERR, defaultTTL)
+    for s in simulations:
+      s.query(dn, qtype, answer)
+  return (queries, (last - first) if queries else 0.0)
+
+def report(simulations, queries, duration, upstreamPerMiss, out = sys.stdout):
+  out.write("%d queries over %.1fs\n" % (queries, duration))
+  out.write("%-8s %-6s %10s %10s %6s %10s %10s %12s\n" %
+            ("size", "policy", "hits", "misses", "ratio", "peak", "MB",
+             "upstream/s"))
+  for s in simulations:
+    out.write("%-8s %-6s %10d %10d %6.3f %10d %10.1f %12.1f\n" %
+              (s.size if s.size is not None else "none",
+               s.policy if s.size is not None else "-", s.hits,
+               s.misses, s.hits / float(queries) if queries else 0.0, s.peak,
+               s.peak * s.entryBytes() / (1 << 20),
+               s.misses * upstreamPerMiss / duration if duration else 0.0))
+
+def parse_sizes(spec):
+  """ Returns the cache sizes of the comma-separated spec, None for
+  "none". """
+  return [None if s == "none" else int(s) for s in spec.split(",")]
+
+def main(argv):
+  parser = OptionParser(usage="%prog [options] TRACE")
+  parser.add_option("--sizes", default="1000,10000,100000",
+                    help="comma-separated cache sizes in entries; add \"none\" for an unbounded cache to compare with (default: %default)")
+  parser.add_option("--policies", default=",".join(POLICIES),
+                    help="comma-separated eviction policies (default: %default)")
+  parser.add_option("--default-ttl", dest="defaultttl", type="int",
+                    default=DEFAULT_TTL,
+                    help="seconds an answer is cached for when its reply is not in the trace (default: %default)")
+  parser.add_option("--max-names", dest="maxnames", type="int",
+                    default=MAX_NAMES,
+                    help="names whose TTLs are remembered (default: %default)")
+  parser.add_option("--upstream-per-miss", dest="upstreampermiss",
+                    type="float", default=1.0,
+                    help="upstream queries a cache miss costs, e.g. the mean of the server's ncsdns_upstream_queries_per_query (default: %default)")
+  parser.add_option("-n", "--limit", type="int", help="simulate only the first N queries")
+  (options, args) = parser.parse_args(argv)
+  if len(args) != 1:
+    parser.error("need a TRACE")
+  policies = options.policies.split(",")
+  for policy in policies:
+    if policy not in POLICIES:
+      parser.error("unknown policy %s; choose from %s" %
+                   (policy, ", ".join(POLICIES)))
+
+  clock = VirtualClock()
+  simulations = []
+  for size in parse_sizes(options.sizes):
+    # Without a limit, nothing is evicted and the policy makes no
+    # difference.
+    for policy in (policies if size is not None else policies[:1]):
+      simulations.append(Simulation(size, policy, clock))
+  (queries, duration) = simulate(read_trace(args[0]), simulations,
+                                 TTLTable(options.maxnames),
+                                 options.defaultttl, options.limit)
+  report(simulations, queries, duration, options.upstreampermiss)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
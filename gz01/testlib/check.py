@@ -0,0 +1,574 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+"""
+Checks of behaviour that the benchmarks do not exercise.
+
+Usage: python -m gz01.testlib.check [CHECK...]
+
+Runs every check, or those named, and prints PASS, FAIL or SKIP for
+each; exits with the number that failed.  A check is skipped when the
+host lacks what it needs, e.g. IPv6.  Like the benchmarks, the checks
+need no network access: servers are run against stand-in hierarchies
+on loopback.
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os, random, shutil, signal, struct, sys, tempfile, time, traceback
+from select import select
+from threading import Thread
+from socket import socket, error, has_ipv6, AF_INET, AF_INET6, AF_UNIX, \
+  SOCK_DGRAM, SOCK_STREAM
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import RR
+from gz01.inetlib.types import DomainName
+from gz01.forwarder import ForwarderPool, parse_upstream
+from gz01.localzones import LocalZones, NODATA
+from gz01.resolver import Resolver
+from gz01.testlib.bench import start_resolver, stop_resolver
+from gz01.testlib.digparse import parse_reply, final_addresses
+from gz01.testlib.standin import build_hierarchy, hierarchy_for_names, \
+  IPV6_ADDR, StandinServer
+
+class Failure(Exception):
+  pass
+
+class Skip(Exception):
+  pass
+
+# [(name, function)] of every check, in the order they are run.
+CHECKS = []
+
+def check(f):
+  """ Decorator registering f as a check, named after it. """
+  CHECKS.append((f.__name__, f))
+  return f
+
+def expect(condition, message, *args):
+  if not condition:
+    raise Failure(message % args)
+
+def write_file(dir, name, text):
+  path = os.path.join(dir, name)
+  f = open(path, "w")
+  f.write(text)
+  f.close()
+  return path
+
+ZONE = """$ORIGIN example.com.
+$TTL 600
+@       IN SOA ns hostmaster 1 3600 600 86400 300
+        IN NS  ns
+        IN MX  10 mail
+ns      IN A   192.0.2.1
+mail    IN MX  10 mx.example.net.
+a.b     IN A   192.0.2.2
+*.w.x   IN A   192.0.2.3
+"""
+
+def local_zone_answers():
+  """ Returns {name: (rcode, entry)} of the answers from ZONE. """
+  workdir = tempfile.mkdtemp(prefix="ncsdns-check-")
+  try:
+    zones = LocalZones()
+    zones.addZone(write_file(workdir, "example.com.zone", ZONE))
+    zones.reload()
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+  answers = dict()
+  for name in ("example.com.", "ns.example.com.", "mail.example.com.",
+               "b.example.com.", "a.b.example.com.", "x.example.com.",
+               "w.x.example.com.", "v.w.x.example.com.", "c.example.com.",
+               "c.b.example.com.", "example.net."):
+    found = zones.lookup(DomainName(name)._key)
+    answers[name] = found and (found[0], found[2])
+  return answers
+
+@check
+def local_zone_apex():
+  answers = local_zone_answers()
+  expect(answers["example.com."] == (Header.RCODE_NOERR, NODATA),
+         "apex answered %r, not NODATA", answers["example.com."])
+  expect(answers["mail.example.com."] == (Header.RCODE_NOERR, NODATA),
+         "name with only an MX answered %r, not NODATA",
+         answers["mail.example.com."])
+  expect(answers["ns.example.com."][1][0] == RR.TYPE_A,
+         "ns.example.com. answered %r", answers["ns.example.com."])
+  expect(answers["example.net."] is None,
+         "name outside the zone answered %r", answers["example.net."])
+
+@check
+def local_zone_empty_non_terminal():
+  answers = local_zone_answers()
+  for name in ("b.example.com.", "x.example.com.", "w.x.example.com."):
+    expect(answers[name] == (Header.RCODE_NOERR, NODATA),
+           "empty non-terminal %s answered %r, not NODATA", name, answers[name])
+  expect(answers["a.b.example.com."][1][0] == RR.TYPE_A,
+         "a.b.example.com. answered %r", answers["a.b.example.com."])
+  expect(answers["v.w.x.example.com."][1][0] == RR.TYPE_A,
+         "wildcard answered %r", answers["v.w.x.example.com."])
+  for name in ("c.example.com.", "c.b.example.com."):
+    expect(answers[name] == (Header.RCODE_NAMEERR, None),
+           "undefined name %s answered %r, not NXDOMAIN", name, answers[name])
+
+def send_query(sock, serveraddr, name, qtype = QE.TYPE_A):
+  """ Sends a query about name to serveraddr from sock; returns its
+  ID. """
+  id = random.randint(0, 65535)
+  sock.sendto(Header(id, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1,
+                     rd=True).pack() + QE(qtype, DomainName(name)).pack(),
+              serveraddr)
+  return id
+
+def receive_reply(sock, id, name, timeout):
+  """ Returns (rcode, addresses of name) of the reply with id that
+  arrives on sock within timeout seconds, or None. """
+  end = time.time() + timeout
+  while True:
+    (rds, wds, xds) = select([sock], [], [], max(end - time.time(), 0))
+    if not rds:
+      return None
+    data = sock.recv(512)
+    if struct.unpack_from(">H", data)[0] != id:
+      continue
+    (rcode, address_dict, cname_dict, authns_dict, glueaddr_dict) = \
+      parse_reply(data)
+    return (rcode, final_addresses(name, address_dict, cname_dict))
+
+def query(serveraddr, name, qtype = QE.TYPE_A, timeout = 10.0):
+  """ Returns (rcode, addresses of name) of serveraddr's reply to a
+  query about name, or None if none came within timeout seconds. """
+  sock = socket(AF_INET6 if ":" in serveraddr[0] else AF_INET, SOCK_DGRAM)
+  try:
+    return receive_reply(sock, send_query(sock, serveraddr, name, qtype),
+                         name, timeout)
+  finally:
+    sock.close()
+
+# Seconds a resolution takes in the signal checks, and between the
+# signals sent to the server under test meanwhile.  Without a
+# forwarder, the root, TLD and domain servers share it, and each
+# answers before the server would ask again.
+SLOW_LATENCY = 1.5
+SIGNAL_EVERY = 0.4
+
+def signal_mid_resolution(forward):
+  """ Query a server whose upstreams are slow, signal it while it
+  waits for them, and expect the answer. """
+  name = "www.example.com."
+  hierarchy = hierarchy_for_names([name], latency=SLOW_LATENCY if forward
+                                  else SLOW_LATENCY / 3)
+  hierarchy.start()
+  args = []
+  if forward:
+    # The stand-in server of example.com answers for it as a
+    # recursive resolver would.
+    args = ["--forward", "%s:%d" % hierarchy._servers[-1]._addr]
+  (server, serverport, workdir) = start_resolver(hierarchy, extraargs=args)
+  sock = socket(AF_INET, SOCK_DGRAM)
+  try:
+    id = send_query(sock, ("127.0.0.1", serverport), name)
+    # The profiler, and a reload of the log levels.
+    for signum in (signal.SIGUSR1, signal.SIGHUP):
+      time.sleep(SIGNAL_EVERY)
+      os.kill(server.pid, signum)
+    reply = receive_reply(sock, id, name, 10 * SLOW_LATENCY)
+    expect(server.poll() is None, "server exited with status %s after a "
+           "signal", server.returncode)
+    expect(reply is not None, "no reply")
+    expect(reply == (Header.RCODE_NOERR, hierarchy._names[0][1]),
+           "answered %r", reply)
+  finally:
+    sock.close()
+    stop_resolver(server, workdir)
+    hierarchy.stop()
+
+@check
+def resolve_signal():
+  signal_mid_resolution(forward=False)
+
+@check
+def forward_signal():
+  signal_mid_resolution(forward=True)
+
+@check
+def slow_name_alongside():
+  (cached, slow, other) = ("www.example.com.", "www.slow.com.",
+                           "www.other.com.")
+  hierarchy = hierarchy_for_names([cached, slow, other])
+  hierarchy.start()
+  # Only slow.com. is slow to resolve, through its own forwarder.
+  zones = [zone for s in hierarchy._servers for zone in s._zones
+           if zone._origin._key == DomainName("slow.com.")._key]
+  forwarder = StandinServer("127.0.0.1", 0, zones, latency=SLOW_LATENCY)
+  forwarder.start()
+  (server, serverport, workdir) = start_resolver(hierarchy, extraargs=[
+    "--forward-zone", "slow.com=127.0.0.1:%d" % forwarder._addr[1]])
+  serveraddr = ("127.0.0.1", serverport)
+  addrs = dict(hierarchy._names)
+  sock = socket(AF_INET, SOCK_DGRAM)
+  try:
+    expect(query(serveraddr, cached) == (Header.RCODE_NOERR, addrs[cached]),
+           "%s not answered", cached)
+    id = send_query(sock, serveraddr, slow)
+    time.sleep(0.1)
+    # Neither a cache hit nor another miss waits for the slow name.
+    for name in (cached, other):
+      reply = query(serveraddr, name, timeout=SLOW_LATENCY / 2)
+      expect(reply is not None, "%s not answered while %s was resolved",
+             name, slow)
+      expect(reply == (Header.RCODE_NOERR, addrs[name]), "%s answered %r",
+             name, reply)
+    reply = receive_reply(sock, id, slow, 3 * SLOW_LATENCY)
+    expect(reply == (Header.RCODE_NOERR, addrs[slow]), "%s answered %r",
+           slow, reply)
+  finally:
+    sock.close()
+    stop_resolver(server, workdir)
+    forwarder.stop()
+    hierarchy.stop()
+
+# Names resolved at once by the forwarding checks, and the seconds the
+# forwarder takes to answer each.
+FORWARD_NAMES = ["h%d.example.com." % (i,) for i in range(20)]
+FORWARD_LATENCY = 0.3
+
+@check
+def forward_resolve_many():
+  hierarchy = hierarchy_for_names(FORWARD_NAMES, latency=FORWARD_LATENCY)
+  hierarchy.start()
+  forwarder = hierarchy._servers[-1]
+  try:
+    resolver = Resolver(port=hierarchy._port)
+    resolver.forwarders[DomainName(".")._key] = ForwarderPool([forwarder._addr])
+    start = time.time()
+    # The same question twice, spelled differently, is forwarded once.
+    results = resolver.resolve_many(FORWARD_NAMES + ["H0.EXAMPLE.COM."])
+    elapsed = time.time() - start
+  finally:
+    hierarchy.stop()
+  expected = dict(hierarchy._names)
+  for name in FORWARD_NAMES:
+    answers = [rr for rr in results[name].get('answers', [])
+               if rr._type == RR.TYPE_A]
+    expect(len(answers) == 1 and
+           answers[0].__str__().split()[-1] == expected[name][0],
+           "%s resolved to %r", name, results[name])
+  expect(forwarder._queries == len(FORWARD_NAMES),
+         "%d names forwarded with %d queries", len(FORWARD_NAMES),
+         forwarder._queries)
+  expect(elapsed < len(FORWARD_NAMES) * FORWARD_LATENCY / 4,
+         "%d names took %.1fs to forward, one at a time", len(FORWARD_NAMES),
+         elapsed)
+
+def control_command(path, command):
+  """ Returns the lines of the reply to command on the control socket
+  at path. """
+  sock = socket(AF_UNIX, SOCK_STREAM)
+  sock.settimeout(5.0)
+  try:
+    sock.connect(path)
+    sock.sendall(command + "\n")
+    data = ""
+    while not [l for l in data.split("\n")
+               if l.startswith("OK") or l.startswith("ERROR")]:
+      more = sock.recv(4096)
+      expect(more, "control socket closed after %r", data)
+      data += more
+  finally:
+    sock.close()
+  return data.splitlines()
+
+@check
+def forward_preload():
+  names = FORWARD_NAMES[:5]
+  hierarchy = hierarchy_for_names(names, latency=FORWARD_LATENCY)
+  hierarchy.start()
+  forwarder = hierarchy._servers[-1]
+  (server, serverport, workdir) = start_resolver(hierarchy, extraargs=[
+    "--forward", "%s:%d" % forwarder._addr, "--control", "control"])
+  path = os.path.join(workdir, "control")
+  try:
+    for i in range(50):
+      if os.path.exists(path):
+        break
+      time.sleep(0.1)
+    mode = os.stat(path).st_mode & 0777
+    expect(mode == 0600, "control socket has mode %o", mode)
+    reply = control_command(path, "preload " + " ".join(names))
+    expect(reply == ["OK %d queued" % (len(names),)], "preload: %r", reply)
+    end = time.time() + 10 * FORWARD_LATENCY
+    while forwarder._queries < len(names) and time.time() < end:
+      time.sleep(0.05)
+    expect(forwarder._queries == len(names), "%d of %d names preloaded",
+           forwarder._queries, len(names))
+    time.sleep(FORWARD_LATENCY)
+    for (name, addrs) in hierarchy._names:
+      reply = control_command(path, "lookup " + name)
+      expect([l for l in reply if l.split()[-1:] == addrs],
+             "%s not cached: %r", name, reply)
+    # Answered from the cache.
+    expect(query(("127.0.0.1", serverport), names[0]) ==
+           (Header.RCODE_NOERR, hierarchy._names[0][1]), "%s not answered",
+           names[0])
+    expect(forwarder._queries == len(names), "preloaded %s forwarded again",
+           names[0])
+  finally:
+    stop_resolver(server, workdir)
+    hierarchy.stop()
+
+class TruncatingForwarder(Thread):
+  """
+  A forwarder answering names whose first label is "big" over UDP with
+  only the TC bit set, and then over TCP after TCP_LATENCY seconds;
+  other names are answered over UDP after UDP_LATENCY seconds.
+  Answers are those of the StandinServer server.
+  """
+
+  UDP_LATENCY = 0.1
+  TCP_LATENCY = 0.5
+
+  def __init__(self, server):
+    Thread.__init__(self)
+    self.daemon = True
+    self._server = server
+    self._udp = socket(AF_INET, SOCK_DGRAM)
+    self._udp.bind(("127.0.0.1", 0))
+    self._addr = self._udp.getsockname()
+    self._tcp = socket(AF_INET, SOCK_STREAM)
+    self._tcp.bind(self._addr)
+    self._tcp.listen(5)
+    self._running = True
+
+  def run(self):
+    while self._running:
+      (rds, wds, xds) = select([self._udp, self._tcp], [], [], 0.05)
+      if self._udp in rds:
+        (data, address) = self._udp.recvfrom(512)
+        reply = self._server.reply(data)
+        if QE.fromData(data, 12)._dn._key.startswith("\x03big"):
+          reply = reply[:2] + chr(ord(reply[2]) | 0x02) + reply[3:]
+          reply = reply[:6] + "\x00" * 6 + reply[12:12 + len(data) - 12]
+        else:
+          time.sleep(self.UDP_LATENCY)
+        self._udp.sendto(reply, address)
+      if self._tcp in rds:
+        (conn, address) = self._tcp.accept()
+        Thread(target=self._answerTcp, args=(conn,)).start()
+
+  def _answerTcp(self, conn):
+    conn.settimeout(5.0)
+    data = ""
+    while len(data) < 2 or len(data) < 2 + struct.unpack(">H", data[:2])[0]:
+      more = conn.recv(4096)
+      if not more:
+        conn.close()
+        return
+      data += more
+    time.sleep(self.TCP_LATENCY)
+    reply = self._server.reply(data[2:])
+    conn.sendall(struct.pack(">H", len(reply)) + reply)
+    conn.close()
+
+  def stop(self):
+    self._running = False
+    self.join()
+    self._udp.close()
+    self._tcp.close()
+
+@check
+def forward_truncated():
+  names = ["big.example.com.", "small.example.com."]
+  hierarchy = hierarchy_for_names(names)
+  forwarder = TruncatingForwarder(hierarchy._servers[-1])
+  forwarder.start()
+  try:
+    pool = ForwarderPool([forwarder._addr])
+    done = dict()
+    start = time.time()
+    for (i, name) in enumerate(names):
+      packet = Header(i, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1,
+                      rd=True).pack() + QE(dn=DomainName(name)).pack()
+      pool.start(packet, 5.0, lambda f, name=name:
+                 done.setdefault(name, (time.time() - start, f.reply)))
+    while len(done) < len(names) and time.time() - start < 5.0:
+      select(pool.readers(), pool.writers(), [], pool.nextTimeout())
+      pool.poll()
+  finally:
+    forwarder.stop()
+  expected = dict(hierarchy._names)
+  for name in names:
+    expect(name in done and done[name][1] is not None, "%s not answered",
+           name)
+    (rcode, address_dict, cname_dict, authns_dict, glueaddr_dict) = \
+      parse_reply(done[name][1])
+    expect(final_addresses(name, address_dict, cname_dict) == expected[name],
+           "%s answered %r", name, done[name][1])
+  expect(done["big.example.com."][0] >= TruncatingForwarder.TCP_LATENCY,
+         "truncated reply answered in %.2fs, before the TCP reply",
+         done["big.example.com."][0])
+  expect(done["small.example.com."][0] < TruncatingForwarder.TCP_LATENCY,
+         "reply over UDP held up %.2fs by the TCP retry of another",
+         done["small.example.com."][0])
+
+@check
+def forward_ipv6():
+  expect(parse_upstream("[2001:DB8::1]:5353") == ("2001:db8::1", 5353) and
+         parse_upstream("2001:db8::1") == ("2001:db8::1", 53) and
+         parse_upstream("192.0.2.1:5353") == ("192.0.2.1", 5353),
+         "forwarder addresses misparsed")
+  for spec in ("2001:db8::1:", "[2001:db8::1", "[::1]53", "host:53"):
+    try:
+      parse_upstream(spec)
+    except ValueError:
+      continue
+    raise Failure("bad forwarder address %r accepted" % (spec,))
+  require_ipv6()
+  name = "www.example.com."
+  hierarchy = hierarchy_for_names([name])
+  forwarder = StandinServer(IPV6_ADDR, 0, hierarchy._servers[-1]._zones)
+  forwarder.start()
+  (server, serverport, workdir) = start_resolver(hierarchy, extraargs=[
+    "--forward", "[%s]:%d" % forwarder._addr])
+  try:
+    reply = query(("127.0.0.1", serverport), name)
+    expect(reply == (Header.RCODE_NOERR, hierarchy._names[0][1]),
+           "answered %r through an IPv6 forwarder", reply)
+    expect(forwarder._queries == 1, "IPv6 forwarder asked %d times",
+           forwarder._queries)
+  finally:
+    stop_resolver(server, workdir)
+    forwarder.stop()
+
+@check
+def handoff_cache():
+  name = "www.example.com."
+  hierarchy = hierarchy_for_names([name])
+  hierarchy.start()
+  servers = []
+  path = os.path.join(tempfile.mkdtemp(prefix="ncsdns-check-"), "handoff")
+  try:
+    servers.append(start_resolver(hierarchy, extraargs=["--handoff", path]))
+    (old, serverport, workdir) = servers[0]
+    expect(query(("127.0.0.1", serverport), name) ==
+           (Header.RCODE_NOERR, hierarchy._names[0][1]), "%s not answered",
+           name)
+    mode = os.stat(path).st_mode & 0777
+    expect(mode == 0600, "handoff socket has mode %o", mode)
+    # The new server primes the root again, but needs not ask the
+    # domain's server.
+    domainserver = hierarchy._servers[-1]
+    asked = domainserver._queries
+    servers.append(start_resolver(hierarchy, extraargs=["--handoff", path]))
+    expect(servers[1][1] == serverport, "new server on port %d, not %d",
+           servers[1][1], serverport)
+    for i in range(50):
+      if old.poll() is not None:
+        break
+      time.sleep(0.1)
+    expect(old.poll() is not None, "old server still running")
+    expect(query(("127.0.0.1", serverport), name) ==
+           (Header.RCODE_NOERR, hierarchy._names[0][1]),
+           "%s not answered after handover", name)
+    expect(domainserver._queries == asked,
+           "cache not handed over: %s resolved again", name)
+  finally:
+    for (server, serverport, workdir) in servers:
+      stop_resolver(server, workdir)
+    hierarchy.stop()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+def require_ipv6():
+  """ Raises Skip unless the host can use the IPv6 loopback address. """
+  if not has_ipv6:
+    raise Skip("no IPv6 support")
+  sock = socket(AF_INET6, SOCK_DGRAM)
+  try:
+    sock.bind((IPV6_ADDR, 0))
+  except error, e:
+    raise Skip("cannot bind %s: %s" % (IPV6_ADDR, e))
+  finally:
+    sock.close()
+
+@check
+def ipv6_client():
+  require_ipv6()
+  name = "www.example.com."
+  hierarchy = hierarchy_for_names([name])
+  hierarchy.start()
+  (server, serverport, workdir) = start_resolver(hierarchy)
+  try:
+    for host in (IPV6_ADDR, "127.0.0.1"):
+      reply = query((host, serverport), name)
+      expect(reply == (Header.RCODE_NOERR, hierarchy._names[0][1]),
+             "query over %s answered %r", host, reply)
+  finally:
+    stop_resolver(server, workdir)
+    hierarchy.stop()
+
+@check
+def ipv6_only_name_server():
+  require_ipv6()
+  # tld0. is served from ::1 only, with AAAA glue and no A.
+  hierarchy = build_hierarchy(ntlds=2, ndomains=2, nhosts=1, nchains=0,
+                              ipv6=True)
+  hierarchy.start()
+  tld0 = [s for s in hierarchy._servers if s._addr[0] == IPV6_ADDR][0]
+  (server, serverport, workdir) = start_resolver(hierarchy)
+  try:
+    for (name, addrs) in hierarchy._names:
+      reply = query(("127.0.0.1", serverport), name)
+      expect(reply == (Header.RCODE_NOERR, addrs), "%s answered %r", name,
+             reply)
+    expect(tld0._queries > 0, "tld0. server on %s never asked", IPV6_ADDR)
+  finally:
+    stop_resolver(server, workdir)
+    hierarchy.stop()
+
+def main(argv):
+  names = [name for (name, f) in CHECKS]
+  for name in argv:
+    if name not in names:
+      sys.stderr.write("unknown check %s; choose from %s\n" %
+                       (name, ", ".join(names)))
+      return 2
+  failed = 0
+  for (name, f) in CHECKS:
+    if argv and name not in argv:
+      continue
+    try:
+      f()
+      print "PASS: %s" % (name,)
+    except Skip, e:
+      print "SKIP: %s: %s" % (name, e)
+    except Failure, e:
+      print "FAIL: %s: %s" % (name, e)
+      failed += 1
+    except Exception:
+      print "FAIL: %s" % (name,)
+      traceback.print_exc()
+      failed += 1
+  return failed
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,312 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+"""
+Micro-benchmarks of the DNS message codec.
+
+Usage: python -m gz01.testlib.codecbench [options]
+
+Times parsing and packing of a corpus of representative messages with
+gz01.dnslib and gz01.inetlib.types.DomainName, and the cost of hashing
+and comparing names.  Timings are divided by that of a fixed
+calibration loop, so a baseline saved on one machine can be checked on
+another; --compare fails if any benchmark got slower than the baseline
+by more than the tolerance.
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from optparse import OptionParser
+import gc, json, os, struct, sys, time
+from socket import inet_aton, inet_pton, AF_INET6
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import *
+from gz01.inetlib.types import DomainName
+
+# The baseline kept in the source tree; refresh it with --save when a
+# change is meant to alter codec performance.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "codecbench.json")
+
+def pack_message(header, question, rrs):
+  """
+  Returns the packed message made of header, question and rrs (all of
+  its sections, in order), with owner names and NS/CNAME targets
+  compressed as real servers do (RFC 1035, Section 4.1.4).
+  """
+  out = [header.pack()]
+  length = [len(out[0])]
+  suffixes = dict() # canonical key --> offset of that name in the message
+
+  def name(dn):
+    key = dn._key
+    labels = [l for l in dn._namelist if l]
+    for i in range(len(labels)):
+      offset = suffixes.get(key)
+      if offset is not None:
+        out.append(struct.pack(">H", 0xC000 | offset))
+        length[0] += 2
+        return 2 + sum([1 + len(l) for l in labels[:i]])
+      if length[0] < 0x4000:
+        suffixes[key] = length[0]
+      out.append(chr(len(labels[i])) + labels[i])
+      length[0] += 1 + len(labels[i])
+      key = DomainName.parentKey(key)
+    out.append("\x00")
+    length[0] += 1
+    return 1 + sum([1 + len(l) for l in labels])
+
+  name(question._dn)
+  out.append(struct.pack(">2H", question._type, QE.CLASS_IN))
+  length[0] += 4
+  for rr in rrs:
+    name(rr._dn)
+    if rr._type in (RR.TYPE_NS, RR.TYPE_CNAME):
+      target = rr._nsdn if rr._type == RR.TYPE_NS else rr._cname
+      out.append(None) # placeholder for the fixed fields
+      i = len(out) - 1
+      length[0] += 10
+      rdlength = name(target)
+      out[i] = struct.pack(">2HlH", rr._type, RR.CLASS_IN, rr._ttl, rdlength)
+    else:
+      packed = rr.pack()
+      fixed = packed[len(rr._dn.pack()):]
+      out.append(fixed)
+      length[0] += len(fixed)
+  return "".join(out)
+
+def corpus():
+  """ Returns [(name, packed message)] of representative replies. """
+  messages = []
+  # A root referral to a TLD with 13 name servers and their glue.
+  q = QE(dn=DomainName("www.example.com."))
+  ns = [RR_NS(DomainName("com."), 172800,
+              DomainName("%s.gtld-servers.net." % (chr(ord('a') + i),)))
+        for i in range(13)]
+  glue = [RR_A(rr._nsdn, 172800, inet_aton("192.%d.30.30" % (i,)))
+          for (i, rr) in enumerate(ns)]
+  h = Header(1, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1,
+             nscount=len(ns), arcount=len(glue), qr=True)
+  messages.append(("referral13", pack_message(h, q, ns + glue)))
+  # A CNAME chain ending in an address.
+  q = QE(dn=DomainName("www.shop.example.com."))
+  chain = [RR_CNAME(DomainName("www.shop.example.com."), 300,
+                    DomainName("shop.example.cdn.net.")),
+           RR_CNAME(DomainName("shop.example.cdn.net."), 60,
+                    DomainName("e1234.a.cdn.net.")),
+           RR_CNAME(DomainName("e1234.a.cdn.net."), 20,
+                    DomainName("e1234.edge7.cdn.net.")),
+           RR_A(DomainName("e1234.edge7.cdn.net."), 20, inet_aton("203.0.113.7")),
+           RR_A(DomainName("e1234.edge7.cdn.net."), 20, inet_aton("203.0.113.8"))]
+  h = Header(2, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1,
+             ancount=len(chain), qr=True, aa=True)
+  messages.append(("cnamechain", pack_message(h, q, chain)))
+  # A negative answer carrying the zone's SOA.
+  q = QE(dn=DomainName("nonexistent.example.org."))
+  soa = [RR_SOA(DomainName("example.org."), 3600,
+                DomainName("ns1.example.org."),
+                DomainName("hostmaster.example.org."),
+                2024010101, 7200, 3600, 1209600, 3600)]
+  h = Header(3, Header.OPCODE_QUERY, Header.RCODE_NAMEERR, qdcount=1,
+             nscount=1, qr=True, aa=True)
+  messages.append(("soanegative", pack_message(h, q, soa)))
+  # IPv6 addresses.
+  q = QE(type=RR.TYPE_AAAA, dn=DomainName("www.example.net."))
+  aaaa = [RR_AAAA(DomainName("www.example.net."), 300,
+                  inet_pton(AF_INET6, "2001:db8::%x" % (i + 1,)))
+          for i in range(4)]
+  h = Header(4, Header.OPCODE_QUERY, Header.RCODE_NOERR, qdcount=1,
+             ancount=len(aaaa), qr=True, aa=True)
+  messages.append(("aaaa", pack_message(h, q, aaaa)))
+  return messages
+
+def parse(data):
+  """ Parse every record of data the way ncsdns.py does; returns
+  (header, question, rrs). """
+  header = Header.fromData(data)
+  offset = len(header)
+  question = QE.fromData(data, offset)
+  offset += len(question)
+  rrs = []
+  for i in range(header._ancount + header._nscount + header._arcount):
+    (rr, length) = RR.fromData(data, offset)
+    offset += length
+    rrs.append(rr)
+  return (header, question, rrs)
+
+def pack(message):
+  (header, question, rrs) = message
+  return "".join([header.pack(), question.pack()] + [rr.pack() for rr in rrs])
+
+def timeit(f, arg, n, repeat = 5):
+  """ Returns the best of repeat timings of n calls f(arg), in
+  nanoseconds per call. """
+  best = None
+  for r in range(repeat):
+    t0 = time.time()
+    for i in xrange(n):
+      f(arg)
+    t = (time.time() - t0) / n * 1e9
+    best = t if best is None or t < best else best
+  return best
+
+def _calibration(n):
+  x = 0
+  for i in xrange(n):
+    x += i & 7
+  return x
+
+def calibrate():
+  """ Returns the time of a fixed pure-Python loop, in nanoseconds per
+  iteration, to normalize timings across machines. """
+  best = None
+  for r in range(5):
+    t0 = time.time()
+    _calibration(200000)
+    t = (time.time() - t0) / 200000 * 1e9
+    best = t if best is None or t < best else best
+  return best
+
+def allocations(f, arg, n = 1000):
+  """ Returns the number of garbage-collected objects that n calls
+  f(arg) leave alive, divided by n: for a parse, the objects making
+  up one parsed message. """
+  gc.collect()
+  before = len(gc.get_objects())
+  keep = [f(arg) for i in xrange(n)]
+  after = len(gc.get_objects())
+  del keep
+  return (after - before - 1) / float(n)
+
+def benchmarks(n = 2000):
+  """ Returns [(benchmark name, f, arg, calls per timing, whether to
+  count allocations)]. """
+  l = []
+  for (name, data) in corpus():
+    l.append(("parse." + name, parse, data, n, True))
+    l.append(("pack." + name, pack, parse(data), n, False))
+
+  www = DomainName("www.example.com.")
+  same = DomainName("WWW.Example.COM.")
+  other = DomainName("www.example.org.")
+  table = dict([(DomainName("h%d.example.com." % (i,))._key, i) for i in range(1000)])
+  table[www._key] = -1
+  l.extend([("name.fromdata", DomainName.fromData, www.pack(), n * 10, False),
+            ("name.fromstring", DomainName, "www.example.com.", n * 10, False),
+            ("name.hash", hash, www, n * 50, False),
+            ("name.equal", www.__eq__, same, n * 50, False),
+            ("name.unequal", www.__eq__, other, n * 50, False),
+            ("name.lookup", table.get, www._key, n * 50, False),
+            ("name.walkparents", _walk, www._key, n * 10, False)])
+  return l
+
+def run(n = 2000, only = None):
+  """ Returns {benchmark name: {'ns': ns per op, 'units': ns per op
+  divided by the calibration loop's, 'allocs': objects per op (parse
+  benchmarks only)}}, for the benchmarks named in only, or all. """
+  results = dict()
+  for (name, f, arg, count, allocs) in benchmarks(n):
+    if only is not None and name not in only:
+      continue
+    # Calibrate next to every benchmark, so that a change of clock speed
+    # or load during the run scales both alike.
+    unit = calibrate()
+    ns = timeit(f, arg, count)
+    unit = min(unit, calibrate())
+    results[name] = {'ns': round(ns, 1), 'units': round(ns / unit, 3)}
+    if allocs:
+      results[name]['allocs'] = allocations(f, arg)
+  return results
+
+def _walk(key):
+  while key is not None:
+    key = DomainName.parentKey(key)
+
+def compare(results, baseline, tolerance):
+  """ Returns [(benchmark name, message)] describing every benchmark
+  that is slower, in calibrated units, than baseline by more than
+  tolerance (a fraction). """
+  regressions = []
+  for (name, b) in sorted(baseline.items()):
+    r = results.get(name)
+    if r is None:
+      continue
+    if r['units'] > b['units'] * (1.0 + tolerance):
+      regressions.append((name, "%s: %.3f units (%.0fns) > baseline %.3f units" %
+                                 (name, r['units'], r['ns'], b['units'])))
+    if 'allocs' in b and r.get('allocs', 0) > b['allocs'] * (1.0 + tolerance):
+      regressions.append((name, "%s: %.1f objects per message > baseline %.1f" %
+                                 (name, r['allocs'], b['allocs'])))
+  return regressions
+
+def main(argv):
+  parser = OptionParser(usage="%prog [options]")
+  parser.add_option("-n", "--iterations", type="int", default=2000,
+                    help="calls per timing of the message benchmarks")
+  parser.add_option("--save", metavar="FILE", nargs=1,
+                    help="write the results to FILE as a new baseline")
+  parser.add_option("--update", dest="save", action="store_const",
+                    const=BASELINE, help="same as --save %s" % (BASELINE,))
+  parser.add_option("--compare", metavar="FILE", nargs=1,
+                    help="fail on regressions against the baseline in FILE")
+  parser.add_option("--check", dest="compare", action="store_const",
+                    const=BASELINE, help="same as --compare %s" % (BASELINE,))
+  parser.add_option("--tolerance", type="float", default=0.25,
+                    help="allowed fractional slowdown (default: %default)")
+  parser.add_option("--retries", type="int", default=2,
+                    help="times to re-time a regressed benchmark before failing")
+  (options, args) = parser.parse_args(argv)
+
+  results = run(options.iterations)
+  if options.compare:
+    f = open(options.compare)
+    baseline = json.load(f)
+    f.close()
+    # A timing can be thrown off by other load on the machine; re-time
+    # what looks regressed and keep each benchmark's best.
+    for i in range(options.retries):
+      regressed = set([name for (name, m) in
+                       compare(results, baseline, options.tolerance)])
+      if not regressed:
+        break
+      for (name, r) in run(options.iterations, regressed).items():
+        if r['units'] < results[name]['units']:
+          results[name] = r
+  print "%-24s %10s %8s %8s" % ("benchmark", "ns/op", "units", "allocs")
+  for name in sorted(results):
+    r = results[name]
+    print "%-24s %10.1f %8.3f %8s" % (name, r['ns'], r['units'],
+                                      "%.1f" % r['allocs'] if 'allocs' in r else "")
+  if options.save:
+    f = open(options.save, "w")
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.close()
+  if options.compare:
+    regressions = compare(results, baseline, options.tolerance)
+    for (name, m) in regressions:
+      print "REGRESSION: %s" % (m,)
+    if regressions:
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -1,4 +1,9 @@
 import re
+from socket import inet_ntoa
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import RR
 
 cnamere = re.compile(r'((?:[^ \t\n\r\f\v\.]+\.)+)\s+\d+\s+IN\s+CNAME\s+((?:[^ \t\n\r\f\v\.]+\.)+)')
 addressre = re.compile(r'((?:[^ \t\n\r\f\v\.]+\.)+)\s+\d+\s+IN\s+A\s+((?:\d+\.)+\d+)')
@@ -38,3 +43,49 @@ def parse_digout(digout):
 
   return (address_dict, cname_dict, authns_dict, glueaddr_dict)
 
+
+def parse_reply(data):
+  """
+  Parse a DNS reply straight from the wire, without running dig.
+  Returns (rcode, address_dict, cname_dict, authns_dict,
+  glueaddr_dict), the last four in the form parse_digout returns.
+  """
+  header = Header.fromData(data)
+  offset = len(header)
+  for i in range(header._qdcount):
+    offset += len(QE.fromData(data, offset))
+  sections = []
+  for count in (header._ancount, header._nscount, header._arcount):
+    rrs = []
+    for i in range(count):
+      (rr, length) = RR.fromData(data, offset)
+      offset += length
+      rrs.append(rr)
+    sections.append(rrs)
+  (answers, authority, additional) = sections
+
+  address_dict, cname_dict, authns_dict, glueaddr_dict = {}, {}, {}, {}
+  for rr in answers:
+    if rr._type == RR.TYPE_A:
+      address_dict.setdefault(str(rr._dn), []).append(inet_ntoa(rr._inaddr))
+    elif rr._type == RR.TYPE_CNAME:
+      cname_dict.setdefault(str(rr._dn), []).append(str(rr._cname))
+  for rr in authority:
+    if rr._type == RR.TYPE_NS:
+      authns_dict.setdefault(str(rr._dn), []).append(str(rr._nsdn))
+  for rr in additional:
+    if rr._type == RR.TYPE_A:
+      glueaddr_dict.setdefault(str(rr._dn), []).append(inet_ntoa(rr._inaddr))
+  return (header._rcode, address_dict, cname_dict, authns_dict, glueaddr_dict)
+
+def final_addresses(name, address_dict, cname_dict):
+  """
+  Returns the addresses name resolves to in a parsed answer section,
+  following any CNAME chain in it.
+  """
+  name = name.lower()
+  seen = set()
+  while name not in address_dict and name in cname_dict and name not in seen:
+    seen.add(name)
+    name = cname_dict[name][0]
+  return address_dict.get(name, [])
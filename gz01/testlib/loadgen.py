@@ -0,0 +1,389 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+"""
+In-process DNS load generator.
+
+Usage: python -m gz01.testlib.loadgen [options] PORT [NAMEFILE]
+
+Sends queries from a single UDP socket at a target rate, keeping up to
+a configurable number of them outstanding and matching replies to
+queries by DNS ID.  Latencies go into a Histogram; replies are counted
+by rcode and can be checked against expected addresses as they arrive.
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from bisect import bisect_left
+from collections import deque
+from optparse import OptionParser
+import errno, math, random, struct, sys, time
+from select import select
+from socket import *
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.inetlib.types import DomainName
+from gz01.testlib.digparse import parse_reply, final_addresses
+
+# DNS IDs are 16 bits, which bounds the queries one socket can have
+# outstanding.
+MAX_OUTSTANDING = 65536
+
+class Histogram:
+  """
+  A log-linear latency histogram: each power of two of microseconds is
+  split into SUBBUCKETS equal buckets, so any recorded value is known
+  to within 1/SUBBUCKETS of itself.
+
+  Member variables:
+
+  _counts -- [bucket index --> number of values recorded in it].
+
+  _count, _sum, _max -- count, sum and maximum of the values recorded.
+  """
+  SUBBUCKETS = 16
+
+  def __init__(self):
+    self._counts = dict()
+    self._count = 0
+    self._sum = 0.0
+    self._max = 0.0
+
+  def record(self, seconds):
+    us = int(seconds * 1e6)
+    if us < self.SUBBUCKETS:
+      i = us
+    else:
+      e = us.bit_length() - 5 # log2(SUBBUCKETS) + 1
+      i = (e + 1) * self.SUBBUCKETS + (us >> e) - self.SUBBUCKETS
+    self._counts[i] = self._counts.get(i, 0) + 1
+    self._count += 1
+    self._sum += seconds
+    if seconds > self._max:
+      self._max = seconds
+
+  def bucketLimit(self, i):
+    """ Returns the upper bound, in seconds, of bucket i. """
+    if i < self.SUBBUCKETS:
+      return (i + 1) / 1e6
+    e = i // self.SUBBUCKETS - 1
+    return ((i % self.SUBBUCKETS + self.SUBBUCKETS + 1) << e) / 1e6
+
+  def merge(self, other):
+    for (i, n) in other._counts.iteritems():
+      self._counts[i] = self._counts.get(i, 0) + n
+    self._count += other._count
+    self._sum += other._sum
+    self._max = max(self._max, other._max)
+
+  def percentile(self, p):
+    """ Returns the p-th percentile (0 <= p <= 100), in seconds. """
+    if not self._count:
+      return float('nan')
+    rank = max(1, int(math.ceil(p / 100.0 * self._count)))
+    seen = 0
+    for i in sorted(self._counts):
+      seen += self._counts[i]
+      if seen >= rank:
+        return min(self.bucketLimit(i), self._max)
+    return self._max
+
+  def mean(self):
+    return self._sum / self._count if self._count else float('nan')
+
+  def fractionBelow(self, seconds):
+    """ Returns the fraction of recorded values (to bucket precision)
+    no greater than seconds. """
+    if not self._count:
+      return float('nan')
+    n = sum([c for (i, c) in self._counts.iteritems()
+             if self.bucketLimit(i) <= seconds])
+    return n / float(self._count)
+
+def sequence(names):
+  """ Yields names in order, once each. """
+  for name in names:
+    yield name
+
+def uniform(names, rnd = random):
+  """ Yields names drawn uniformly at random, forever. """
+  while True:
+    yield names[rnd.randrange(len(names))]
+
+def zipf(names, s = 1.0, rnd = random):
+  """
+  Yields names drawn forever from a Zipf distribution with exponent s:
+  the k-th name is drawn with probability proportional to 1/k**s.
+  """
+  cdf = []
+  total = 0.0
+  for k in range(1, len(names) + 1):
+    total += 1.0 / k ** s
+    cdf.append(total)
+  while True:
+    yield names[min(bisect_left(cdf, rnd.random() * total), len(names) - 1)]
+
+class LoadResult:
+  """
+  Outcome of one LoadGenerator run.
+
+  Member variables:
+
+  _sent, _received, _timeouts -- query counts.
+
+  _late -- replies that matched no outstanding query (typically ones
+  arriving after their query timed out).
+
+  _malformed -- replies that could not be parsed.
+
+  _invalid -- replies whose answers did not match the expected
+  addresses.
+
+  _rcodes -- [rcode --> number of replies].
+
+  _latency -- a Histogram of reply latencies.
+
+  _elapsed -- wall-clock duration of the run, in seconds.
+  """
+
+  def __init__(self):
+    self._sent = self._received = self._timeouts = 0
+    self._late = self._malformed = self._invalid = 0
+    self._rcodes = dict()
+    self._latency = Histogram()
+    self._elapsed = 0.0
+
+  def qps(self):
+    return self._received / self._elapsed if self._elapsed > 0 else 0.0
+
+  def __str__(self):
+    l = ["sent %d, received %d, timeouts %d, late %d, malformed %d, invalid %d" %
+         (self._sent, self._received, self._timeouts, self._late,
+          self._malformed, self._invalid),
+         "%.1f replies/s over %.2fs" % (self.qps(), self._elapsed),
+         "latency ms: mean %.2f p50 %.2f p99 %.2f p999 %.2f max %.2f" %
+         tuple([v * 1000 for v in (self._latency.mean(),
+                                   self._latency.percentile(50),
+                                   self._latency.percentile(99),
+                                   self._latency.percentile(99.9),
+                                   self._latency._max)]),
+         "rcodes: %s" % (", ".join(["%d=%d" % kv for kv in
+                                    sorted(self._rcodes.items())]),)]
+    return "\n".join(l)
+
+class LoadGenerator:
+  """
+  Sends queries for the names yielded by a name source to a server.
+
+  Member variables:
+
+  _serveraddr -- the (address, port) of the server under test.
+
+  _qtype -- the QE type of queries whose source gives none.
+
+  _rate -- target queries per second, or 0 to send as fast as the
+  outstanding limit allows.
+
+  _outstanding -- the maximum number of queries awaiting a reply.
+
+  _timeout -- seconds after which an unanswered query is given up.
+
+  _expected -- optional [lowercase name --> expected addresses]; a
+  reply for such a name whose answer resolves to none of them counts as
+  invalid.
+  """
+
+  def __init__(self, serveraddr, qtype = QE.TYPE_A, rate = 0,
+               outstanding = 1000, timeout = 5.0, expected = None):
+    self._serveraddr = serveraddr
+    self._qtype = qtype
+    self._rate = rate
+    self._outstanding = min(outstanding, MAX_OUTSTANDING)
+    self._timeout = timeout
+    self._expected = expected
+    self._nextid = random.randrange(MAX_OUTSTANDING)
+    self._cache = dict() # (name, qtype) --> packed question section
+
+  def _question(self, name, qtype):
+    q = self._cache.get((name, qtype))
+    if q is None:
+      if len(self._cache) > 100000:
+        self._cache.clear()
+      q = self._cache[(name, qtype)] = QE(qtype, DomainName(name)).pack()
+    return q
+
+  def run(self, source, count = None, duration = None):
+    """
+    Send queries for the names yielded by source until it is
+    exhausted, count queries have been sent or duration seconds have
+    passed, then wait for the outstanding replies.  Returns a
+    LoadResult.
+
+    source may also yield tuples (due, name, qtype) to replay a
+    schedule: each such query is sent no earlier than due seconds after
+    the start of the run (as soon as possible if due is None), with
+    the given qtype.
+    """
+    result = LoadResult()
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.setsockopt(SOL_SOCKET, SO_RCVBUF, 1 << 22)
+    sock.setblocking(0)
+    pending = dict()  # id --> (send time, name)
+    order = deque()   # (send time, id), oldest first
+    start = time.time()
+    stop = start + duration if duration else None
+    exhausted = False
+    held = None       # the next (due, name, qtype) to send
+    while True:
+      now = time.time()
+      nextsend = None
+      # Send as many queries as the rate and outstanding limit allow.
+      while not exhausted and len(pending) < self._outstanding:
+        if count is not None and result._sent >= count or \
+           stop is not None and now >= stop:
+          exhausted = True
+          break
+        if self._rate and start + result._sent / float(self._rate) > now:
+          nextsend = start + result._sent / float(self._rate)
+          break
+        if held is None:
+          try:
+            held = source.next()
+          except StopIteration:
+            exhausted = True
+            break
+          if not isinstance(held, tuple):
+            held = (None, held, self._qtype)
+        (due, name, qtype) = held
+        if due is not None and start + due > now:
+          nextsend = start + due
+          break
+        id = self._nextid
+        while id in pending:
+          id = (id + 1) % MAX_OUTSTANDING
+        packet = struct.pack(">6H", id, 0x0100, 1, 0, 0, 0) + \
+                 self._question(name, qtype)
+        try:
+          sock.sendto(packet, self._serveraddr)
+        except error, e:
+          if e.errno in (errno.EAGAIN, errno.ENOBUFS):
+            break
+          raise
+        self._nextid = (id + 1) % MAX_OUTSTANDING
+        held = None
+        pending[id] = (now, name)
+        order.append((now, id))
+        result._sent += 1
+
+      # Give up on queries that have waited too long.
+      while order and order[0][0] + self._timeout <= now:
+        (t0, id) = order.popleft()
+        if id in pending and pending[id][0] == t0:
+          del pending[id]
+          result._timeouts += 1
+
+      if exhausted and not pending:
+        break
+
+      wait = order[0][0] + self._timeout - now if order else self._timeout
+      if nextsend is not None:
+        wait = min(wait, nextsend - now)
+      rds, wds, xds = select([sock], [], [], max(0.0, wait))
+      if rds:
+        self._receive(sock, pending, result)
+
+    result._elapsed = time.time() - start
+    sock.close()
+    return result
+
+  def _receive(self, sock, pending, result):
+    """ Read and account for every reply waiting on sock. """
+    while True:
+      try:
+        data = sock.recv(4096)
+      except error, e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return
+        raise
+      now = time.time()
+      if len(data) < 12:
+        result._malformed += 1
+        continue
+      (id,) = struct.unpack_from(">H", data)
+      entry = pending.pop(id, None)
+      if entry is None:
+        result._late += 1
+        continue
+      (t0, name) = entry
+      result._received += 1
+      result._latency.record(now - t0)
+      rcode = ord(data[3]) & 0xF
+      result._rcodes[rcode] = result._rcodes.get(rcode, 0) + 1
+      if self._expected is not None and name.lower() in self._expected:
+        try:
+          (rcode, address_dict, cname_dict, authns_dict, glueaddr_dict) = \
+            parse_reply(data)
+        except (struct.error, IndexError):
+          result._malformed += 1
+          continue
+        addrs = final_addresses(name if name.endswith(".") else name + ".",
+                                address_dict, cname_dict)
+        if not set(addrs) & set(self._expected[name.lower()]):
+          result._invalid += 1
+
+def main(argv):
+  parser = OptionParser(usage="%prog [options] PORT [NAMEFILE]")
+  parser.add_option("-s", "--server", default="127.0.0.1",
+                    help="server address (default: %default)")
+  parser.add_option("-r", "--rate", type="float", default=0,
+                    help="queries per second (default: as fast as possible)")
+  parser.add_option("-o", "--outstanding", type="int", default=1000,
+                    help="maximum queries in flight (default: %default)")
+  parser.add_option("-n", "--count", type="int", help="number of queries to send")
+  parser.add_option("-d", "--duration", type="float", help="seconds to run for")
+  parser.add_option("-z", "--zipf", type="float", metavar="S",
+                    help="draw names from a Zipf distribution with exponent S")
+  parser.add_option("-u", "--uniform", action="store_true",
+                    help="draw names uniformly at random")
+  parser.add_option("-t", "--timeout", type="float", default=5.0)
+  (options, args) = parser.parse_args(argv)
+  if not args:
+    parser.error("need the server port")
+
+  f = open(args[1]) if len(args) > 1 else sys.stdin
+  names = [line.split()[0] for line in f if line.strip()]
+  if options.zipf:
+    source = zipf(names, options.zipf)
+  elif options.uniform:
+    source = uniform(names)
+  else:
+    source = sequence(names)
+  if options.count is None and options.duration is None and \
+     (options.zipf or options.uniform):
+    options.count = len(names)
+
+  gen = LoadGenerator((options.server, int(args[0])), rate=options.rate,
+                      outstanding=options.outstanding, timeout=options.timeout)
+  print gen.run(source, options.count, options.duration)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+"""
+Replay a recorded query trace against a DNS server.
+
+Usage: python -m gz01.testlib.replay [options] TRACE
+
+TRACE is a query log written by ncsdns.py --capture, or a pcap file.
+Queries are sent with their recorded spacing divided by --speed (or as
+fast as possible with --speed 0), either to a live server given with
+--port, or to a fresh ncsdns.py resolving against a stand-in hierarchy
+built from the trace's names (--standin).
+"""
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from itertools import islice
+from optparse import OptionParser
+from socket import socket, AF_INET, SOCK_STREAM
+import sys
+
+from gz01.metrics import scrape
+from gz01.querylog import MAGIC, read_querylog, read_pcap
+from gz01.testlib.bench import start_resolver, stop_resolver, SERVERPATH
+from gz01.testlib.loadgen import LoadGenerator
+from gz01.testlib.standin import hierarchy_for_names
+
+def read_trace(path, limit = None):
+  """ Yields the (timestamp, client, port, name, qtype) records of the
+  query log or pcap file at path, at most limit of them. """
+  f = open(path, "rb")
+  magic = f.read(len(MAGIC))
+  f.close()
+  records = read_querylog(path) if magic == MAGIC else read_pcap(path)
+  return islice(records, limit)
+
+def schedule(records, speed):
+  """
+  Yields a LoadGenerator schedule (due, name, qtype) for records,
+  compressing the recorded inter-arrival times by speed; speed 0 sends
+  every query as soon as possible.
+  """
+  t0 = None
+  for (timestamp, client, port, name, qtype) in records:
+    if t0 is None:
+      t0 = timestamp
+    yield ((timestamp - t0) / speed if speed else None, name, qtype)
+
+def replay(path, serveraddr, speed = 1.0, outstanding = 1000, timeout = 5.0,
+           limit = None):
+  """ Replay the trace at path against serveraddr; returns a
+  LoadResult. """
+  gen = LoadGenerator(serveraddr, outstanding=outstanding, timeout=timeout)
+  return gen.run(schedule(read_trace(path, limit), speed))
+
+def server_counts(url):
+  """ Returns (cache hits, client queries answered, upstream queries)
+  from the server metrics at url. """
+  samples = dict(scrape(url))
+  return (samples.get('ncsdns_query_duration_seconds_count{cache="hit"}', 0),
+          samples.get('ncsdns_query_duration_seconds_count{cache="hit"}', 0) +
+          samples.get('ncsdns_query_duration_seconds_count{cache="miss"}', 0),
+          samples.get('ncsdns_upstream_queries_total', 0))
+
+def report(result, hitthreshold, upstream = None, counts = None,
+           out = sys.stdout):
+  """
+  Print result.  If counts, the difference between server_counts before
+  and after the replay, is given, the hit ratio and the upstream
+  queries the server counted come from it; otherwise the hit ratio is
+  estimated from latencies.  upstream is the number of queries the
+  stand-in servers received, if they were used.  Each upstream count
+  is printed with where it came from, and its absence is reported.
+  """
+  out.write("%s\n" % (result,))
+  if counts is not None:
+    (hits, answered, upstreamcounted) = counts
+    out.write("hit ratio: %.3f (%d of %d answered from cache)\n" %
+              (hits / answered if answered else float('nan'), hits, answered))
+  else:
+    out.write("estimated hit ratio: %.3f (replies within %.2fms)\n" %
+              (result._latency.fractionBelow(hitthreshold), hitthreshold * 1000))
+  sources = []
+  if counts is not None:
+    sources.append(("server metrics", upstreamcounted))
+  if upstream is not None:
+    sources.append(("stand-in servers", upstream))
+  for (source, n) in sources:
+    out.write("upstream queries (%s): %d, %.2f per client query\n" %
+              (source, n, n / float(result._sent) if result._sent
+               else float('nan')))
+  if not sources:
+    out.write("upstream queries: not measured; give --metrics to count them\n")
+
+def counts_delta(before, after):
+  return tuple([a - b for (a, b) in zip(after, before)])
+
+def main(argv):
+  parser = OptionParser(usage="%prog [options] TRACE")
+  parser.add_option("-s", "--server", default="127.0.0.1",
+                    help="address of a live server (default: %default)")
+  parser.add_option("-p", "--port", type="int", help="port of a live server")
+  parser.add_option("--standin", action="store_true",
+                    help="replay against ncsdns.py and a stand-in hierarchy")
+  parser.add_option("--serverpath", default=SERVERPATH,
+                    help="server script to run with --standin")
+  parser.add_option("--latency", type="float", default=0.0,
+                    help="seconds added to every stand-in server reply")
+  parser.add_option("-x", "--speed", type="float", default=1.0,
+                    help="replay speed-up factor; 0 for maximum speed")
+  parser.add_option("-o", "--outstanding", type="int", default=1000)
+  parser.add_option("-t", "--timeout", type="float", default=5.0)
+  parser.add_option("-n", "--limit", type="int", help="replay only the first N queries")
+  parser.add_option("--hit-threshold", dest="hitthreshold", type="float",
+                    default=1.0, metavar="MS",
+                    help="without metrics, count replies faster than MS milliseconds as cache hits")
+  parser.add_option("-m", "--metrics", metavar="URL",
+                    help="metrics URL of the live server, for exact hit and upstream counts")
+  (options, args) = parser.parse_args(argv)
+  if len(args) != 1 or (options.port is None) == (not options.standin):
+    parser.error("need a TRACE and exactly one of --port or --standin")
+
+  if not options.standin:
+    before = server_counts(options.metrics) if options.metrics else None
+    result = replay(args[0], (options.server, options.port), options.speed,
+                    options.outstanding, options.timeout, options.limit)
+    counts = None
+    if options.metrics:
+      counts = counts_delta(before, server_counts(options.metrics))
+    report(result, options.hitthreshold / 1000.0, counts=counts)
+    return 0
+
+  names = (name for (ts, client, port, name, qtype)
+           in read_trace(args[0], options.limit))
+  hierarchy = hierarchy_for_names(names, latency=options.latency)
+  hierarchy.start()
+  s = socket(AF_INET, SOCK_STREAM)
+  s.bind(("127.0.0.1", 0))
+  metricsport = s.getsockname()[1]
+  s.close()
+  url = "http://127.0.0.1:%d/metrics" % (metricsport,)
+  try:
+    (server, serverport, workdir) = start_resolver(hierarchy, options.serverpath,
+      ["--metrics-port", str(metricsport)])
+    try:
+      before = server_counts(url)
+      result = replay(args[0], ("127.0.0.1", serverport), options.speed,
+                      options.outstanding, options.timeout, options.limit)
+      counts = counts_delta(before, server_counts(url))
+    finally:
+      stop_resolver(server, workdir)
+  finally:
+    hierarchy.stop()
+  report(result, options.hitthreshold / 1000.0, hierarchy.queries(), counts)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
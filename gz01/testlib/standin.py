@@ -0,0 +1,444 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Stand-in root, TLD and authoritative name servers on loopback. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import heapq, random, struct, time
+from select import select
+from socket import *
+from threading import Thread
+
+from gz01.dnslib.Header import Header
+from gz01.dnslib.QE import QE
+from gz01.dnslib.RR import *
+from gz01.inetlib.types import DomainName
+
+# All stand-in servers of a hierarchy listen on the same port, each on
+# its own loopback address, so that the resolver under test only needs
+# to be told the root's address and that port.
+ROOT_ADDR = "127.0.1.1"
+
+# The address of the one stand-in server a hierarchy may have that is
+# reached over IPv6 only.
+IPV6_ADDR = "::1"
+
+GLUE_TYPES = (RR.TYPE_A, RR.TYPE_AAAA)
+
+class Zone:
+  """
+  Authoritative data for one zone.
+
+  Member variables:
+
+  _origin -- the DomainName at the apex of the zone.
+
+  _records -- [domain name key --> list of RRs owned by that name].
+  NS records owned by a name below the origin are delegations (zone
+  cuts); A and AAAA records for the targets of those NS records are
+  glue.
+  """
+
+  def __init__(self, origin):
+    self._origin = DomainName(origin)
+    self._records = dict()
+    self.add(RR_SOA(self._origin, 3600, DomainName("ns." + origin),
+                    DomainName("hostmaster." + origin), 1, 3600, 600,
+                    86400, 300))
+
+  def add(self, rr):
+    """ Add a resource record to the zone. """
+    self._records.setdefault(rr._dn._key, []).append(rr)
+
+  def addA(self, name, addr, ttl = 3600):
+    self.add(RR_A(DomainName(name), ttl, inet_aton(addr)))
+
+  def addAAAA(self, name, addr, ttl = 3600):
+    self.add(RR_AAAA(DomainName(name), ttl, inet_pton(AF_INET6, addr)))
+
+  def addNS(self, name, nsname, ttl = 86400):
+    self.add(RR_NS(DomainName(name), ttl, DomainName(nsname)))
+
+  def addCNAME(self, name, target, ttl = 3600):
+    self.add(RR_CNAME(DomainName(name), ttl, DomainName(target)))
+
+  def lookup(self, question):
+    """
+    Returns a tuple (rcode, aa, answers, authority, additional)
+    answering question from this zone's data.
+    """
+    qkey = question._dn._key
+    # Look for a zone cut between the origin and the question name:
+    key = qkey
+    while key != self._origin._key:
+      cut = [rr for rr in self._records.get(key, []) if rr._type == RR.TYPE_NS]
+      if cut:
+        glue = []
+        for ns in cut:
+          glue.extend([rr for rr in self._records.get(ns._nsdn._key, [])
+                       if rr._type in GLUE_TYPES])
+        return (Header.RCODE_NOERR, False, [], cut, glue)
+      key = DomainName.parentKey(key)
+
+    rrs = self._records.get(qkey)
+    soa = [rr for rr in self._records[self._origin._key]
+           if rr._type == RR.TYPE_SOA]
+    if rrs is None:
+      empty = [k for k in self._records if k.endswith(qkey)]
+      if empty:
+        return (Header.RCODE_NOERR, True, [], soa, [])
+      return (Header.RCODE_NAMEERR, True, [], soa, [])
+    answers = [rr for rr in rrs if rr._type == question._type]
+    if not answers:
+      answers = [rr for rr in rrs if rr._type == RR.TYPE_CNAME]
+    if not answers:
+      return (Header.RCODE_NOERR, True, [], soa, [])
+    additional = []
+    for rr in answers:
+      if rr._type == RR.TYPE_NS:
+        additional.extend([a for a in self._records.get(rr._nsdn._key, [])
+                           if a._type in GLUE_TYPES])
+    return (Header.RCODE_NOERR, True, answers, [], additional)
+
+class StandinServer(Thread):
+  """
+  A UDP name server answering authoritatively for a set of zones, with
+  optional injected latency and packet loss.
+
+  Member variables:
+
+  _addr -- the (address, port) this server listens on, over IPv6 if
+  the address is an IPv6 one.
+
+  _zones -- the Zones this server is authoritative for.
+
+  _latency -- seconds to hold every reply for before sending it.
+
+  _jitter -- up to this many seconds are added to _latency at random.
+
+  _loss -- probability in [0, 1) that a query is silently dropped.
+
+  _queries -- the number of queries received so far.
+  """
+
+  def __init__(self, addr, port, zones, latency = 0.0, jitter = 0.0,
+               loss = 0.0):
+    Thread.__init__(self)
+    self.daemon = True
+    self._zones = []
+    self._index = dict() # origin key --> Zone
+    for zone in zones:
+      self.addZone(zone)
+    self._latency = latency
+    self._jitter = jitter
+    self._loss = loss
+    self._queries = 0
+    self._dropped = 0
+    self._running = True
+    self._random = random.Random(hash((addr, port)))
+    self._sock = socket(AF_INET6 if ":" in addr else AF_INET, SOCK_DGRAM)
+    self._sock.bind((addr, port))
+    self._addr = self._sock.getsockname()[:2]
+
+  def addZone(self, zone):
+    self._zones.append(zone)
+    self._index[zone._origin._key] = zone
+
+  def zoneFor(self, dn):
+    """ Returns the closest enclosing zone served here, or None. """
+    key = dn._key
+    while key is not None:
+      zone = self._index.get(key)
+      if zone is not None:
+        return zone
+      key = DomainName.parentKey(key)
+    return None
+
+  def reply(self, data):
+    """ Returns the packed reply to the packed query data. """
+    header = Header.fromData(data)
+    question = QE.fromData(data, len(header))
+    zone = self.zoneFor(question._dn)
+    if zone is None:
+      (rcode, aa, answers, authority, additional) = \
+        (Header.RCODE_REFUSED, False, [], [], [])
+    else:
+      (rcode, aa, answers, authority, additional) = zone.lookup(question)
+    l = [Header(header._id, Header.OPCODE_QUERY, rcode, qdcount=1,
+                ancount=len(answers), nscount=len(authority),
+                arcount=len(additional), qr=True, aa=aa,
+                rd=header._rd).pack(), question.pack()]
+    for rr in answers + authority + additional:
+      l.append(rr.pack())
+    return "".join(l)
+
+  def run(self):
+    pending = [] # heap of (send time, reply, client address)
+    while self._running:
+      timeout = 0.05
+      if pending:
+        timeout = max(0.0, min(timeout, pending[0][0] - time.time()))
+      rds, wds, xds = select([self._sock], [], [], timeout)
+      if rds:
+        try:
+          (data, address) = self._sock.recvfrom(512)
+        except error:
+          continue
+        self._queries += 1
+        if self._random.random() < self._loss:
+          self._dropped += 1
+          continue
+        try:
+          reply = self.reply(data)
+        except struct.error:
+          continue
+        delay = self._latency + self._random.random() * self._jitter
+        if delay > 0:
+          heapq.heappush(pending, (time.time() + delay, reply, address))
+        else:
+          self._sock.sendto(reply, address)
+      now = time.time()
+      while pending and pending[0][0] <= now:
+        (when, reply, address) = heapq.heappop(pending)
+        self._sock.sendto(reply, address)
+    self._sock.close()
+
+  def stop(self):
+    self._running = False
+    self.join()
+
+class Hierarchy:
+  """
+  A set of stand-in servers making up a DNS tree rooted at a stand-in
+  root server on ROOT_ADDR.
+
+  Member variables:
+
+  _port -- the port every server of the hierarchy listens on.
+
+  _servers -- the StandinServers, root first.
+
+  _names -- [(hostname, [expected addresses])] for every resolvable
+  name in the hierarchy, CNAME chain heads included.
+  """
+
+  def __init__(self, port = 0):
+    self._port = port if port else free_port()
+    self._servers = []
+    self._names = []
+
+  def addServer(self, addr, zones, **kwargs):
+    """ Create a stand-in server for zones on addr; the keyword
+    arguments are passed on to StandinServer. """
+    server = StandinServer(addr, self._port, zones, **kwargs)
+    self._servers.append(server)
+    return server
+
+  def start(self):
+    for server in self._servers:
+      server.start()
+
+  def stop(self):
+    for server in self._servers:
+      server.stop()
+
+  def queries(self):
+    """ Returns the total number of queries the servers received. """
+    return sum([s._queries for s in self._servers])
+
+def free_port(addrs = (ROOT_ADDR, "127.0.2.1", "127.0.3.1")):
+  """ Returns a UDP port that is currently unused on all of addrs. """
+  while True:
+    s = socket(AF_INET6 if ":" in addrs[0] else AF_INET, SOCK_DGRAM)
+    s.bind((addrs[0], 0))
+    port = s.getsockname()[1]
+    socks = [s]
+    try:
+      for addr in addrs[1:]:
+        t = socket(AF_INET6 if ":" in addr else AF_INET, SOCK_DGRAM)
+        socks.append(t)
+        t.bind((addr, port))
+    except error:
+      continue
+    finally:
+      for t in socks:
+        t.close()
+    return port
+
+def build_hierarchy(ntlds = 2, ndomains = 10, nhosts = 5, nchains = 2,
+                    chainlength = 2, glueless = 0.0, latency = 0.0,
+                    jitter = 0.0, loss = 0.0, port = 0, seed = 0,
+                    ipv6 = False):
+  """
+  Build (but do not start) a synthetic Hierarchy: one root server,
+  one server per TLD and one server per second-level domain.
+
+  ntlds -- number of TLDs, named tld0., tld1., ...
+  ndomains -- number of domains per TLD, named d0.tld0., ...
+  nhosts -- number of A records per domain, named h0.d0.tld0., ...
+  nchains -- number of CNAME chains per domain.
+  chainlength -- number of CNAMEs in each chain.  Successive links
+    live in different domains, so each one needs a fresh resolution.
+  glueless -- fraction of domains delegated to a name server whose
+    address is not given as glue.
+  latency, jitter, loss -- injected into every server (see
+    StandinServer).
+  ipv6 -- serve tld0. from IPV6_ADDR, with only AAAA glue, so that the
+    names below it can only be resolved over IPv6.
+  """
+  rnd = random.Random(seed)
+  if ipv6 and not port:
+    port = free_port((ROOT_ADDR, "127.0.2.1", "127.0.3.1", IPV6_ADDR))
+  h = Hierarchy(port)
+  opts = dict(latency=latency, jitter=jitter, loss=loss)
+
+  root = Zone(".")
+  root.addNS(".", "f.root-servers.net.")
+  root.addA("f.root-servers.net.", ROOT_ADDR)
+  h.addServer(ROOT_ADDR, [root], **opts)
+
+  domains = []
+  for t in range(ntlds):
+    tld = "tld%d." % (t,)
+    tldaddr = "127.0.2.%d" % (t + 1,)
+    root.addNS(tld, "ns.nic." + tld)
+    tldzone = Zone(tld)
+    tldzone.addNS(tld, "ns.nic." + tld)
+    if ipv6 and t == 0:
+      tldaddr = IPV6_ADDR
+      root.addAAAA("ns.nic." + tld, tldaddr)
+      tldzone.addAAAA("ns.nic." + tld, tldaddr)
+    else:
+      root.addA("ns.nic." + tld, tldaddr)
+      tldzone.addA("ns.nic." + tld, tldaddr)
+    h.addServer(tldaddr, [tldzone], **opts)
+    for d in range(ndomains):
+      domains.append(("d%d.%s" % (d, tld), tldzone))
+
+  for (i, (domain, tldzone)) in enumerate(domains):
+    addr = "127.0.%d.%d" % (3 + i // 250, 1 + i % 250)
+    zone = Zone(domain)
+    nsname = "ns." + domain
+    zone.addA(nsname, addr)
+    if i > 0 and rnd.random() < glueless:
+      # Delegate to an out-of-bailiwick name served by the first
+      # domain's server, which then needs resolving on its own.
+      nsname = "ns%d.%s" % (i, domains[0][0])
+      h._servers[1 + ntlds]._zones[0].addA(nsname, addr)
+    else:
+      tldzone.addA(nsname, addr)
+    zone.addNS(domain, nsname)
+    tldzone.addNS(domain, nsname)
+    for n in range(nhosts):
+      host = "h%d.%s" % (n, domain)
+      hostaddr = "10.%d.%d.%d" % (i // 250, i % 250, n + 1)
+      zone.addA(host, hostaddr)
+      h._names.append((host, [hostaddr]))
+    h.addServer(addr, [zone], **opts)
+
+  # CNAME chains hop across domains and end at an existing host.
+  for (i, (domain, tldzone)) in enumerate(domains):
+    zone = h._servers[1 + ntlds + i]._zones[0]
+    for c in range(nchains):
+      target = h._names[rnd.randrange(len(h._names))]
+      name = "c%d.%s" % (c, domain)
+      head = name
+      for link in range(chainlength - 1):
+        (nextdomain, nexttld) = domains[rnd.randrange(len(domains))]
+        nextname = "c%d-%d-%d.%s" % (i, c, link, nextdomain)
+        zone.addCNAME(name, nextname)
+        zone = h._servers[1 + ntlds + domains.index((nextdomain, nexttld))]._zones[0]
+        name = nextname
+      zone.addCNAME(name, target[0])
+      zone = h._servers[1 + ntlds + i]._zones[0]
+      h._names.append((head, target[1]))
+
+  return h
+
+def loopback_addresses():
+  """ Yields the stand-in server addresses 127.0.2.1, 127.0.2.2, ...
+  in order, skipping those ending in .0 and .255. """
+  for b in range(2, 256):
+    for c in range(0, 256):
+      for d in range(1, 255):
+        yield "127.%d.%d.%d" % (b, c, d)
+
+def hierarchy_for_names(names, latency = 0.0, jitter = 0.0, loss = 0.0,
+                        port = 0, nservers = 64):
+  """
+  Build (but do not start) a Hierarchy in which every name of names
+  resolves, e.g. to replay a production trace offline.  Each name gets
+  an A record in the zone of its last two labels, delegated to from a
+  zone for its TLD.  TLD zones and second-level zones are spread over
+  at most nservers servers each, so that large traces do not need a
+  thread per zone.
+  """
+  h = Hierarchy(port)
+  opts = dict(latency=latency, jitter=jitter, loss=loss)
+  addrs = loopback_addresses()
+  tldservers = []
+  domainservers = []
+
+  def place(zone, pool):
+    """ Add zone to a server of pool, returning the server's address. """
+    if len(pool) < nservers:
+      pool.append(h.addServer(addrs.next(), [], **opts))
+    server = pool[hash(zone._origin._key) % len(pool)]
+    server.addZone(zone)
+    return server._addr[0]
+
+  root = Zone(".")
+  root.addNS(".", "f.root-servers.net.")
+  root.addA("f.root-servers.net.", ROOT_ADDR)
+  h.addServer(ROOT_ADDR, [root], **opts)
+
+  tlds = dict()     # tld --> Zone
+  domains = dict()  # domain --> Zone
+  seen = set()
+  for name in names:
+    labels = [l.lower() for l in name.rstrip(".").split(".") if l]
+    fqdn = ".".join(labels) + "."
+    if len(labels) < 2 or fqdn in seen:
+      continue
+    seen.add(fqdn)
+    tld = labels[-1] + "."
+    domain = ".".join(labels[-2:]) + "."
+    if tld not in tlds:
+      tlds[tld] = Zone(tld)
+      addr = place(tlds[tld], tldservers)
+      tlds[tld].addNS(tld, "ns.nic." + tld)
+      tlds[tld].addA("ns.nic." + tld, addr)
+      root.addNS(tld, "ns.nic." + tld)
+      root.addA("ns.nic." + tld, addr)
+    if domain not in domains:
+      zone = domains[domain] = Zone(domain)
+      addr = place(zone, domainservers)
+      # A name server name unlikely to clash with names in the trace:
+      nsname = "ns-standin." + domain
+      zone.addNS(domain, nsname)
+      zone.addA(nsname, addr)
+      tlds[tld].addNS(domain, nsname)
+      tlds[tld].addA(nsname, addr)
+    n = len(h._names)
+    hostaddr = "10.%d.%d.%d" % (n >> 16 & 0xFF, n >> 8 & 0xFF, n & 0xFF)
+    domains[domain].addA(fqdn, hostaddr)
+    h._names.append((fqdn, [hostaddr]))
+  return h
@@ -0,0 +1,181 @@
+# Copyright (C) 2026 The Local DNS Server contributors
+
+""" Per-query resolution traces, for finding where slow queries spend
+their time. """
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT.  IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json, logging, logging.handlers, random, time
+
+from gz01.util import AsyncLogHandler
+
+class Trace:
+  """
+  The spans recorded while answering one client query.  A span is a
+  dict with at least 'kind', 'depth' (nesting level below the query)
+  and 'start' and 'ms' (offset from the start of the query and
+  duration, both in milliseconds); further keys depend on the kind.
+
+  Member variables:
+
+  _detailed -- whether cheap operations such as cache lookups are
+  recorded as well as upstream exchanges and resolution steps.
+
+  _spans -- the spans, in the order they were begun.
+
+  _upstream -- the number of upstream exchanges so far.
+  """
+
+  def __init__(self, attrs, detailed):
+    self._attrs = attrs
+    self._detailed = detailed
+    self._start = time.time()
+    self._spans = []
+    self._depth = 0
+    self._upstream = 0
+
+  def begin(self, kind, **attrs):
+    """ Open a span nested inside any open spans and return it. """
+    attrs['kind'] = kind
+    attrs['depth'] = self._depth
+    attrs['start'] = time.time()
+    self._spans.append(attrs)
+    self._depth += 1
+    return attrs
+
+  def end(self, span, **attrs):
+    """ Close span, adding attrs to it. """
+    self._depth -= 1
+    span.update(attrs)
+    span['ms'] = (time.time() - span['start']) * 1000
+
+  def upstream(self, start, **attrs):
+    """ Record an upstream exchange that began at time start. """
+    self._upstream += 1
+    attrs['kind'] = "upstream"
+    attrs['depth'] = self._depth
+    attrs['start'] = start
+    attrs['ms'] = (time.time() - start) * 1000
+    self._spans.append(attrs)
+
+  def duration(self):
+    """ Returns the time since the query started, in seconds. """
+    return time.time() - self._start
+
+  def record(self):
+    """ Returns this trace as a JSON-serializable dict. """
+    d = dict(self._attrs)
+    d['time'] = self._start
+    d['ms'] = self.duration() * 1000
+    d['upstream'] = self._upstream
+    d['spans'] = []
+    for span in self._spans:
+      span = dict(span)
+      span['start'] = round((span['start'] - self._start) * 1000, 3)
+      span['ms'] = round(span.get('ms', -1), 3)
+      d['spans'].append(span)
+    return d
+
+class Tracer:
+  """
+  Traces client queries and writes the ones slower than a threshold
+  as JSON lines to a log file.
+
+  Member variables:
+
+  _threshold -- seconds; queries taking at least this long are
+  written out.
+
+  _sample -- the fraction of queries traced in detail (see
+  Trace._detailed).  Resolution steps and upstream exchanges, which
+  are costly anyway, are recorded for every query.
+
+  _maxrate -- the most slow-query records written per second; excess
+  ones are counted in _suppressed.
+
+  current -- the Trace of the query being answered, or None.
+  """
+
+  def __init__(self, threshold, sample = 0.01, maxrate = 100,
+               path = "./ncsdns.trace"):
+    self._threshold = threshold
+    self._sample = sample
+    self._maxrate = maxrate
+    self._second = 0
+    self._written = 0
+    self._suppressed = 0
+    self.current = None
+    self._log = logging.getLogger("ncsdns.trace")
+    self._log.propagate = False
+    self._log.setLevel(logging.INFO)
+    fh = logging.handlers.RotatingFileHandler(path, 'a', 10000000, 5)
+    fh.setFormatter(logging.Formatter("%(message)s"))
+    self._handler = AsyncLogHandler(fh)
+    self._log.addHandler(self._handler)
+
+  def start(self, **attrs):
+    """ Begin tracing a client query described by attrs. """
+    self.current = Trace(attrs, random.random() < self._sample)
+    return self.current
+
+  def finish(self, **attrs):
+    """ Finish the current trace, writing it out if it was slow. """
+    trace = self.current
+    self.current = None
+    if trace is None or trace.duration() < self._threshold:
+      return
+    second = int(time.time())
+    if second != self._second:
+      self._second = second
+      self._written = 0
+    if self._written >= self._maxrate:
+      self._suppressed += 1
+      return
+    self._written += 1
+    trace._attrs.update(attrs)
+    self._log.info("%s", json.dumps(trace.record(), sort_keys=True))
+
+# The Tracer of this process, if tracing is enabled.
+tracer = None
+
+def traced(kind, describe = None, detailed = False):
+  """
+  Decorator recording each call of the decorated function as a span of
+  the given kind in the current trace, if there is one.
+
+  describe -- optional function taking the decorated function's
+  arguments and returning a dict of attributes for the span.
+  detailed -- if True, only record the span in detailed traces.
+  """
+  def decorate(f):
+    def wrapper(*args, **kwargs):
+      trace = tracer.current if tracer is not None else None
+      if trace is None or detailed and not trace._detailed:
+        return f(*args, **kwargs)
+      span = trace.begin(kind, **(describe(*args, **kwargs) if describe else {}))
+      try:
+        return f(*args, **kwargs)
+      finally:
+        trace.end(span)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+  return decorate
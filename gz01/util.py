@@ -23,17 +23,163 @@
 # SOFTWARE.
 
 import logging, logging.handlers
-import signal, sys
+import signal, sys, threading
+from Queue import Queue, Full
 
 DEBUG1 = 9
 DEBUG2 = 8
 logfile = "./ncsdns.log"
 
+# Optional file of "loggername LEVEL" lines giving per-module
+# verbosity; it is read at startup and re-read on SIGHUP.
+loglevelsfile = "./ncsdns.loglevels"
+
+# Maximum number of records buffered for the background log writer.
+# Records logged while the buffer is full are dropped and counted.
+LOG_QUEUE_SIZE = 10000
+
+# Put on the queue by AsyncLogHandler.flush(), so that the writer
+# knows every record queued before it has been written, and by close(),
+# so that it stops.
+_FLUSHED = object()
+_STOPPED = object()
+
 logging.addLevelName(DEBUG1, "DEBUG1")
 logging.addLevelName(DEBUG2, "DEBUG2")
 
+class AsyncLogHandler(logging.Handler):
+  """
+  A log handler that never does I/O on the thread that logs.  Records
+  are put on a bounded queue that a background thread drains into a
+  target handler.
+
+  Member variables:
+
+  _target -- the handler that records are eventually written to.
+
+  _dropped -- the number of records discarded because the queue was
+  full.
+
+  _written -- the number of records passed on to _target.
+
+  _rollover -- whether the target is to be rolled over once the
+  records queued so far have been written.
+  """
+
+  def __init__(self, target, maxsize = LOG_QUEUE_SIZE):
+    logging.Handler.__init__(self)
+    self._target = target
+    self._queue = Queue(maxsize)
+    self._dropped = 0
+    self._reported = 0
+    self._written = 0
+    self._rollover = False
+    self._thread = threading.Thread(target=self._run, name="logwriter")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def emit(self, record):
+    if record.exc_info:
+      # Tracebacks cannot be formatted once the frame is gone.
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+      record.exc_info = None
+    try:
+      self._queue.put_nowait(record)
+    except Full:
+      self._dropped += 1
+
+  def _run(self):
+    while True:
+      record = self._queue.get()
+      try:
+        if record is _STOPPED:
+          return
+        if record is _FLUSHED:
+          if self._rollover:
+            self._rollover = False
+            self._target.doRollover()
+          continue
+        if self._dropped != self._reported:
+          dropped = self._dropped
+          self._target.handle(logging.makeLogRecord({
+            'levelno': logging.WARNING, 'levelname': "WARNING",
+            'msg': "log writer fell behind; %d records dropped so far",
+            'args': (dropped,)}))
+          self._reported = dropped
+        self._target.handle(record)
+        self._written += 1
+      finally:
+        self._queue.task_done()
+
+  def flush(self):
+    """ Block until every queued record has been written, and the
+    target rolled over if rollover() was called. """
+    if self._thread.is_alive():
+      self._queue.put(_FLUSHED)
+      self._queue.join()
+    self._target.flush()
+
+  def rollover(self):
+    """
+    Have the target rolled over at the next flush(), after the records
+    queued before it.  Safe to call from a signal handler: it takes no
+    lock, as the thread interrupted may hold the queue's.
+    """
+    self._rollover = True
+
+  def close(self):
+    """ Write what is queued, then stop the writer and close the
+    target. """
+    self.flush()
+    if self._thread.is_alive():
+      self._queue.put(_STOPPED)
+      self._thread.join()
+    self._target.close()
+    logging.Handler.close(self)
+
+def set_log_level(name, level):
+  """
+  Set the verbosity of the logger called name at runtime.  Modules
+  log to loggers named after themselves (e.g. "gz01.dnslib.RR");
+  "root" names the root logger, whose level is inherited by every
+  logger that has no level of its own.
+
+  level -- a level number or name, e.g. "INFO" or "DEBUG2".  "NOTSET"
+  reverts a module logger to the root logger's level.
+  """
+  if isinstance(level, basestring):
+    level = logging.getLevelName(level.upper())
+    if not isinstance(level, int):
+      raise ValueError("unknown log level %r" % (level,))
+  logging.getLogger(None if name == "root" else name).setLevel(level)
+
+def load_log_levels(path = loglevelsfile):
+  """
+  Apply the per-module verbosity settings in the file at path, if it
+  exists.  Each non-blank line not starting with '#' holds a logger
+  name and a level name.
+  """
+  try:
+    f = open(path)
+  except IOError:
+    return
+  for line in f:
+    line = line.strip()
+    if not line or line.startswith("#"):
+      continue
+    try:
+      (name, level) = line.split()
+      set_log_level(name, level)
+    except ValueError:
+      logger.warning("%s: ignoring bad line %r", path, line)
+  f.close()
+
+# The root logger's level gates every module logger without a level of
+# its own, so messages below it cost a single comparison.  Raise the
+# verbosity of individual modules with set_log_level or the
+# loglevelsfile rather than by lowering this.
 logger = logging.getLogger()
-logger.setLevel(DEBUG2) # do not alter
+logger.setLevel(logging.INFO)
 
 # Create console handler and set level.  You may configure the
 # following call to ch.setLevel in order to alter the verbosity of
@@ -43,22 +189,52 @@ ch.setLevel(logging.INFO)
 chformatter = logging.Formatter("%(levelname)-7s: %(message)s")
 ch.setFormatter(chformatter)
 
-# Create file handler and set verbosity level.  You may configure the
-# following call to fh.setLevel in order to alter the verbosity of
-# messages output to the log file.
-fh = logging.handlers.RotatingFileHandler(logfile, 'a', 2000000, 5)
-fh.setLevel(DEBUG2)
-fhformatter = logging.Formatter("%(message)s")
-fh.setFormatter(fhformatter)
-
 logger.addHandler(ch)
-logger.addHandler(fh)
 
-def signal_handler(signal, frame):
-  fh.doRollover()
+# The handler of the log file, and its writer thread, once
+# start_logging() has been called; only the server logs to a file, so
+# that tools importing gz01 neither write one nor start a thread.
+afh = None
+
+# Set by the SIGHUP handler, and acted on by poll_signals().
+_reloadLevels = False
+
+def start_logging(path = logfile):
+  """
+  Log to the file at path as well as to the console, apply the
+  loglevelsfile, and handle SIGINT and SIGHUP.  Everything that passes
+  the logger levels is written to the file from a background thread
+  (see AsyncLogHandler), which is stopped by logging.shutdown() at
+  exit.  Returns the AsyncLogHandler.
+  """
+  global afh
+  fh = logging.handlers.RotatingFileHandler(path, 'a', 2000000, 5)
+  fh.setFormatter(logging.Formatter("%(message)s"))
+  afh = AsyncLogHandler(fh)
+  logger.addHandler(afh)
+  load_log_levels()
+  signal.signal(signal.SIGINT, signal_handler)
+  signal.signal(signal.SIGHUP, sighup_handler)
+  return afh
+
+# Signal handlers only note what is asked of them: anything that logs
+# or waits on the log writer can deadlock with the code they interrupt.
+# The log is flushed, and rolled over, by logging.shutdown() at exit.
+def signal_handler(signum, frame):
+  afh.rollover()
   sys.exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
+def sighup_handler(signum, frame):
+  global _reloadLevels
+  _reloadLevels = True
+
+def poll_signals():
+  """ Carry out what signals have asked for since the last call; the
+  server's loop calls this every iteration. """
+  global _reloadLevels
+  if _reloadLevels:
+    _reloadLevels = False
+    load_log_levels()
 
 FILTER=''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
 